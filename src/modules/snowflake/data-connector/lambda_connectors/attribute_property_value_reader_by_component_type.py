@@ -0,0 +1,159 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import os
+from collections import OrderedDict
+from utils import udqw_constants
+from utils.connection_utils import SNOWFLAKE_CONNECTION_MANAGER
+from utils.param_parser import UDQWParamsParser
+from utils.result_cache import ResultCache
+
+# Maximum number of elem_ids in the IN list of one query, larger requests are split into several queries
+ATTRIBUTE_QUERY_MAX_ELEMENTS = int(os.environ.get('ATTRIBUTE_QUERY_MAX_ELEMENTS', '1000'))
+
+# Configure logger
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Attribute values by (table, elem_id, property name), kept across invocations of a warm container.
+# Attribute rows rarely change, a changed value shows up once its cached copy expires
+ATTRIBUTE_CACHE_TTL_SECONDS = int(os.environ.get('ATTRIBUTE_CACHE_TTL_SECONDS', '300'))
+ATTRIBUTE_CACHE = ResultCache(
+    max_bytes=int(os.environ.get('ATTRIBUTE_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+    ttl_seconds=ATTRIBUTE_CACHE_TTL_SECONDS,
+    recent_ttl_seconds=ATTRIBUTE_CACHE_TTL_SECONDS,
+    immutable_after_seconds=0
+)
+
+# ---------------------------------------------------------------------------
+#   Sample implementation of an AWS IoT TwinMaker UDQ Connector against Snowflake
+#   queries static values of multiple properties of many entities sharing the same component type
+# ---------------------------------------------------------------------------
+
+
+def lambda_handler(event, context):
+    """
+    Query attribute values of the selected properties of many entities, one query per attribute table.
+    The request lists the entities in 'entities', each with the entityId, componentName and the properties
+    holding its elem_id and, optionally, its attributePropertyTableName.
+    The connector returns the property values of every entity, in the format of AttributePropertyValueReaderByEntity.
+    """
+
+    # 1. Parse input parameter
+    param_parser = UDQWParamsParser(event)
+
+    default_table_name = param_parser.get_attribute_property_table_name()
+    selected_properties = param_parser.get_selected_properties()
+    entities = param_parser.get_entities()
+    if not entities:
+        raise Exception('Required key[{}] is missing'.format(udqw_constants.ENTITIES))
+
+    # 2. Get selected property definitions
+    property_descriptors = param_parser.get_property_descriptors()
+
+    # 3. Group the elem_ids of the entities by table
+    entity_elements = []
+    elem_ids_by_table = OrderedDict()
+    for entity in entities:
+        entity_parser = UDQWParamsParser(entity)
+        table_name = entity_parser.get_attribute_property_table_name() or default_table_name
+        element_id = entity_parser.get_element_id()
+        entity_elements.append((entity_parser.get_entity_id(), entity_parser.get_component_name(), table_name,
+                                element_id))
+        elem_ids_by_table.setdefault(table_name, OrderedDict())[element_id] = None
+
+    # 4. Query the attribute rows missing from the cache
+    cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
+    try:
+        attribute_values = {}
+        for table_name in elem_ids_by_table:
+            attribute_values[table_name] = query_attribute_values(cursor, table_name,
+                                                                  list(elem_ids_by_table[table_name]),
+                                                                  selected_properties)
+    except Exception as e:
+        SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+        raise e
+    finally:
+        cursor.close()
+    LOGGER.info('attribute cache: %s', ATTRIBUTE_CACHE.stats())
+
+    # 5. Generate response
+    entity_property_values = []
+    for (entity_id, component_name, table_name, element_id) in entity_elements:
+        property_values = {}
+        row = attribute_values[table_name].get(element_id)
+        if row is not None:
+            for property_name in selected_properties:
+                if property_name not in row:
+                    continue
+                property_values[property_name] = {
+                    'propertyReference': {
+                        'propertyName': property_name,
+                        'entityId': entity_id,
+                        'componentName': component_name
+                    },
+                    'propertyValue': {
+                        property_descriptors[property_name].require_value_type(): row[property_name]
+                    }
+                }
+        entity_property_values.append({
+            'entityId': entity_id,
+            'componentName': component_name,
+            'propertyValues': property_values
+        })
+
+    return {
+        'entities': entity_property_values
+    }
+
+
+def query_attribute_values(cursor, table_name, elem_ids, selected_properties):
+    """
+    Return {elem_id: {property name: value}} of the elements that have a row in the table.
+    Cached values are reused, the other elements are queried with all their missing properties.
+    """
+    rows = {}
+    missing_elem_ids = []
+    missing_properties = OrderedDict()
+    for elem_id in elem_ids:
+        row = {}
+        for property_name in selected_properties:
+            value = ATTRIBUTE_CACHE.get((table_name, elem_id, property_name))
+            if value is None:
+                missing_properties[property_name] = None
+            else:
+                row[property_name] = value[0]
+        if row:
+            rows[elem_id] = row
+        if len(row) < len(selected_properties):
+            missing_elem_ids.append(elem_id)
+
+    if not missing_elem_ids:
+        return rows
+
+    query_properties = list(missing_properties)
+    for start in range(0, len(missing_elem_ids), ATTRIBUTE_QUERY_MAX_ELEMENTS):
+        chunk = missing_elem_ids[start: start + ATTRIBUTE_QUERY_MAX_ELEMENTS]
+        wrapped_properties = ['identifier(?)' for property_name in query_properties]
+        query_statement = 'select elem_id, {} from identifier(?) where elem_id in ({})'.format(
+            ', '.join(wrapped_properties), ', '.join(['?'] * len(chunk)))
+        parameters = query_properties + [table_name] + chunk
+        LOGGER.info('query statement: %s', query_statement)
+        LOGGER.info('parameters: %s, Table: %s, elements: %s', ', '.join(query_properties), table_name, len(chunk))
+
+        cursor.execute(query_statement, parameters)
+        queried_elem_ids = set()
+        for record in cursor.fetchall():
+            elem_id = record[0]
+            if elem_id in queried_elem_ids:
+                raise ValueError('Greater than 1 rows is not supported for elem_id {}!'.format(elem_id))
+            queried_elem_ids.add(elem_id)
+
+            row = rows.setdefault(elem_id, {})
+            for (property_name, value) in zip(query_properties, record[1:]):
+                row[property_name] = value
+                # values are wrapped, so a NULL attribute is cached too
+                ATTRIBUTE_CACHE.put((table_name, elem_id, property_name), [value], ATTRIBUTE_CACHE_TTL_SECONDS)
+
+    return rows
@@ -2,25 +2,13 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import logging
-from utils import udqw_constants
-from utils.connection_utils import connect_snowflake
+from utils.connection_utils import SNOWFLAKE_CONNECTION_MANAGER
 from utils.param_parser import UDQWParamsParser
 
-VALUE_TYPE_DATA_TYPE_MAPPING = {
-    'DOUBLE': 'doubleValue',
-    'LONG': 'longValue',
-    'INTEGER': 'intValue',
-    'STRING': 'stringValue',
-    'BOOLEAN': 'booleanValue'
-}
-
 # Configure logger
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-# Connect to Snowflake
-SNOWFLAKE_CONNECTION = connect_snowflake()
-
 # ---------------------------------------------------------------------------
 #   Sample implementation of an AWS IoT TwinMaker UDQ Connector against Snowflake
 #   queries static values of multiple properties within a single component
@@ -42,13 +30,9 @@ def lambda_handler(event, context):
     component_name = param_parser.get_component_name()
     selected_properties = param_parser.get_selected_properties()
     element_id = param_parser.get_element_id()
-    properties = param_parser.get_properties()
 
     # 2. Get selected property definitions
-    property_definitions = {}
-    for property_name in selected_properties:
-        property_type = properties[property_name][udqw_constants.PROPERTY_DEFINITION][udqw_constants.PROPERTY_DATA_TYPE][udqw_constants.PROPERTY_TYPE]
-        property_definitions[property_name] = property_type
+    property_descriptors = param_parser.get_property_descriptors()
 
     # 3. Generate query statement
     wrapped_properties = ['identifier(?)' for property in selected_properties]
@@ -58,7 +42,7 @@ def lambda_handler(event, context):
     LOGGER.info('parameters: %s, Table: %s, element_id: %s', ', '.join(selected_properties), table_name, element_id)
 
     # 4. Query Snowflake and fetch result
-    cursor = SNOWFLAKE_CONNECTION.cursor()
+    cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
     property_values = {}
     try:
         cursor.execute(query_statement, parameters)
@@ -74,9 +58,12 @@ def lambda_handler(event, context):
                         'componentName': component_name
                     },
                     'propertyValue': {
-                        VALUE_TYPE_DATA_TYPE_MAPPING[property_definitions[property_name]]: row[i]
+                        property_descriptors[property_name].require_value_type(): row[i]
                     }
                 }
+    except Exception as e:
+        SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+        raise e
     finally:
         cursor.close()
 
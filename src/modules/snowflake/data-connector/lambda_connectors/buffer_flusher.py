@@ -0,0 +1,157 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import os
+import time
+from collections import OrderedDict
+import data_writer
+from utils import parse_timestamp, udqw_constants
+from utils.write_buffer import create_dead_letter_buffer, create_write_buffer, message_key
+
+# A flush runs once the buffer holds FLUSH_MIN_ENTRIES entries, or every FLUSH_MAX_AGE_SECONDS, whichever comes first.
+# Entries wait up to FLUSH_MAX_AGE_SECONDS plus FLUSH_SCHEDULE_SECONDS, the rate of the flush schedule
+FLUSH_MIN_ENTRIES = int(os.environ.get('FLUSH_MIN_ENTRIES', '1000'))
+FLUSH_MAX_AGE_SECONDS = int(os.environ.get('FLUSH_MAX_AGE_SECONDS', '60'))
+FLUSH_SCHEDULE_SECONDS = int(os.environ.get('FLUSH_SCHEDULE_SECONDS', '60'))
+# Entries loaded per flush, the rest stays buffered for the next one so the warehouse load is bounded
+FLUSH_MAX_ENTRIES = int(os.environ.get('FLUSH_MAX_ENTRIES', '2000'))
+# Values that failed to load this many times are moved to the dead-letter buffer instead of the write buffer
+FLUSH_MAX_ATTEMPTS = int(os.environ.get('FLUSH_MAX_ATTEMPTS', '5'))
+
+# Configure logger
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# the writer's buffer when both functions run in the same process, fails at startup without a queue
+WRITE_BUFFER = data_writer.WRITE_BUFFER or create_write_buffer()
+# without it, messages with values that failed to load are released and left to the redrive policy of the queue
+DEAD_LETTER_BUFFER = create_dead_letter_buffer()
+
+# ---------------------------------------------------------------------------
+#   Scheduled flush of the write buffer of the UDW Connector
+#   loads the buffered entries into Snowflake in large batches
+# ---------------------------------------------------------------------------
+
+
+def lambda_handler(event, context):
+    # messages are only received by flushes that load them, every receive counts towards the maxReceiveCount of the
+    # redrive policy of the queue
+    if not is_flush_due(event):
+        return {
+            'flushedEntries': 0
+        }
+
+    messages = WRITE_BUFFER.receive(FLUSH_MAX_ENTRIES)
+    if not messages:
+        return {
+            'flushedEntries': 0
+        }
+
+    receipts = [message.receipt for message in messages]
+    entries, properties, entry_messages = coalesce_messages(messages)
+    # a failure here leaves the messages in the buffer, they are received again once their visibility timeout expires.
+    # The values of a message received again may already be loaded, by an earlier flush that failed on other values
+    # or stopped before deleting the message, the writer skips the values already in their table. One flush runs
+    # at a time, no other flush loads the same values between the lookup and the load
+    error_entries = data_writer.write_entries(entries, properties, skip_loaded_rows=True)
+
+    # only the values that failed to load are buffered again, in a new message counting the failed attempts.
+    # The messages are deleted after the new ones are sent, a failure in between leaves both in the buffer
+    retry_bodies = list()
+    dead_letter_bodies = list()
+    released_receipts = set()
+    for error_entry in error_entries:
+        for error in error_entry['errors']:
+            LOGGER.error('Failed to load buffered entry: %s', error)
+            error_entry_messages = entry_messages[error[udqw_constants.ENTRY][udqw_constants.ENTRY_ID]]
+            if DEAD_LETTER_BUFFER is None:
+                # the queue moves the messages to its dead-letter queue once they were received too many times
+                released_receipts.update(message.receipt for message in error_entry_messages)
+                continue
+            body = retry_message_body(error_entry_messages, error[udqw_constants.ENTRY][udqw_constants.PROPERTY_VALUES])
+            if body['attempts'] >= FLUSH_MAX_ATTEMPTS:
+                dead_letter_bodies.append(body)
+            else:
+                retry_bodies.append(body)
+    WRITE_BUFFER.put(retry_bodies)
+    if dead_letter_bodies:
+        DEAD_LETTER_BUFFER.put(dead_letter_bodies)
+    WRITE_BUFFER.release([receipt for receipt in receipts if receipt in released_receipts])
+    WRITE_BUFFER.delete([receipt for receipt in receipts if receipt not in released_receipts])
+
+    LOGGER.info('Flushed %s entries from %s buffered messages, %s entries buffered again and %s moved to the '
+                'dead-letter buffer after errors, %s messages released', len(entries), len(messages),
+                len(retry_bodies), len(dead_letter_bodies), len(released_receipts))
+    return {
+        'flushedEntries': len(entries),
+        'errorEntries': len(error_entries)
+    }
+
+
+def is_flush_due(event):
+    """
+    Whether the buffer holds FLUSH_MIN_ENTRIES entries, or holds any and the scheduled time of the invocation is the
+    first one of a FLUSH_MAX_AGE_SECONDS interval. SQS only tells the age of a message by receiving it, so the age
+    of the buffered entries is bounded by flushing at every interval instead
+    """
+    depth = WRITE_BUFFER.approximate_depth()
+    if depth >= FLUSH_MIN_ENTRIES:
+        return True
+    if depth == 0:
+        return False
+
+    # the time of a scheduled event is its scheduled time, a direct invocation uses the current time
+    scheduled_time = parse_timestamp(event['time']).timestamp() if event and 'time' in event else time.time()
+    if scheduled_time % FLUSH_MAX_AGE_SECONDS < FLUSH_SCHEDULE_SECONDS:
+        return True
+
+    LOGGER.info('Buffer holds about %s entries, not flushing', depth)
+    return False
+
+
+def coalesce_messages(messages):
+    """
+    Merge the buffered messages into one write request. The buffer delivers a message at least once, the messages
+    sharing a message key are one entry whose property values are deduplicated on their timestamp.
+    Entries of different messages are never merged, each gets an entry id unique in the request.
+    Returns the entries, the property definitions and the messages of every entry id.
+    """
+    entries = OrderedDict()
+    # message key -> timestamp -> property value
+    property_values = OrderedDict()
+    properties = dict()
+    key_messages = dict()
+    for message in messages:
+        entry = message.body['entry']
+        key = message_key(message.body)
+        entries[key] = entry
+        key_messages.setdefault(key, list()).append(message)
+        entry_property_values = property_values.setdefault(key, OrderedDict())
+        for property_value in entry[udqw_constants.PROPERTY_VALUES]:
+            entry_property_values[property_value[udqw_constants.TIMESTAMP]] = property_value
+
+        for entity_id in message.body['properties']:
+            properties.setdefault(entity_id, dict()).update(message.body['properties'][entity_id])
+
+    coalesced_entries = list()
+    entry_messages = dict()
+    for key in entries:
+        entry = dict(entries[key])
+        entry[udqw_constants.ENTRY_ID] = '{}:{}'.format(key[0], key[1])
+        entry[udqw_constants.PROPERTY_VALUES] = list(property_values[key].values())
+        coalesced_entries.append(entry)
+        entry_messages[entry[udqw_constants.ENTRY_ID]] = key_messages[key]
+    return coalesced_entries, properties, entry_messages
+
+
+def retry_message_body(messages, property_values):
+    """
+    Message of the property values of an entry that failed to load, with the same message key as the messages
+    of the entry and one more failed attempt than any of them
+    """
+    body = dict(messages[0].body)
+    body['entry'] = dict(body['entry'])
+    body['entry'][udqw_constants.PROPERTY_VALUES] = property_values
+    body['attempts'] = max(message.body.get('attempts', 0) for message in messages) + 1
+    return body
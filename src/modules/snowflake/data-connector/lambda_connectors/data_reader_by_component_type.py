@@ -1,21 +1,29 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
-import json
 import logging
-from datetime import datetime, timezone
-from utils import parse_next_token, udqw_constants
-from utils.connection_utils import connect_snowflake
+import os
+from utils import generate_next_token, parse_next_token, udqw_constants
+from utils.columnar import fetch_rows
+from utils.connection_utils import SNOWFLAKE_CONNECTION_MANAGER
 from utils.param_parser import UDQWParamsParser
 from utils.param_validator import UDQParamsValidator
+from utils.partition_predicate import generate_partition_predicate, parse_partition_columns
+from utils.response_budget import NEXT_TOKEN_BYTES_PER_PROPERTY, RESPONSE_MAX_BYTES, ResponseBudget
+from utils.result_cache import result_cache_from_environment
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-# Establish Snowflake connection
-SNOWFLAKE_CONNECTION = connect_snowflake()
+# Query results of historical time windows, kept across invocations of a warm container
+RESULT_CACHE = result_cache_from_environment()
 
 DEFAULT_ALARM_TABLE = 'TEST_ALARMS'
+# YEAR,MONTH,DAY partition columns of the alarm table, derived from EVENT_TIME. Queries add a redundant predicate
+# on them when set, the default alarm table has none
+ALARM_PARTITION_COLUMNS = parse_partition_columns(os.environ.get('ALARM_PARTITION_COLUMNS', ''))
+# orders the events of an alarm sharing the same EVENT_TIME, after ALARM_ID
+ALARM_TIE_BREAKER_EXPRESSION = 'HASH(STATUS)'
 
 # ---------------------------------------------------------------------------
 #   Sample implementation of an AWS IoT TwinMaker UDQ Connector against Snowflake
@@ -25,26 +33,32 @@ DEFAULT_ALARM_TABLE = 'TEST_ALARMS'
 def post_process(dict_values, entity_id=None, component_name=None, selected_properties=None):
     result = {'propertyValues': []}
     for key in dict_values:
-        entry = {}
-        if entity_id and component_name:
-            entry['entityPropertyReference'] = {
-                'entityId': entity_id,
-                'componentName': component_name,
-                'propertyName': selected_properties[0]
-            }
-        else:
-            entry['entityPropertyReference'] = {
-                'externalIdProperty': {
-                    'alarm_key': key
-                },
-                'propertyName': selected_properties[0]
-            }
+        entry = generate_property_value_entry(key, entity_id, component_name, selected_properties)
         entry['values'] = dict_values[key] or []
         result['propertyValues'].append(entry)
 
     return result
 
 
+def generate_property_value_entry(key, entity_id, component_name, selected_properties):
+    entry = {}
+    if entity_id and component_name:
+        entry['entityPropertyReference'] = {
+            'entityId': entity_id,
+            'componentName': component_name,
+            'propertyName': selected_properties[0]
+        }
+    else:
+        entry['entityPropertyReference'] = {
+            'externalIdProperty': {
+                'alarm_key': key
+            },
+            'propertyName': selected_properties[0]
+        }
+    entry['values'] = []
+    return entry
+
+
 def lambda_handler(event, context):
     LOGGER.info('Event: %s', event)
 
@@ -72,88 +86,168 @@ def lambda_handler(event, context):
     alarm_id = param_parser.get_alarm_id()
     table = param_parser.get_table_name() or DEFAULT_ALARM_TABLE
 
+    # the alarm status filter matches the latest status of an alarm within the requested time range,
+    # which must not move while paging through the range
+    request_start_time = start_time
+    request_end_time = end_time
+
     # last_date_time_operator is constructed in the local, with ['<', '<='] only
     last_date_time_operator = '<='  # handle the 1-off case when orderBy == DESC
+    # (ALARM_ID, status hash) of the last event returned, orders the events sharing its EVENT_TIME
+    last_tie_breaker = None
 
     if next_token and len(next_token) >= 1:
         if udqw_constants.FILTER_ALARM_PROPERTY_NAME not in next_token:
             raise Exception("Invalid token {}".format(next_token))
 
-        pagination_token = next_token[udqw_constants.FILTER_ALARM_PROPERTY_NAME]
+        (pagination_token, last_tie_breaker) = next_token[udqw_constants.FILTER_ALARM_PROPERTY_NAME]
         if order_by == udqw_constants.ORDER_BY_ASC:
             start_time = pagination_token
         else:
             end_time = pagination_token
             last_date_time_operator = '<'
 
-    if alarm_id:
-        query_string = ("SELECT ALARM_ID, EVENT_TIME, identifier(?) FROM identifier(?) " \
-                + " WHERE ALARM_ID=? AND EVENT_TIME > ? AND EVENT_TIME {} ? " \
-                + " ORDER BY EVENT_TIME {} LIMIT ? ;") \
-                .format(last_date_time_operator, udqw_constants.getOrderByWord(order_by))
-
-        query_params = [
-            selected_properties[0], 
-            table,
-            alarm_id,
-            start_time,
-            end_time,
-            max_results
-        ]
-    elif alarm_status_filter:
-        query_string = ("SELECT ALARM_ID, EVENT_TIME, identifier(?) FROM " \
-                + " (SELECT ALARM_ID, EVENT_TIME, identifier(?), FIRST_VALUE(identifier(?)) OVER (PARTITION BY ALARM_ID ORDER BY EVENT_TIME DESC) last_status " \
-                + " FROM identifier(?) WHERE EVENT_TIME > ? AND EVENT_TIME {} ? ORDER BY EVENT_TIME {} LIMIT ?) "  \
-                + " WHERE last_status=?;").format(last_date_time_operator, udqw_constants.getOrderByWord(order_by))
-
-        query_params = [
+    (event_time_predicate, event_time_params) = generate_event_time_predicate(
+        start_time, end_time, last_date_time_operator, order_by, parse_tie_breaker(last_tie_breaker))
+    order_by_word = udqw_constants.getOrderByWord(order_by)
+
+    # the inner query reads the events of the page, the outer one seeks past the last event returned
+    if alarm_status_filter:
+        # keep the events of alarms whose latest status matches first, then page over them,
+        # so every page holds up to max_results matching events
+        (request_partition_predicate, request_partition_params) = generate_partition_predicate(
+            request_start_time, request_end_time, ALARM_PARTITION_COLUMNS)
+        events_query = ("SELECT ALARM_ID, EVENT_TIME, identifier(?) STATUS FROM identifier(?) " \
+                + " WHERE {}EVENT_TIME > ? AND EVENT_TIME <= ? {}" \
+                + " QUALIFY FIRST_VALUE(identifier(?)) OVER (PARTITION BY ALARM_ID ORDER BY EVENT_TIME DESC) = ?") \
+                .format('ALARM_ID=? AND ' if alarm_id else '',
+                        'AND {} '.format(request_partition_predicate) if request_partition_predicate else '')
+
+        events_params = [
             selected_properties[0],
-            selected_properties[0], 
+            table
+        ] + ([alarm_id] if alarm_id else []) + [
+            request_start_time,
+            request_end_time
+        ] + request_partition_params + [
             selected_properties[0],
-            table,
-            start_time,
-            end_time,
-            max_results,
             alarm_status_filter
         ]
     else:
-        query_string = ("SELECT ALARM_ID, EVENT_TIME, identifier(?) FROM identifier(?)" \
-                + " WHERE EVENT_TIME > ? AND EVENT_TIME {} ? ORDER BY EVENT_TIME {} LIMIT ?;") \
-                .format(last_date_time_operator, udqw_constants.getOrderByWord(order_by)) 
-
-        query_params = [
-            selected_properties[0], 
-            table,
-            start_time,
-            end_time,
-            max_results 
-        ]
+        # the events at the EVENT_TIME of the last event returned are kept for the seek of the outer query
+        events_predicates = ["EVENT_TIME >= ? AND EVENT_TIME <= ?"]
+        events_params = [selected_properties[0], table, start_time, end_time]
+        if alarm_id:
+            events_predicates.insert(0, "ALARM_ID=?")
+            events_params.insert(2, alarm_id)
+        (partition_predicate, partition_params) = generate_partition_predicate(start_time, end_time,
+                                                                               ALARM_PARTITION_COLUMNS)
+        if partition_predicate is not None:
+            events_predicates.append(partition_predicate)
+            events_params.extend(partition_params)
+        events_query = "SELECT ALARM_ID, EVENT_TIME, identifier(?) STATUS FROM identifier(?) WHERE {}".format(
+            ' AND '.join(events_predicates))
+
+    query_string = ("SELECT ALARM_ID, EVENT_TIME, STATUS, {} FROM ({}) " \
+            + " WHERE {} ORDER BY EVENT_TIME {}, ALARM_ID {}, {} {} LIMIT ?;") \
+            .format(ALARM_TIE_BREAKER_EXPRESSION, events_query, event_time_predicate, order_by_word, order_by_word,
+                    ALARM_TIE_BREAKER_EXPRESSION, order_by_word)
+    query_params = events_params + event_time_params + [max_results]
 
     LOGGER.info("Query string is %s", query_string)
+
+    cache_key = (query_string, tuple(query_params))
+    cache_ttl = RESULT_CACHE.ttl_for_window(end_time)
+    cached_result = RESULT_CACHE.get(cache_key) if cache_ttl > 0 else None
+    if cached_result is not None:
+        (rows, count, last_key) = cached_result
+    else:
+        (rows, count, last_key) = query_alarm_values(query_string, query_params)
+        RESULT_CACHE.put(cache_key, (rows, count, last_key), cache_ttl)
+    LOGGER.info('result cache: %s', RESULT_CACHE.stats())
+
+    # the response stops at the last event that fits in RESPONSE_MAX_BYTES, and the next page continues after it
+    budget = ResponseBudget(RESPONSE_MAX_BYTES, NEXT_TOKEN_BYTES_PER_PROPERTY)
     values = {}
+    for (alarm_id, current_event, tie_breaker) in rows:
+        if alarm_id not in values:
+            budget.add_always(generate_property_value_entry(alarm_id, entity_id, component_name, selected_properties))
+        if not budget.add(current_event):
+            LOGGER.info('Response reached %s bytes after %s of %s events', RESPONSE_MAX_BYTES, budget.items,
+                        len(rows))
+            break
+        values.setdefault(alarm_id, []).append(current_event)
+        included_key = (current_event['time'], tie_breaker)
+    if budget.exceeded:
+        last_key = included_key
+
+    result = post_process(values, entity_id, component_name, selected_properties)
 
-    last_timestamp = None
+    if count == max_results or budget.exceeded:
+        result['nextToken'] = generate_next_token({
+            udqw_constants.FILTER_ALARM_PROPERTY_NAME: last_key
+        })
+
+    return result
+
+
+def query_alarm_values(query_string, query_params):
+    """
+    Returns the (alarm id, event, tie-breaker) rows in query order, their count and the key of the last row
+    """
+    rows = []
+
+    last_key = None
     count = 0
     try:
-        cursor = SNOWFLAKE_CONNECTION.cursor()
-        for (alarm_id, event_time, status) in cursor.execute(query_string, query_params):
-            if alarm_id not in values:
-                values[alarm_id] = []
-            current_event = {'time': event_time.replace(tzinfo=timezone.utc).isoformat(), 'value': {'stringValue': status}}
-            values[alarm_id].append(current_event)
-            last_timestamp = current_event['time']
+        cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
+        for (alarm_id, event_time, status, status_hash) in fetch_rows(cursor.execute(query_string, query_params), 1):
+            current_event = {'time': event_time, 'value': {'stringValue': status}}
+            tie_breaker = [alarm_id, status_hash]
+            rows.append((alarm_id, current_event, tie_breaker))
+            last_key = (current_event['time'], tie_breaker)
             count += 1
     except Exception as e:
         LOGGER.error("Query exception: %s", e)
+        SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
         raise e
     finally:
         cursor.close()
 
-    result = post_process(values, entity_id, component_name, selected_properties)
-
-    if count == max_results:
-        result['nextToken'] = json.dumps({
-            udqw_constants.FILTER_ALARM_PROPERTY_NAME: last_timestamp
-        })
-
-    return result
+    return (rows, count, last_key)
+
+
+def parse_tie_breaker(tie_breaker):
+    """
+    (ALARM_ID, status hash) of a next token tie-breaker. Tokens written before the status hash only hold the ALARM_ID.
+    """
+    if tie_breaker is None:
+        return None
+    if isinstance(tie_breaker, list):
+        return (tie_breaker[0], tie_breaker[1])
+    return (tie_breaker, None)
+
+
+def generate_event_time_predicate(start_time, end_time, last_date_time_operator, order_by, last_tie_breaker):
+    """
+    EVENT_TIME range of the current page. A page resuming from a next token seeks past the
+    (EVENT_TIME, ALARM_ID, status hash) of the last event returned, so events sharing an EVENT_TIME, of different
+    alarms or of the same alarm, are neither skipped nor returned twice.
+    Events of an alarm sharing EVENT_TIME and status tie, only one of them is returned when a page ends between them.
+    """
+    if last_tie_breaker is None:
+        return ("EVENT_TIME > ? AND EVENT_TIME {} ?".format(last_date_time_operator), [start_time, end_time])
+
+    (last_alarm_id, last_status_hash) = last_tie_breaker
+    comparison = '>' if order_by == udqw_constants.ORDER_BY_ASC else '<'
+    if last_status_hash is None:
+        (tie_predicate, tie_params) = ("ALARM_ID {} ?".format(comparison), [last_alarm_id])
+    else:
+        (tie_predicate, tie_params) = ("(ALARM_ID {} ? OR (ALARM_ID = ? AND {} {} ?))".format(
+            comparison, ALARM_TIE_BREAKER_EXPRESSION, comparison), [last_alarm_id, last_alarm_id, last_status_hash])
+
+    if order_by == udqw_constants.ORDER_BY_ASC:
+        return ("(EVENT_TIME > ? OR (EVENT_TIME = ? AND {})) AND EVENT_TIME {} ?".format(
+            tie_predicate, last_date_time_operator), [start_time, start_time] + tie_params + [end_time])
+    return ("EVENT_TIME > ? AND (EVENT_TIME < ? OR (EVENT_TIME = ? AND {}))".format(tie_predicate),
+            [start_time, end_time, end_time] + tie_params)
@@ -1,29 +1,65 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
-import json
 import logging
-from datetime import datetime, timezone
-from utils import parse_next_token
-from utils.connection_utils import connect_snowflake
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from utils import generate_next_token, parse_next_token, parse_timestamp, udqw_constants
+from utils.columnar import fetch_rows
+from utils.connection_utils import SNOWFLAKE_CONNECTION_MANAGER
+from utils.latest_values import generate_latest_timestamp_query_statement, latest_value_table_name
 from utils.param_parser import UDQWParamsParser
+from utils.partition_predicate import generate_partition_predicate, parse_partition_columns
+from utils.response_budget import NEXT_TOKEN_BYTES_PER_PROPERTY, RESPONSE_MAX_BYTES, ResponseBudget
+from utils.result_cache import result_cache_from_environment
+from utils.timeseries_batch import BOOLEAN_VALUE_TYPES, STRING_VALUE_TYPES, read_value
 
-VALUE_TYPE_DATA_TYPE_MAPPING = {
-    'DOUBLE': 'doubleValue',
-    'LONG': 'longValue',
-    'INTEGER': 'intValue',
-    'STRING': 'stringValue',
-    'BOOLEAN': 'booleanValue'
-}
 ORDER_BY_ASC = 'ASC'
 ORDER_BY_DESC = 'DESC'
+# position of TS in the select list of the query statements
+TIMESTAMP_COLUMN_INDEX = 2
+# orders the rows of a PT sharing the same TS, so pages can resume right after the last row returned.
+# The time-series tables have no row id, rows of a PT sharing TS and value tie, and only one of them is returned
+# when a page ends between them
+TIE_BREAKER_EXPRESSION = 'HASH(PT_VALUE, PT_VALUE_STR)'
+
+# SINGLE_PROPERTY sends one statement per property, MULTI_PROPERTY fetches every property's page in one statement,
+# CONCURRENT sends the per-property statements in parallel on up to MAX_CONCURRENT_QUERIES cursors
+QUERY_MODE_SINGLE_PROPERTY = 'SINGLE_PROPERTY'
+QUERY_MODE_MULTI_PROPERTY = 'MULTI_PROPERTY'
+QUERY_MODE_CONCURRENT = 'CONCURRENT'
+QUERY_MODE = os.environ.get('QUERY_MODE', QUERY_MODE_MULTI_PROPERTY)
+MAX_CONCURRENT_QUERIES = int(os.environ.get('MAX_CONCURRENT_QUERIES', '8'))
+
+# Aggregation functions applied to PT_VALUE per TIME_SLICE bucket
+AGGREGATION_FUNCTIONS = {
+    'AVG': 'AVG(PT_VALUE)',
+    'MIN': 'MIN(PT_VALUE)',
+    'MAX': 'MAX(PT_VALUE)',
+    'FIRST': 'MIN_BY(PT_VALUE, TS)',
+    'LAST': 'MAX_BY(PT_VALUE, TS)',
+    'COUNT': 'COUNT(PT_VALUE)'
+}
+# Value type of the aggregated points, COUNT gives whole numbers and the other functions numbers of PT_VALUE
+AGGREGATION_VALUE_TYPES = {'COUNT': 'longValue'}
+AGGREGATION_DEFAULT_VALUE_TYPE = 'doubleValue'
+# Candidate bucket widths in seconds when the request only sets a target number of points
+AGGREGATION_BUCKET_WIDTHS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400]
+AGGREGATION_TARGET_POINTS = int(os.environ.get('AGGREGATION_TARGET_POINTS', '1000'))
+
+# Partition columns of the time-series tables, filled by DataWriter from TS. Queries add a redundant predicate
+# on them when enabled, rows written without them would be skipped
+PARTITION_PRUNING_ENABLED = os.environ.get('PARTITION_PRUNING_ENABLED', 'false').lower() == 'true'
+TIMESERIES_PARTITION_COLUMNS = parse_partition_columns('YEAR,MONTH,DAY') if PARTITION_PRUNING_ENABLED else None
 
 # Configure logger
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-# Connect to Snowflake
-SNOWFLAKE_CONNECTION = connect_snowflake()
+# Query results of historical time windows, kept across invocations of a warm container
+RESULT_CACHE = result_cache_from_environment()
 
 # ---------------------------------------------------------------------------
 #   Sample implementation of an AWS IoT TwinMaker UDQ Connector against Snowflake
@@ -46,12 +82,13 @@ def lambda_handler(event, context):
     entity_id = param_parser.get_entity_id()
     component_name = param_parser.get_component_name()
     selected_properties = param_parser.get_selected_properties()
-    properties = param_parser.get_properties()
+    property_descriptors = param_parser.get_property_descriptors()
     start_time = param_parser.get_start_time()
     end_time = param_parser.get_end_time()
     order_by = param_parser.get_order_by()
     max_results = param_parser.get_max_results()
     next_token = param_parser.get_next_token()
+    aggregation = parse_aggregation(param_parser.get_aggregation(), start_time, end_time)
 
     # 2. Get current page query requests
     property_next_tokens = parse_next_token(next_token, selected_properties)
@@ -60,8 +97,9 @@ def lambda_handler(event, context):
     if property_next_tokens is None:
         # query without next token
         for property_name in selected_properties:
-            property_foreign_key = properties[property_name]['definition']['configuration']['PT']
-            property_type = properties[property_name]['definition']['dataType']['type']
+            property_descriptor = property_descriptors[property_name]
+            property_foreign_key = property_descriptor.require_foreign_key()
+            value_type = property_descriptor.require_value_type()
 
             property_query_start_key = None
             if order_by == ORDER_BY_ASC:
@@ -72,66 +110,150 @@ def lambda_handler(event, context):
                 raise ValueError('Invalid order {}'.format(order_by))
 
             current_page_properties[property_foreign_key] = \
-                (property_name, property_foreign_key, property_type, property_query_start_key)
+                (property_name, property_foreign_key, value_type, property_query_start_key, None)
 
     else:
         # query with next token
-        for property_name, last_exclusive_timestamp in property_next_tokens.items():
-            property_foreign_key = properties[property_name]['definition']['configuration']['PT']
-            property_type = properties[property_name]['definition']['dataType']['type']
-            property_query_start_key = last_exclusive_timestamp
+        for property_name, (last_timestamp, last_tie_breaker) in property_next_tokens.items():
+            property_descriptor = property_descriptors[property_name]
+            property_foreign_key = property_descriptor.require_foreign_key()
             current_page_properties[property_foreign_key] = \
-                (property_name, property_foreign_key, property_type, property_query_start_key)
+                (property_name, property_foreign_key, property_descriptor.require_value_type(), last_timestamp,
+                 last_tie_breaker)
 
-    # 3. Generate query statement
-    statements = []
-    for property_tuple in current_page_properties.values():
-        statements.append(
-            generate_single_property_query_statement(table_name, property_tuple, start_time, end_time,
-                                                     order_by, max_results))
-
-    # 4. Query Snowflake
-    cursor = SNOWFLAKE_CONNECTION.cursor()
+    if aggregation is not None:
+        validate_aggregated_properties(current_page_properties.values())
 
+    # 3. Serve historical pages from the warm container cache
     property_values = {}
+    # tie-breaker of every value, the response may stop after any value
+    property_tie_breakers = {}
+    # number of rows read and key of the last row read per property, rows without a value included
+    property_row_counts = {}
+    property_last_keys = {}
     for property_name in selected_properties:
         property_values[property_name] = []
+        property_tie_breakers[property_name] = []
+        property_row_counts[property_name] = 0
 
-    try:
-        for (query, parameters) in statements:
-            for (pt, value, timestamp) in cursor.execute(query, parameters):
-                if pt is not None and value is not None and timestamp is not None:
-                    (property_name, property_foreign_key, property_type, property_query_start_key) = current_page_properties[pt]
-                    value_type = get_value_type(property_type)
-                    property_values[property_name].append({
-                        'time': timestamp.replace(tzinfo=timezone.utc).isoformat(),
-                        'value': {
-                            value_type: value
-                        }
-                    })
-    finally:
-        cursor.close()
+    query_page_properties = {}
+    cache_entries = {}
+    for property_foreign_key, property_tuple in current_page_properties.items():
+        property_name = property_tuple[0]
+        property_query_start_key = property_tuple[3]
+        window_end = end_time if order_by == ORDER_BY_ASC else property_query_start_key
+        cache_ttl = RESULT_CACHE.ttl_for_window(window_end)
+        if cache_ttl > 0:
+            (query, parameters) = generate_query_statement(table_name, [property_tuple], start_time, end_time,
+                                                           order_by, max_results, aggregation)
+            # the same PT read as another value type gives other values
+            cache_key = (query, tuple(parameters), property_tuple[2])
+            cached_page = RESULT_CACHE.get(cache_key)
+            if cached_page is not None:
+                (cached_values, cached_tie_breakers, property_row_counts[property_name],
+                 property_last_keys[property_name]) = cached_page
+                property_values[property_name] = list(cached_values)
+                property_tie_breakers[property_name] = list(cached_tie_breakers)
+                continue
+            cache_entries[property_name] = (cache_key, cache_ttl)
+        query_page_properties[property_foreign_key] = property_tuple
+
+    # 4. Look the latest point of every PT up in the latest value table for latest value requests. Its TS bounds
+    # the scan of the time-series table from below
+    latest_value_request = is_latest_value_request(order_by, max_results, property_next_tokens, aggregation)
+    lower_bounds = {}
+    latest_table_name = latest_value_table_name(table_name)
+    if latest_value_request and latest_table_name is not None and query_page_properties:
+        lower_bounds = query_latest_timestamps(latest_table_name, list(query_page_properties), start_time, end_time)
 
-    # 5. generate response and next token
+    # 5. Generate query statement
+    statements = []
+    # the latest values of many properties always take one QUALIFY statement
+    if (QUERY_MODE == QUERY_MODE_MULTI_PROPERTY or latest_value_request) and len(query_page_properties) > 1:
+        statements.append(
+            generate_query_statement(table_name, list(query_page_properties.values()), start_time, end_time,
+                                     order_by, max_results, aggregation, lower_bounds))
+    else:
+        for property_tuple in query_page_properties.values():
+            statements.append(
+                generate_query_statement(table_name, [property_tuple], start_time, end_time,
+                                         order_by, max_results, aggregation, lower_bounds))
+
+    # 6. Query Snowflake
+    for (pt, value, timestamp, tie_breaker, value_str) in query_rows(statements):
+        if pt is not None and timestamp is not None:
+            property_name = query_page_properties[pt][0]
+            value_type = query_page_properties[pt][2]
+            property_row_counts[property_name] += 1
+            property_last_keys[property_name] = (timestamp, tie_breaker)
+            if aggregation is None:
+                value = read_value(value_type, value, value_str)
+            else:
+                (value_type, value) = read_aggregated_value(aggregation, value)
+            if value is not None:
+                property_values[property_name].append({
+                    'time': timestamp,
+                    'value': {
+                        value_type: value
+                    }
+                })
+                property_tie_breakers[property_name].append(tie_breaker)
+
+    for property_name, (cache_key, cache_ttl) in cache_entries.items():
+        RESULT_CACHE.put(cache_key, (list(property_values[property_name]), list(property_tie_breakers[property_name]),
+                                     property_row_counts[property_name], property_last_keys.get(property_name)),
+                         cache_ttl)
+    LOGGER.info('result cache: %s', RESULT_CACHE.stats())
+
+    # 7. generate response and next token, the response stops at the last value that fits in RESPONSE_MAX_BYTES
     response_values = []
     response_token = {}
+    page_start_keys = {property_tuple[0]: (property_tuple[3], property_tuple[4])
+                       for property_tuple in current_page_properties.values()}
+    budget = ResponseBudget(RESPONSE_MAX_BYTES, sum(NEXT_TOKEN_BYTES_PER_PROPERTY + 2 * len(property_name)
+                                                   for property_name in page_start_keys))
 
     for (property_name, values) in property_values.items():
-        response_values.append({
+        property_value = {
             'entityPropertyReference': {
                 'entityId': entity_id,
                 'componentName': component_name,
                 'propertyName': property_name
             },
-            'values': values
-        })
-        if len(values) == max_results:
-            response_token[property_name] = values[-1]['time']
+            'values': []
+        }
+        budget.add_always(property_value)
+        response_values.append(property_value)
+
+        value_count = 0
+        while value_count < len(values) and budget.add(values[value_count]):
+            value_count += 1
+        property_value['values'] = values[:value_count]
+
+        if value_count < len(values):
+            if value_count == 0:
+                # continue from the start of this page
+                (last_timestamp, last_tie_breaker) = page_start_keys[property_name]
+            else:
+                last_timestamp = values[value_count - 1]['time']
+                last_tie_breaker = property_tie_breakers[property_name][value_count - 1]
+                if aggregation is not None:
+                    last_timestamp = get_next_bucket_start_key(last_timestamp, order_by, aggregation)
+            response_token[property_name] = (last_timestamp, last_tie_breaker)
+        elif property_row_counts[property_name] == max_results:
+            (last_timestamp, last_tie_breaker) = property_last_keys[property_name]
+            if aggregation is not None:
+                last_timestamp = get_next_bucket_start_key(last_timestamp, order_by, aggregation)
+            response_token[property_name] = (last_timestamp, last_tie_breaker)
+
+    if budget.exceeded:
+        LOGGER.info('Response reached %s bytes, returning a next token for %s properties', RESPONSE_MAX_BYTES,
+                    len(response_token))
 
     if len(response_token.keys()) > 0:
         return {
             'propertyValues': response_values,
-            'nextToken': json.dumps(response_token)
+            'nextToken': generate_next_token(response_token)
         }
     else:
         return {
@@ -139,32 +261,288 @@ def lambda_handler(event, context):
         }
 
 
-def generate_single_property_query_statement(table_name, property_tuple, start_time, end_time, order_by, max_results):
+def query_rows(statements, timestamp_column_index=TIMESTAMP_COLUMN_INDEX):
+    """
+    Yield the (PT, PT_VALUE, TS, tie-breaker, PT_VALUE_STR) rows of all statements,
+    with TS formatted as an ISO 8601 UTC string.
+    In CONCURRENT mode the statements run in parallel and the rows are yielded once every statement has finished,
+    in statement order, so the response is the same as running them one after another.
+    """
+    if QUERY_MODE == QUERY_MODE_CONCURRENT and len(statements) > 1:
+        for rows in execute_statements_concurrently(statements):
+            yield from rows
+        return
+
+    cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
+    try:
+        for (query, parameters) in statements:
+            yield from fetch_rows(cursor.execute(query, parameters), timestamp_column_index)
+    except Exception as e:
+        SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+        raise e
+    finally:
+        cursor.close()
+
+
+def is_latest_value_request(order_by, max_results, property_next_tokens, aggregation):
+    """
+    A request of the first page of one descending row per property, i.e. of the latest value of every property
+    """
+    return order_by == ORDER_BY_DESC and max_results == 1 and property_next_tokens is None and aggregation is None
+
+
+def query_latest_timestamps(latest_table_name, property_foreign_keys, start_time, end_time):
+    """
+    Return {PT: TS of its latest point in the latest value table} of the PTs whose point there is within the
+    requested time range. DataWriter merges the table after loading the points, and skips the MERGE on errors,
+    so the table never runs ahead of the time-series table: the newest point of a PT is at or after this TS.
+    """
+    lower_bounds = {}
+    lower_time = parse_timestamp(start_time)
+    upper_time = parse_timestamp(end_time)
+    for (pt, timestamp) in query_rows([generate_latest_timestamp_query_statement(latest_table_name,
+                                                                                 property_foreign_keys)], 1):
+        if lower_time < parse_timestamp(timestamp) < upper_time:
+            lower_bounds[pt] = timestamp
+    return lower_bounds
+
+
+def execute_statements_concurrently(statements):
+    max_workers = max(1, min(MAX_CONCURRENT_QUERIES, len(statements)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(execute_statement, query, parameters) for (query, parameters) in statements]
+
+        results = []
+        first_exception = None
+        for (query, parameters), future in zip(statements, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                LOGGER.error('Query exception for parameters %s: %s', parameters, e)
+                if first_exception is None:
+                    first_exception = e
+                    # statements that have not started yet are no longer needed
+                    for pending_future in futures:
+                        pending_future.cancel()
+
+    if first_exception is not None:
+        raise first_exception
+    return results
+
+
+def execute_statement(query, parameters):
+    # each worker uses its own cursor, cursors of the same connection can run in parallel
+    cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
+    try:
+        return list(fetch_rows(cursor.execute(query, parameters), TIMESTAMP_COLUMN_INDEX))
+    except Exception as e:
+        SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+        raise e
+    finally:
+        cursor.close()
+
+
+def generate_query_statement(table_name, property_tuples, start_time, end_time, order_by, max_results, aggregation,
+                             lower_bounds=None):
+    """
+    lower_bounds optionally maps PTs to an inclusive lower bound of the TS of their rows, see query_latest_timestamps
+    """
+    if aggregation is not None:
+        return generate_aggregated_query_statement(table_name, property_tuples, start_time, end_time, order_by,
+                                                   max_results, aggregation)
+    if len(property_tuples) == 1:
+        return generate_single_property_query_statement(table_name, property_tuples[0], start_time, end_time,
+                                                        order_by, max_results, lower_bounds)
+    return generate_multi_property_query_statement(table_name, property_tuples, start_time, end_time, order_by,
+                                                   max_results, lower_bounds)
+
+
+def generate_single_property_query_statement(table_name, property_tuple, start_time, end_time, order_by, max_results,
+                                             lower_bounds=None):
+    (predicate, predicate_parameters) = generate_property_range_predicate(
+        property_tuple, start_time, end_time, order_by, (lower_bounds or {}).get(property_tuple[1]))
+
+    query = 'select PT, PT_VALUE, TS, {}, PT_VALUE_STR from identifier(?) where {} ' \
+            'order by TS {}, {} {} LIMIT ?'.format(TIE_BREAKER_EXPRESSION, predicate, order_by,
+                                                   TIE_BREAKER_EXPRESSION, order_by)
+    parameters = [table_name] + predicate_parameters + [max_results]
+
+    return (query, parameters)
+
+
+def generate_multi_property_query_statement(table_name, property_tuples, start_time, end_time, order_by, max_results,
+                                            lower_bounds=None):
+    """
+    Query the current page of all properties in a single round trip.
+    Every property keeps the time range generate_single_property_query_statement would use for it,
+    and ROW_NUMBER() caps the number of rows returned per PT at max_results.
+    """
+    property_predicates = []
+    parameters = [table_name]
+    for property_tuple in property_tuples:
+        (predicate, predicate_parameters) = generate_property_range_predicate(
+            property_tuple, start_time, end_time, order_by, (lower_bounds or {}).get(property_tuple[1]))
+        property_predicates.append('({})'.format(predicate))
+        parameters.extend(predicate_parameters)
+    parameters.append(max_results)
+
+    query = 'select PT, PT_VALUE, TS, {}, PT_VALUE_STR from identifier(?) where {} ' \
+            'qualify row_number() over (partition by PT order by TS {}, {} {}) <= ? ' \
+            'order by PT, TS {}, {} {}'.format(TIE_BREAKER_EXPRESSION, ' or '.join(property_predicates),
+                                              order_by, TIE_BREAKER_EXPRESSION, order_by,
+                                              order_by, TIE_BREAKER_EXPRESSION, order_by)
+
+    return (query, parameters)
+
+
+def generate_property_range_predicate(property_tuple, start_time, end_time, order_by, lower_bound=None):
+    """
+    Range of the current page of a property.
+    A page resuming from a next token seeks past the (TS, tie-breaker) key of the last row returned,
+    so rows sharing its timestamp are neither skipped nor returned twice.
+    A lower_bound adds TS >= lower_bound, it must not be after any row of the page.
+    """
     property_foreign_key = property_tuple[1]
     property_query_start_key = property_tuple[3]
+    property_query_start_tie_breaker = property_tuple[4]
 
     if order_by == ORDER_BY_ASC:
-        query = 'select PT, PT_VALUE, TS from identifier(?) where PT = ? and TS > ? and TS < ? order by TS ASC LIMIT ?'
-        parameters = [
-            table_name, 
-            property_foreign_key, 
-            property_query_start_key, 
-            end_time, max_results
-        ]
+        if property_query_start_tie_breaker is None:
+            (predicate, parameters) = ('PT = ? and TS > ? and TS < ?',
+                                       [property_foreign_key, property_query_start_key, end_time])
+        else:
+            (predicate, parameters) = ('PT = ? and (TS > ? or (TS = ? and {} > ?)) and TS < ?'.format(
+                TIE_BREAKER_EXPRESSION), [property_foreign_key, property_query_start_key, property_query_start_key,
+                                          property_query_start_tie_breaker, end_time])
+        (lower_time, upper_time) = (property_query_start_key, end_time)
     elif order_by == ORDER_BY_DESC:
-        query = 'select PT, PT_VALUE, TS from identifier(?) where PT = ? and TS > ? and TS < ? order by TS DESC LIMIT ?'
-        parameters = [
-            table_name, 
-            property_foreign_key, 
-            start_time, 
-            property_query_start_key, 
-            max_results
-        ]
+        if property_query_start_tie_breaker is None:
+            (predicate, parameters) = ('PT = ? and TS > ? and TS < ?',
+                                       [property_foreign_key, start_time, property_query_start_key])
+        else:
+            (predicate, parameters) = ('PT = ? and TS > ? and (TS < ? or (TS = ? and {} < ?))'.format(
+                TIE_BREAKER_EXPRESSION), [property_foreign_key, start_time, property_query_start_key,
+                                          property_query_start_key, property_query_start_tie_breaker])
+        (lower_time, upper_time) = (start_time, property_query_start_key)
     else:
         raise ValueError('Invalid order {}'.format(order_by))
 
+    if lower_bound is not None:
+        (predicate, parameters) = ('{} and TS >= ?'.format(predicate), parameters + [lower_bound])
+        lower_time = lower_bound
+    return append_partition_predicate(predicate, parameters, lower_time, upper_time)
+
+
+def append_partition_predicate(predicate, parameters, lower_time, upper_time):
+    (partition_predicate, partition_parameters) = generate_partition_predicate(lower_time, upper_time,
+                                                                               TIMESERIES_PARTITION_COLUMNS)
+    if partition_predicate is None:
+        return (predicate, parameters)
+    return ('{} and {}'.format(predicate, partition_predicate), parameters + partition_parameters)
+
+
+def generate_aggregated_query_statement(table_name, property_tuples, start_time, end_time, order_by, max_results,
+                                        aggregation):
+    """
+    Query one aggregated point per TIME_SLICE bucket, at most max_results buckets per PT.
+    Time ranges are half-open [lower, upper) so that a next token pointing at a bucket start never splits a bucket.
+    """
+    if order_by not in (ORDER_BY_ASC, ORDER_BY_DESC):
+        raise ValueError('Invalid order {}'.format(order_by))
+
+    (aggregation_function, bucket_width) = aggregation
+
+    property_predicates = []
+    parameters = [table_name]
+    for property_tuple in property_tuples:
+        property_foreign_key = property_tuple[1]
+        property_query_start_key = property_tuple[3]
+
+        if order_by == ORDER_BY_ASC:
+            (predicate, predicate_parameters) = append_partition_predicate(
+                'PT = ? and TS >= ? and TS < ?', [property_foreign_key, property_query_start_key, end_time],
+                property_query_start_key, end_time)
+        else:
+            (predicate, predicate_parameters) = append_partition_predicate(
+                'PT = ? and TS >= ? and TS < ?', [property_foreign_key, start_time, property_query_start_key],
+                start_time, property_query_start_key)
+        property_predicates.append('({})'.format(predicate))
+        parameters.extend(predicate_parameters)
+    parameters.append(max_results)
+
+    # the bucket width is validated as an integer, TIME_SLICE only accepts a constant slice length
+    # buckets are unique per PT, a bucket start alone is enough to resume paging
+    query = 'select PT, {}, TIME_SLICE(TS, {}, \'SECOND\') as BUCKET, null, null from identifier(?) where {} ' \
+            'group by PT, BUCKET ' \
+            'qualify row_number() over (partition by PT order by BUCKET {}) <= ? ' \
+            'order by PT, BUCKET {}'.format(AGGREGATION_FUNCTIONS[aggregation_function], bucket_width,
+                                            ' or '.join(property_predicates), order_by, order_by)
+
     return (query, parameters)
 
 
-def get_value_type(data_type):
-    return VALUE_TYPE_DATA_TYPE_MAPPING[data_type.upper()]
+def parse_aggregation(aggregation, start_time, end_time):
+    """
+    Return (function, bucket width in seconds) of an aggregation request, or None to query raw data points.
+    Without a bucket width, the width is the smallest candidate width that splits the requested time range
+    into at most targetPoints (default AGGREGATION_TARGET_POINTS) buckets.
+    """
+    if not aggregation:
+        return None
+
+    aggregation_function = str(aggregation.get(udqw_constants.AGGREGATION_FUNCTION, '')).upper()
+    if aggregation_function not in AGGREGATION_FUNCTIONS:
+        raise ValueError('Invalid aggregation function {}, expected one of {}'.format(
+            aggregation_function, ', '.join(AGGREGATION_FUNCTIONS.keys())))
+
+    bucket_width = aggregation.get(udqw_constants.AGGREGATION_BUCKET_WIDTH)
+    if bucket_width is None:
+        target_points = int(aggregation.get(udqw_constants.AGGREGATION_TARGET_POINTS, AGGREGATION_TARGET_POINTS))
+        bucket_width = choose_bucket_width(start_time, end_time, target_points)
+
+    bucket_width = int(bucket_width)
+    if bucket_width < 1:
+        raise ValueError('Invalid aggregation bucket width {}'.format(bucket_width))
+
+    return (aggregation_function, bucket_width)
+
+
+def choose_bucket_width(start_time, end_time, target_points):
+    if target_points < 1:
+        raise ValueError('Invalid aggregation target points {}'.format(target_points))
+
+    range_seconds = (parse_timestamp(end_time) - parse_timestamp(start_time)).total_seconds()
+    min_bucket_width = math.ceil(range_seconds / target_points)
+    for bucket_width in AGGREGATION_BUCKET_WIDTHS:
+        if bucket_width >= min_bucket_width:
+            return bucket_width
+    # longer than the largest candidate, use whole days
+    return math.ceil(min_bucket_width / 86400) * 86400
+
+
+def validate_aggregated_properties(property_tuples):
+    """
+    Aggregations only apply to the numbers of PT_VALUE
+    """
+    for (property_name, _, value_type, _, _) in property_tuples:
+        if value_type in STRING_VALUE_TYPES or value_type in BOOLEAN_VALUE_TYPES:
+            raise ValueError('Aggregation is not supported for {} property {}'.format(value_type, property_name))
+
+
+def read_aggregated_value(aggregation, value):
+    """
+    Return (value type, value) of an aggregated point
+    """
+    aggregation_function = aggregation[0]
+    value_type = AGGREGATION_VALUE_TYPES.get(aggregation_function, AGGREGATION_DEFAULT_VALUE_TYPE)
+    if value is None:
+        return (value_type, None)
+    return (value_type, int(value) if value_type == 'longValue' else float(value))
+
+
+def get_next_bucket_start_key(last_bucket_time, order_by, aggregation):
+    # ascending pages continue at the bucket after the last one, descending pages below the last bucket start
+    if order_by == ORDER_BY_DESC:
+        return last_bucket_time
+    (aggregation_function, bucket_width) = aggregation
+    return (parse_timestamp(last_bucket_time) + timedelta(seconds=bucket_width)).isoformat()
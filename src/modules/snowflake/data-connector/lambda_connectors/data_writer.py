@@ -1,26 +1,70 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
+import json
 import logging
-from collections import defaultdict
-from datetime import datetime
+import os
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from utils import udqw_constants
 from utils.bulk_loader import SnowflakeBulkLoader
+from utils.latest_values import latest_value_rows, latest_value_table_name
+from utils.staging_encoder import create_staging_encoder
+from utils.timeseries_batch import TimeSeriesBatch
 from utils.param_parser import UDQWParamsParser
+from utils.property_descriptor import EntityPropertyDescriptors
 from utils.udw_param_validator import UDWParamsValidator
+from utils.write_buffer import create_write_buffer
 
 TIMESERIES_TABLE_FIELDNAMES = ['PT_ID', 'PT', 'DESCRIPTION', 'TS', 'UOM', 'DATA_TYPE', 'PT_VALUE',
                                'PT_VALUE_STR', 'PT_STATUS', 'YEAR', 'MONTH', 'DAY']
 INTERNAL_STAGE_NAME = 'twinmaker_batch_write_stage'
 PUT_STAGE_FILE_FORMAT_NAME = 'twinmaker_batch_write_format'
-CSV_FILE_PATH_TEMPLATE = '/tmp/batch-entry-{}.csv'
+STAGING_FILE_PATH_TEMPLATE = '/tmp/batch-entry-{}'
+# Format of the staged files: CSV, loaded with the PUT_STAGE_FILE_FORMAT_NAME file format,
+# or PARQUET, typed columnar files loaded by column name
+STAGING_FORMAT = os.environ.get('STAGING_FORMAT', 'CSV')
+# Parquet column types, the other columns are written as strings
+PARQUET_COLUMN_TYPES = {
+    'TS': 'timestamp',
+    'DATA_TYPE': 'int32',
+    'PT_VALUE': 'float64',
+    'YEAR': 'int32',
+    'MONTH': 'int32',
+    'DAY': 'int32'
+}
+# Staged files are gzipped in memory, larger files are written to /tmp
+STAGE_IN_MEMORY_MAX_BYTES = int(os.environ.get('STAGE_IN_MEMORY_MAX_BYTES', str(64 * 1024 * 1024)))
+# Rows of a table are staged in files of at most this many rows, one COPY INTO per file
+MAX_ROWS_PER_STAGED_FILE = int(os.environ.get('MAX_ROWS_PER_STAGED_FILE', '100000'))
+# Tables receiving at most this many rows in a request are loaded with a single array-bound INSERT
+# instead of a staged file, which saves the PUT round trip and the file encoding. 0 always stages a file
+INSERT_MAX_ROWS = int(os.environ.get('INSERT_MAX_ROWS', '500'))
+# Staged files are uploaded and copied by up to MAX_CONCURRENT_LOADS workers, each with its own cursor,
+# while the next file is encoded
+MAX_CONCURRENT_LOADS = int(os.environ.get('MAX_CONCURRENT_LOADS', '4'))
+
+# SYNC loads the entries of a request before returning, BUFFERED acknowledges them once they are in the write
+# buffer, and buffer_flusher.py loads them in large batches
+WRITE_MODE_SYNC = 'SYNC'
+WRITE_MODE_BUFFERED = 'BUFFERED'
+WRITE_MODE = os.environ.get('WRITE_MODE', WRITE_MODE_SYNC)
+# While the buffer holds more entries than this, requests are loaded synchronously again, which slows writers
+# down to the pace of the warehouse
+WRITE_BUFFER_MAX_DEPTH = int(os.environ.get('WRITE_BUFFER_MAX_DEPTH', '100000'))
 
 # Configure logger
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-SNOWFLAKE_BULK_LOADER = SnowflakeBulkLoader(CSV_FILE_PATH_TEMPLATE, TIMESERIES_TABLE_FIELDNAMES,
-                                            INTERNAL_STAGE_NAME, PUT_STAGE_FILE_FORMAT_NAME)
+SNOWFLAKE_BULK_LOADER = SnowflakeBulkLoader(STAGING_FILE_PATH_TEMPLATE, TIMESERIES_TABLE_FIELDNAMES,
+                                            INTERNAL_STAGE_NAME,
+                                            create_staging_encoder(STAGING_FORMAT, PUT_STAGE_FILE_FORMAT_NAME,
+                                                                   PARQUET_COLUMN_TYPES),
+                                            STAGE_IN_MEMORY_MAX_BYTES)
+
+WRITE_BUFFER = create_write_buffer() if WRITE_MODE == WRITE_MODE_BUFFERED else None
 
 
 # ---------------------------------------------------------------------------
@@ -41,81 +85,205 @@ def lambda_handler(event, context):
     properties = param_parser.get_properties()
     entries = param_parser.get_entries()
 
-    error_entries = list()
-    # 2 Prepare and generate batch data for Snowflake bulk loading
-    batch_entry_list = generate_batch_entry_for_csv_file(entries, properties)
-    for batch_entry in batch_entry_list:
-        for table_name in batch_entry:
-            bulk_data = batch_entry[table_name]
-            error_entry = loading_bulk_data_into_snowflake(table_name, bulk_data, entries)
-            error_entries.extend(error_entry)
+    if WRITE_MODE == WRITE_MODE_BUFFERED:
+        # 2. Acknowledge the entries once they are buffered, only the entries that could not be buffered
+        # are loaded now
+        entries = buffer_entries(entries, properties)
+
     return {
-        'errorEntries': error_entries
+        'errorEntries': write_entries(entries, properties)
     }
 
 
-def loading_bulk_data_into_snowflake(table_name, bulk_data, entries):
-    # 1. Create local csv file from request
-    file_path, total_rows = SNOWFLAKE_BULK_LOADER.write_csv_file(bulk_data)
+def write_entries(entries, properties, skip_loaded_rows=False):
+    """
+    Load the property values of write entries into Snowflake, returns the error entries of the values
+    that failed to load. With skip_loaded_rows, values already in their table are not loaded again.
+    """
+    if not entries:
+        return list()
+
+    # 1. Group the rows of all entries by target table, so each table is loaded with one INSERT, or one COPY INTO
+    # per staged file, instead of one per entry
+    batch_rows_by_table = generate_batch_rows_by_table(entries, properties)
+    if skip_loaded_rows:
+        for table_name in batch_rows_by_table:
+            batch_rows_by_table[table_name] = remove_loaded_rows(table_name, batch_rows_by_table[table_name])
+
+    # 2. Stage the files of this invocation under their own prefix, so concurrent invocations never load or
+    # remove each other's files. COPY INTO purges every loaded file, files that failed to load are left to
+    # the stage sweeper
+    stage_prefix = SNOWFLAKE_BULK_LOADER.new_stage_prefix()
+
+    # entry id -> set of the timestamps of the rows that failed to load, across all tables and files
+    error_entry_map = defaultdict(set)
+    with ThreadPoolExecutor(max_workers=max(1, MAX_CONCURRENT_LOADS)) as executor:
+        pending_loads = deque()
+        for table_name in batch_rows_by_table:
+            bulk_data = batch_rows_by_table[table_name]
+            for chunk_start in range(0, len(bulk_data), MAX_ROWS_PER_STAGED_FILE):
+                # bound the number of encoded files waiting in memory for a worker
+                if len(pending_loads) >= max(1, MAX_CONCURRENT_LOADS):
+                    merge_error_entry_map(error_entry_map, pending_loads.popleft().result())
+
+                chunk = bulk_data.slice(chunk_start, chunk_start + MAX_ROWS_PER_STAGED_FILE)
+                if len(bulk_data) <= INSERT_MAX_ROWS:
+                    pending_loads.append(executor.submit(inserting_bulk_data_into_snowflake, table_name, chunk,
+                                                         stage_prefix))
+                    continue
+
+                # encoding runs here, overlapping the uploads and COPY INTO statements of the previous files
+                staging_buffer, total_rows = SNOWFLAKE_BULK_LOADER.write_staging_file(chunk)
+                pending_loads.append(executor.submit(loading_bulk_data_into_snowflake, table_name, chunk,
+                                                     staging_buffer, total_rows, stage_prefix))
+
+        while pending_loads:
+            merge_error_entry_map(error_entry_map, pending_loads.popleft().result())
+
+    # 3. Move the latest value tables forward with the rows that loaded
+    for table_name in batch_rows_by_table:
+        latest_table_name = latest_value_table_name(table_name)
+        if latest_table_name is not None:
+            merge_latest_values(latest_table_name, batch_rows_by_table[table_name], error_entry_map)
+
+    LOGGER.info('Staging stats: %s', SNOWFLAKE_BULK_LOADER.stats())
+
+    return generate_property_error_entries(entries, error_entry_map)
+
+
+def buffer_entries(entries, properties):
+    """
+    Append the entries to the write buffer, one message per entry with the id of the request and the property
+    definitions it needs.
+    Returns the entries to load synchronously instead: all of them while the buffer is full,
+    otherwise the ones too large for a buffer message.
+    """
+    if WRITE_BUFFER.approximate_depth() >= WRITE_BUFFER_MAX_DEPTH:
+        LOGGER.warning('Write buffer holds more than %s entries, loading %s entries synchronously',
+                       WRITE_BUFFER_MAX_DEPTH, len(entries))
+        return entries
+
+    # entry ids are only unique within a request, the flusher tells the entries of different requests apart by it
+    request_id = uuid.uuid4().hex
+    bodies = list()
+    unbuffered_entries = list()
+    for entry in entries:
+        entity_property_reference = entry[udqw_constants.ENTITY_PROPERTY_REFERENCE]
+        entity_id = entity_property_reference[udqw_constants.ENTITY_ID]
+        property_name = entity_property_reference[udqw_constants.PROPERTY_NAME]
+        body = {
+            'requestId': request_id,
+            'entry': entry,
+            'properties': {
+                entity_id: {
+                    property_name: properties[entity_id][property_name],
+                    udqw_constants.TIMESERIES_TABLE_NAME: properties[entity_id][udqw_constants.TIMESERIES_TABLE_NAME]
+                }
+            }
+        }
+        if len(json.dumps(body, separators=(',', ':'))) > WRITE_BUFFER.max_message_bytes:
+            unbuffered_entries.append(entry)
+        else:
+            bodies.append(body)
+
+    WRITE_BUFFER.put(bodies)
+    LOGGER.info('Buffered %s entries, loading %s entries synchronously', len(bodies), len(unbuffered_entries))
+    return unbuffered_entries
 
-    # 2. Put csv file into Snowflake internal stage
-    put_status, target_file = SNOWFLAKE_BULK_LOADER.put_file_into_stage(file_path)
+
+def loading_bulk_data_into_snowflake(table_name, bulk_data, staging_buffer, total_rows, stage_prefix):
+    """
+    Upload and copy one staging buffer encoded by SnowflakeBulkLoader.write_staging_file from bulk_data,
+    returns the entry id -> timestamps map of the rows that failed to load.
+    """
+    error_entry_map = defaultdict(set)
+
+    # 1. Put the staged file into Snowflake internal stage
+    put_status, target_file = SNOWFLAKE_BULK_LOADER.put_file_into_stage(staging_buffer, stage_prefix)
     if put_status != SnowflakeBulkLoader.PUT_SUCCESS_STATUS:
         # return full entries if PUT command failed
         LOGGER.error('Failed to load %s of rows to Snowflake table.', len(bulk_data))
-        return handle_errors(bulk_data, len(bulk_data), 0, entries)
+        SNOWFLAKE_BULK_LOADER.remove_staging_buffer(staging_buffer)
+        handle_errors(bulk_data, range(len(bulk_data)), error_entry_map)
+        return error_entry_map
+
+    # 2. Bulk load into to Snowflake table
+    copy_into_status, error_rows = SNOWFLAKE_BULK_LOADER.copy_staged_file_into_table(target_file,
+                                                                                     table_name,
+                                                                                     total_rows,
+                                                                                     stage_prefix)
+
+    # 3. Release the staging buffer, and remove its temporary file if it was written to /tmp
+    SNOWFLAKE_BULK_LOADER.remove_staging_buffer(staging_buffer)
+    if error_rows:
+        LOGGER.error('Failed to load %s of rows to Snowflake table, COPY INTO status %s.', len(error_rows),
+                     copy_into_status)
+        handle_errors(bulk_data, error_rows, error_entry_map)
+    return error_entry_map
 
-    # 3. Bulk load into to Snowflake table
-    copy_into_status, num_errors_seen, first_error_row = SNOWFLAKE_BULK_LOADER.copy_staged_file_into_table(target_file,
-                                                                                                           table_name,
-                                                                                                           total_rows)
 
-    # 4. Remove the successfully loaded data files from the stage
-    SNOWFLAKE_BULK_LOADER.remove_staged_file()
+def inserting_bulk_data_into_snowflake(table_name, bulk_data, stage_prefix):
+    """
+    Insert the rows of a small batch, returns the entry id -> timestamps map of the rows that failed to load.
+    """
+    if SNOWFLAKE_BULK_LOADER.insert_rows_into_table(table_name, bulk_data):
+        return defaultdict(set)
 
-    # 5. Remove the temporary file stored in Lambda function
-    SNOWFLAKE_BULK_LOADER.remove_local_file(file_path)
-    if copy_into_status != SnowflakeBulkLoader.COPY_INTO_SUCCESS_STATUS:
-        LOGGER.error('Failed to load %s of rows to Snowflake table.', num_errors_seen)
-        return handle_errors(bulk_data, num_errors_seen, first_error_row, entries)
+    # the INSERT is atomic, none of its rows were loaded. COPY INTO skips the rows it cannot load and reports
+    # them one by one, so a bad row only fails its own value
+    LOGGER.warning('Loading %s rows into %s through a staged file after the INSERT failed', len(bulk_data),
+                   table_name)
+    staging_buffer, total_rows = SNOWFLAKE_BULK_LOADER.write_staging_file(bulk_data)
+    return loading_bulk_data_into_snowflake(table_name, bulk_data, staging_buffer, total_rows, stage_prefix)
 
-    return list()
 
+def remove_loaded_rows(table_name, bulk_data):
+    """
+    Rows of bulk_data that are not in the table yet. The time-series tables have no row id, a row with the same
+    PT, TS and value is the same point to the readers, so loading it again would only duplicate it.
+    """
+    loaded_rows = set(SNOWFLAKE_BULK_LOADER.find_loaded_rows(table_name, bulk_data))
+    if not loaded_rows:
+        return bulk_data
+    LOGGER.info('Skipping %s of %s rows already loaded into %s', len(loaded_rows), len(bulk_data), table_name)
+    return bulk_data.select([row_index for row_index in range(len(bulk_data)) if row_index not in loaded_rows])
 
-def generate_batch_entry_for_csv_file(entries, properties):
-    batch_entry_list = list()
+
+def merge_latest_values(latest_table_name, bulk_data, error_entry_map):
+    """
+    Best-effort update of a latest value table, its points are loaded whether the MERGE succeeds or not.
+    Readers only use the table as a lower bound of the latest TS of a PT, a table left behind is still correct.
+    """
+    rows = latest_value_rows(bulk_data, error_entry_map)
+    if rows and not SNOWFLAKE_BULK_LOADER.merge_latest_values(latest_table_name, rows):
+        LOGGER.error('Latest value table %s is behind by up to %s PTs', latest_table_name, len(rows))
+
+
+def merge_error_entry_map(error_entry_map, file_error_entry_map):
+    for entry_id in file_error_entry_map:
+        error_entry_map[entry_id].update(file_error_entry_map[entry_id])
+
+
+def generate_batch_rows_by_table(entries, properties):
+    data_records = defaultdict(TimeSeriesBatch)
+    property_descriptors = EntityPropertyDescriptors(properties)
     for entry in entries:
         entity_property_reference = entry[udqw_constants.ENTITY_PROPERTY_REFERENCE]
-        entity_id = entity_property_reference[udqw_constants.ENTITY_ID]
-        property_name = entity_property_reference[udqw_constants.PROPERTY_NAME]
-        property_foreign_key = properties[entity_id][property_name]['definition'][udqw_constants.CONFIGURATION]['PT']
-        table_name = properties[entity_id][udqw_constants.TIMESERIES_TABLE_NAME]['value']['stringValue']
+        property_descriptor = property_descriptors.get(entity_property_reference[udqw_constants.ENTITY_ID],
+                                                       entity_property_reference[udqw_constants.PROPERTY_NAME])
         property_values = entry[udqw_constants.PROPERTY_VALUES]
         entry_id = entry[udqw_constants.ENTRY_ID]
-        data_records = defaultdict(list)
-        for property_value in property_values:
-            timestamp = property_value[udqw_constants.TIMESTAMP]
-            epoch_time = datetime.fromisoformat(timestamp).timestamp()
-            value = property_value[udqw_constants.PROPERTY_VALUE]['doubleValue']
-            data_record = {
-                'PT': property_foreign_key,
-                'TS': timestamp,
-                'PT_VALUE': value,
-                'EPOCH_TIME': epoch_time,
-                'ENTRY_ID': entry_id
-            }
-            data_records[table_name].append(data_record)
-        batch_entry_list.append(data_records)
-    return batch_entry_list
+        data_records[property_descriptor.table_name].append_entry(entry_id, property_descriptor.require_foreign_key(),
+                                                                  udqw_constants.TIMESTAMP,
+                                                                  udqw_constants.PROPERTY_VALUE, property_values)
+    return data_records
 
 
-def handle_errors(batch_entry, num_errors_seen, first_error_row, entries):
-    error_entries = batch_entry[first_error_row: first_error_row + num_errors_seen]
-    error_entry_map = defaultdict(list)
-    for row in error_entries:
-        entry_id, epoch_time = row['ENTRY_ID'], row['EPOCH_TIME']
-        error_entry_map[entry_id].append(epoch_time)
-    return generate_property_error_entries(entries, error_entry_map)
+def handle_errors(batch_entry, error_rows, error_entry_map):
+    # rows of a staged file keep the order of batch_entry, so COPY INTO row numbers map back to their entry
+    for error_row in error_rows:
+        # keyed on the timestamp of the request, generate_property_error_entries looks property values up by it
+        error_entry_map[batch_entry.entry_ids[error_row]].add(batch_entry.request_timestamps[error_row])
 
 
 def generate_property_error_entries(entries, error_entry_map):
@@ -2,7 +2,10 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import logging
-from utils.connection_utils import connect_snowflake
+import os
+from collections import OrderedDict
+from utils.connection_utils import SNOWFLAKE_CONNECTION_MANAGER
+from utils.schema_cache import schema_cache_from_environment
 
 REQUEST_KEY_PROPERTIES = 'properties'
 REQUEST_KEY_ELEM_ID = 'elemId'
@@ -12,12 +15,23 @@ REQUEST_KEY_VALUE_STRING = 'stringValue'
 
 ILLEGAL_CHARACTERS = ['#', '(', ')', ' ']
 
+# SIBLINGS loads the schema of the elements sharing the ELEM_PARENT_ID of a missing element in the same query,
+# NONE only loads the missing element
+SCHEMA_PREFETCH_MODE_SIBLINGS = 'SIBLINGS'
+SCHEMA_PREFETCH_MODE_NONE = 'NONE'
+SCHEMA_PREFETCH_MODE = os.environ.get('SCHEMA_PREFETCH_MODE', SCHEMA_PREFETCH_MODE_SIBLINGS)
+SCHEMA_PREFETCH_MAX_ELEMENTS = int(os.environ.get('SCHEMA_PREFETCH_MAX_ELEMENTS', '1000'))
+# Snowflake error of a column missing from the table
+SNOWFLAKE_INVALID_IDENTIFIER_ERRNO = 904
+
 # Configure logger
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-# Connect to Snowflake
-SNOWFLAKE_CONNECTION = connect_snowflake()
+# Schema rows of the elements already initialized by a warm container
+SCHEMA_CACHE = schema_cache_from_environment()
+# tables without ELEM_PARENT_ID, their elements are loaded one by one
+TABLES_WITHOUT_PARENT_ID = set()
 
 # ---------------------------------------------------------------------------
 #   Sample implementation of an AWS IoT TwinMaker control plane Connector against Snowflake
@@ -27,7 +41,7 @@ SNOWFLAKE_CONNECTION = connect_snowflake()
 
 def lambda_handler(event, context):
 
-    cursor = SNOWFLAKE_CONNECTION.cursor()
+    cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
     properties = {}
 
     # Prepare and execute query statement to Snowflake
@@ -38,11 +52,17 @@ def lambda_handler(event, context):
     table_name = table_name_property[REQUEST_KEY_VALUE][REQUEST_KEY_VALUE_STRING] if REQUEST_KEY_VALUE in table_name_property else table_name_property['definition']['defaultValue'][REQUEST_KEY_VALUE_STRING]
 
     try:
-        query = 'select ATTR_NAME, ATTR_VALUE, ATTR_PI_PT, PT_UOM, PT_DATATYPE from identifier(?) where ELEM_ID = ?;'
-
         LOGGER.info('elem_id: %s', elem_id)
 
-        for (attr_name, attr_value, attr_pi_pt, pt_uom, data_type) in cursor.execute(query, [ table_name, elem_id]):
+        SCHEMA_CACHE.validate(table_name, lambda: query_table_version(cursor, table_name))
+        schema_rows = SCHEMA_CACHE.get(table_name, elem_id)
+        if schema_rows is None:
+            schema_rows_by_elem_id = query_schema_rows(cursor, table_name, elem_id)
+            SCHEMA_CACHE.put(table_name, schema_rows_by_elem_id)
+            schema_rows = schema_rows_by_elem_id[elem_id]
+        LOGGER.info('schema cache: %s', SCHEMA_CACHE.stats())
+
+        for (attr_name, attr_value, attr_pi_pt, pt_uom, data_type) in schema_rows:
             if attr_name is None or data_type is None:
                 raise ValueError('Data type and attribute name cannot be null')
 
@@ -80,6 +100,7 @@ def lambda_handler(event, context):
     
     except Exception as e:
         LOGGER.error("Query exception: %s", e)
+        SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
         raise e
 
     finally:
@@ -90,6 +111,51 @@ def lambda_handler(event, context):
     }
 
 
+def query_table_version(cursor, table_name):
+    """
+    Commit time of the last change to the table, or None when it cannot be read
+    """
+    try:
+        return cursor.execute('select SYSTEM$LAST_CHANGE_COMMIT_TIME(?);', [table_name]).fetchone()[0]
+    except Exception as e:
+        LOGGER.warning('Cannot read the last change time of %s, caching its schema without version: %s',
+                       table_name, e)
+        return None
+
+
+def query_schema_rows(cursor, table_name, elem_id):
+    """
+    Return {elem_id: [(ATTR_NAME, ATTR_VALUE, ATTR_PI_PT, PT_UOM, PT_DATATYPE)]} of the element,
+    and of up to SCHEMA_PREFETCH_MAX_ELEMENTS - 1 of its siblings in SIBLINGS prefetch mode.
+    """
+    if SCHEMA_PREFETCH_MODE == SCHEMA_PREFETCH_MODE_SIBLINGS and table_name not in TABLES_WITHOUT_PARENT_ID:
+        # the requested element ranks first, so it is always loaded
+        query = 'select ELEM_ID, ATTR_NAME, ATTR_VALUE, ATTR_PI_PT, PT_UOM, PT_DATATYPE from identifier(?) ' \
+                'where ELEM_ID = ? or ELEM_PARENT_ID = (select any_value(ELEM_PARENT_ID) from identifier(?) ' \
+                'where ELEM_ID = ?) ' \
+                'qualify dense_rank() over (order by iff(ELEM_ID = ?, 0, 1), ELEM_ID) <= ?;'
+        parameters = [table_name, elem_id, table_name, elem_id, elem_id, SCHEMA_PREFETCH_MAX_ELEMENTS]
+        try:
+            return group_schema_rows(cursor.execute(query, parameters), elem_id)
+        except Exception as e:
+            if getattr(e, 'errno', None) != SNOWFLAKE_INVALID_IDENTIFIER_ERRNO:
+                raise
+            LOGGER.warning('Cannot prefetch sibling schemas of %s, loading elements one by one: %s', table_name, e)
+            TABLES_WITHOUT_PARENT_ID.add(table_name)
+
+    query = 'select ELEM_ID, ATTR_NAME, ATTR_VALUE, ATTR_PI_PT, PT_UOM, PT_DATATYPE from identifier(?) ' \
+            'where ELEM_ID = ?;'
+    return group_schema_rows(cursor.execute(query, [table_name, elem_id]), elem_id)
+
+
+def group_schema_rows(rows, elem_id):
+    # the requested element is cached even without any row
+    schema_rows_by_elem_id = OrderedDict([(elem_id, [])])
+    for row in rows:
+        schema_rows_by_elem_id.setdefault(row[0], []).append(tuple(row[1:]))
+    return schema_rows_by_elem_id
+
+
 def replace_illegal_character(attr_name):
     for illegal_char in ILLEGAL_CHARACTERS:
         attr_name = attr_name.replace(illegal_char, '_')
@@ -0,0 +1,29 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import os
+from data_writer import SNOWFLAKE_BULK_LOADER
+
+# Stage prefixes younger than this may still belong to a running writer invocation
+# (the Lambda timeout is at most 15 minutes)
+SWEEP_MIN_AGE_SECONDS = int(os.environ.get('SWEEP_MIN_AGE_SECONDS', '3600'))
+# Maximum number of REMOVE statements per run, the rest is left to the next scheduled run
+SWEEP_MAX_PREFIXES = int(os.environ.get('SWEEP_MAX_PREFIXES', '100'))
+
+# Configure logger
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# ---------------------------------------------------------------------------
+#   Scheduled clean up of the Snowflake stage used by the UDW Connector
+#   removes the files of failed loads and interrupted invocations
+# ---------------------------------------------------------------------------
+
+
+def lambda_handler(event, context):
+    removed_prefixes = SNOWFLAKE_BULK_LOADER.remove_orphaned_stage_prefixes(SWEEP_MIN_AGE_SECONDS,
+                                                                            SWEEP_MAX_PREFIXES)
+    return {
+        'removedPrefixes': removed_prefixes
+    }
@@ -3,6 +3,11 @@
 
 from . import udqw_constants
 import json
+from datetime import datetime, timezone
+
+NEXT_TOKEN_VERSION = 2
+NEXT_TOKEN_VERSION_KEY = 'v'
+NEXT_TOKEN_KEYS_KEY = 'k'
 
 
 def get_value(dict, key):
@@ -11,17 +16,37 @@ def get_value(dict, key):
     else:
         return None
 
+def parse_timestamp(timestamp):
+    '''
+    Parse an ISO 8601 timestamp of a request or next token into an aware datetime.
+    Timestamps without a time zone are in UTC.
+    '''
+    parsed_timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if parsed_timestamp.tzinfo is None:
+        parsed_timestamp = parsed_timestamp.replace(tzinfo=timezone.utc)
+    return parsed_timestamp
+
 def parse_next_token(token, selectedProperties):
     '''
-    For properties that still have more data points to return, the property will be attached with its last exclusive timestamp.
-    So in the current query, the result will continue from last exclusive timestamp.
+    For properties that still have more data points to return, the property will be attached with the key of the last row returned.
+    So in the current query, the result will continue right after that row.
     For properties that have no more data points left, they'll not appear in the query.
 
     Token schema:
 
     {
-        "propertyName": <lastExclusiveTimestamp> // in ISO format
+        "v": 2,
+        "k": {
+            "propertyName": [<lastTimestamp>, <lastTieBreaker>] // timestamp in ISO format
+        }
     }
+
+    lastTieBreaker orders the rows sharing lastTimestamp, e.g. the hash of a data point's value, or the ALARM_ID and
+    status hash of an alarm event, so rows with the same timestamp are neither skipped nor returned twice.
+    When it is null, the query continues after lastTimestamp.
+    Version 1 tokens, {"propertyName": <lastExclusiveTimestamp>}, are still accepted and read with a null tie-breaker.
+
+    Returns {propertyName: (lastTimestamp, lastTieBreaker)}
     '''
 
     if token is None or len(token.strip()) == 0:
@@ -33,10 +58,28 @@ def parse_next_token(token, selectedProperties):
     except Exception as e:
         raise Exception('Cannot decode next token: {}'.format(token), e)
 
-    if len(propertyNextTokens.keys()) > 0:
-        for propertyName, lastExclusiveTimestamp in propertyNextTokens.items():
+    if propertyNextTokens.get(NEXT_TOKEN_VERSION_KEY) == NEXT_TOKEN_VERSION and \
+            isinstance(propertyNextTokens.get(NEXT_TOKEN_KEYS_KEY), dict):
+        propertyNextKeys = {propertyName: (lastKey[0], lastKey[1])
+                            for propertyName, lastKey in propertyNextTokens[NEXT_TOKEN_KEYS_KEY].items()}
+    else:
+        propertyNextKeys = {propertyName: (lastExclusiveTimestamp, None)
+                            for propertyName, lastExclusiveTimestamp in propertyNextTokens.items()}
+
+    if len(propertyNextKeys.keys()) > 0:
+        for propertyName in propertyNextKeys.keys():
             if propertyName not in selectedProperties:
                 raise ValueError('Next token {} doesn\'t match selected properties {}'.format(token, ', '.join(selectedProperties)))
-        return propertyNextTokens
+        return propertyNextKeys
     else:
-        raise ValueError('Parsed next token is empty {}'.format(str(propertyNextTokens)))
\ No newline at end of file
+        raise ValueError('Parsed next token is empty {}'.format(str(propertyNextTokens)))
+
+def generate_next_token(propertyNextKeys):
+    '''
+    Encode {propertyName: (lastTimestamp, lastTieBreaker)} as a next token, see parse_next_token for the schema.
+    '''
+    return json.dumps({
+        NEXT_TOKEN_VERSION_KEY: NEXT_TOKEN_VERSION,
+        NEXT_TOKEN_KEYS_KEY: {propertyName: [lastTimestamp, lastTieBreaker]
+                              for propertyName, (lastTimestamp, lastTieBreaker) in propertyNextKeys.items()}
+    }, separators=(',', ':'))
@@ -1,18 +1,24 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
+import io
 import os
-import csv
 import logging
+import time
 import uuid
-from utils.connection_utils import connect_snowflake
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from utils import parse_timestamp
+from utils.connection_utils import SNOWFLAKE_CONNECTION_MANAGER
+from utils.latest_values import LATEST_VALUE_MERGE_MAX_ROWS, generate_latest_value_merge_statement
 
 # Configure logger
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-# Connect to Snowflake
-SNOWFLAKE_CONNECTION = connect_snowflake()
+# PTs looked up per statement by find_loaded_rows
+LOADED_ROWS_QUERY_MAX_PTS = int(os.environ.get('LOADED_ROWS_QUERY_MAX_PTS', '500'))
 
 
 class SnowflakeBulkLoader:
@@ -20,113 +26,341 @@ class SnowflakeBulkLoader:
     PUT_SUCCESS_STATUS = 'UPLOADED'
     COPY_INTO_SUCCESS_STATUS = 'LOADED'
 
-    def __init__(self, file_path_template, field_names, stage_name, file_format_name):
+    def __init__(self, file_path_template, field_names, stage_name, staging_encoder, max_memory_bytes):
         self.file_path_template = file_path_template
         self.field_names = field_names
-        self.__schema_set = set(field_names)
         self.stage_name = stage_name
-        self.file_format_name = file_format_name
-
-    def __schema_filter(self, entry):
-        row = dict()
-        for column_name, value in entry.items():
-            if column_name in self.__schema_set:
-                row[column_name] = value
-        return row
+        self.staging_encoder = staging_encoder
+        self.max_memory_bytes = max_memory_bytes
+        self.staged_in_memory = 0
+        self.staged_on_disk = 0
+        self.bytes_written_to_disk = 0
+        self.peak_memory_bytes = 0
 
     """
-    Lambda /tmp directory size limit is 512MB, may improve/check this later.
+    Lambda /tmp directory size limit is 512MB, batches are only written there once they outgrow max_memory_bytes.
     Reference: https://docs.aws.amazon.com/lambda/latest/dg/gettingstarted-limits.html
     """
 
-    def write_csv_file(self, batch_entry):
-        file_path = self.file_path_template.format(uuid.uuid4())
-        total_rows = 0
-        with open(file_path, 'w', newline='') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=self.field_names)
-            for row_entry in batch_entry:
-                # only write necessary columns based on Snowflake table schema
-                writer.writerow(self.__schema_filter(row_entry))
-                total_rows += 1
-        LOGGER.info("Created a temporary CSV file in {}".format(file_path))
-        return file_path, total_rows
-
-    def put_file_into_stage(self, file_path):
+    def write_staging_file(self, batch_entry):
+        """
+        Encode the rows with the staging encoder into a staging buffer. The buffer stays in memory up to
+        max_memory_bytes of encoded data, larger batches continue in a file under /tmp.
+        """
+        file_path = '{}.{}'.format(self.file_path_template.format(uuid.uuid4()), self.staging_encoder.file_extension)
+        staging_buffer = StagingBuffer(file_path, self.max_memory_bytes)
+        # only necessary columns are written, based on Snowflake table schema
+        total_rows = self.staging_encoder.encode(batch_entry, self.field_names, staging_buffer)
+        staging_buffer.finish()
+
+        if staging_buffer.spilled:
+            self.staged_on_disk += 1
+            self.bytes_written_to_disk += staging_buffer.size
+            LOGGER.info("Created a temporary staging file of {} bytes in {}".format(staging_buffer.size,
+                                                                                    staging_buffer.file_path))
+        else:
+            self.staged_in_memory += 1
+        self.peak_memory_bytes = max(self.peak_memory_bytes, staging_buffer.peak_memory_bytes)
+        return staging_buffer, total_rows
+
+    @staticmethod
+    def new_stage_prefix():
+        """
+        Stage path owned by one writer invocation, e.g. 1640995200_0b8f.../, starting with its creation time
+        in epoch seconds so that LIST output reads in the order of the invocations
+        """
+        return '{}_{}/'.format(int(time.time()), uuid.uuid4().hex)
+
+    def put_file_into_stage(self, staging_buffer, stage_prefix):
         status = target_file = None
-        cursor = SNOWFLAKE_CONNECTION.cursor()
+        cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
         try:
-            put_result = cursor.execute(
-                "PUT file://{} @{} AUTO_COMPRESS=TRUE;".format(file_path,
-                                                               self.stage_name)).fetchone()
+            put_statement = "PUT file://{} @{}/{} {};".format(
+                staging_buffer.file_path, self.stage_name, stage_prefix, self.staging_encoder.put_options)
+            if staging_buffer.spilled:
+                put_result = cursor.execute(put_statement).fetchone()
+            else:
+                # upload straight from memory, the file name is only used to name the staged file
+                put_result = cursor.execute(put_statement, file_stream=staging_buffer.stream()).fetchone()
             target_file, status = put_result[1], put_result[6]
             LOGGER.info(
-                '{} PUT file://{} into Snowflake stage {} as {}.'.format(status, file_path, self.stage_name,
-                                                                         target_file))
+                '{} PUT file://{} into Snowflake stage {} as {}.'.format(status, staging_buffer.file_path,
+                                                                         self.stage_name, target_file))
         except Exception as e:
             LOGGER.error("PUT file exception: {}".format(e))
+            SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
         finally:
             cursor.close()
 
         return status, target_file
 
-    def copy_staged_file_into_table(self, target_file, table_name, total_rows):
+    def copy_staged_file_into_table(self, target_file, table_name, total_rows, stage_prefix):
         """
+        Only the given file of the invocation's stage prefix is loaded, and purged from the stage once loaded.
+        Files that fail to load are left to remove_orphaned_stage_prefixes.
+
+        Rows that fail to parse are skipped (ON_ERROR = CONTINUE) instead of failing the whole file, returns the
+        COPY INTO status and the 0-based positions in the file of the rows that were not loaded.
+
         COPY INTO command output reference:
         https://docs.snowflake.com/en/sql-reference/sql/copy-into-table.html#output
         """
         status = SnowflakeBulkLoader.COPY_INTO_SUCCESS_STATUS
-        num_errors_seen = total_rows
-        first_error_row = 0 
+        error_rows = list()
 
         # Load data from staged files into an existing table using COPY INTO command
-        cursor = SNOWFLAKE_CONNECTION.cursor()
+        cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
         try:
             copy_into_result = cursor.execute(
-                'COPY INTO {} FROM @{}/{} FILE_FORMAT = (FORMAT_NAME = {});'.format(table_name,
-                                                                                    self.stage_name,
-                                                                                    target_file,
-                                                                                    self.file_format_name)).fetchone()
+                "COPY INTO {} FROM @{}/{} FILES = ('{}') {} ON_ERROR = CONTINUE PURGE = TRUE;".format(
+                    table_name,
+                    self.stage_name,
+                    stage_prefix,
+                    target_file,
+                    self.staging_encoder.copy_options())).fetchone()
 
             LOGGER.info(
                 "Output message from Snowflake COPY INTO command: {}".format(copy_into_result))
 
             if len(copy_into_result) > 1:
-                status, num_errors_seen, first_error_row = copy_into_result[1], copy_into_result[5], copy_into_result[7]
+                status, num_errors_seen, first_error_line = copy_into_result[1], copy_into_result[5], copy_into_result[7]
                 LOGGER.info(
-                    "COPY INTO command status={}, num_errors_seen={}, first_error_row={}".format(
-                        status, num_errors_seen, first_error_row))
+                    "COPY INTO command status={}, num_errors_seen={}, first_error_line={}".format(
+                        status, num_errors_seen, first_error_line))
                 LOGGER.info('COPY {} of rows INTO to Snowflake table "{}"."'.format(copy_into_result[3], table_name))
+                if num_errors_seen:
+                    error_rows = self.__find_error_rows(cursor, table_name, total_rows, num_errors_seen,
+                                                        first_error_line)
 
         except Exception as e:
             LOGGER.error("Failed to COPY {} INTO {} exception: {}".format(target_file, self.stage_name, e))
+            SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+            status = None
+            error_rows = range(total_rows)
         finally:
             cursor.close()
+
+        return status, error_rows
+
+    @staticmethod
+    def __find_error_rows(cursor, table_name, total_rows, num_errors_seen, first_error_line):
+        """
+        Row numbers of the rejected records of the COPY INTO just executed on cursor, from Snowflake's VALIDATE.
+        When VALIDATE is not available, e.g. for Parquet files, the errors are assumed to be the num_errors_seen
+        rows starting at first_error_line.
+        """
+        try:
+            validate_rows = cursor.execute(
+                "SELECT DISTINCT \"ROW_NUMBER\" FROM TABLE(VALIDATE({}, JOB_ID => '{}'));".format(table_name,
+                                                                                              cursor.sfqid))
+            # ROW_NUMBER is 1-based
+            error_rows = sorted(row_number - 1 for (row_number,) in validate_rows if row_number)
+            if error_rows:
+                return error_rows
+        except Exception as e:
+            LOGGER.warning("Failed to VALIDATE the COPY INTO {}: {}".format(table_name, e))
+
         """
         According to Snowflake doc: https://docs.snowflake.com/en/sql-reference/sql/copy-into-table.html#output
-        first_error_row should always return a Number, but it returns a None when no errors occurred
-        enforce first_error_row = 0 before return
+        first_error_line should always return a Number, but it returns a None when no errors occurred
+        """
+        first_error_row = max((first_error_line or 1) - 1, 0)
+        return range(first_error_row, min(first_error_row + num_errors_seen, total_rows))
+
+    def insert_rows_into_table(self, table_name, batch):
+        """
+        Load a small batch with one INSERT statement, binding the rows as arrays instead of staging a file.
+        The statement is atomic, returns whether all rows were inserted.
         """
-        if not first_error_row:
-            first_error_row = 0
+        # only necessary columns are inserted, based on Snowflake table schema
+        column_names = [field_name for field_name in self.field_names if batch.has_values(field_name)]
+        insert_statement = 'INSERT INTO {} ({}) VALUES ({});'.format(table_name,
+                                                                   ', '.join(column_names),
+                                                                   ', '.join(['?'] * len(column_names)))
+
+        cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
+        try:
+            cursor.executemany(insert_statement, [list(row) for row in batch.rows(column_names)])
+            LOGGER.info('INSERT {} of rows INTO Snowflake table "{}".'.format(len(batch), table_name))
+            return True
+        except Exception as e:
+            LOGGER.error("Failed to INSERT INTO {} exception: {}".format(table_name, e))
+            SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+            return False
+        finally:
+            cursor.close()
 
-        return status, num_errors_seen, first_error_row
+    def find_loaded_rows(self, table_name, batch):
+        """
+        Positions in batch of the rows whose (PT, TS, PT_VALUE, PT_VALUE_STR) is already in the table. The table is
+        read over the TS range of every PT of the batch, LOADED_ROWS_QUERY_MAX_PTS PTs per statement.
+        """
+        # PT -> [first TS, last TS] of the batch
+        ts_ranges = OrderedDict()
+        row_keys = []
+        for (pt, ts, value, value_str) in batch.rows(['PT', 'TS', 'PT_VALUE', 'PT_VALUE_STR']):
+            ts = parse_timestamp(ts)
+            ts_range = ts_ranges.setdefault(pt, [ts, ts])
+            ts_range[0] = min(ts_range[0], ts)
+            ts_range[1] = max(ts_range[1], ts)
+            row_keys.append((pt, ts, value, value_str))
 
-    def remove_staged_file(self):
-        cursor = SNOWFLAKE_CONNECTION.cursor()
+        loaded_keys = set()
+        cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
         try:
-            for (file_name, status) in cursor.execute(
-                    'REMOVE @{} PATTERN=".*.csv.gz";'.format(self.stage_name)):
-                LOGGER.info('{} file name: {} from stage name: {}.'.format(status, file_name, self.stage_name))
+            pts = list(ts_ranges)
+            for start in range(0, len(pts), LOADED_ROWS_QUERY_MAX_PTS):
+                query_pts = pts[start: start + LOADED_ROWS_QUERY_MAX_PTS]
+                query = 'select PT, TS, PT_VALUE, PT_VALUE_STR from identifier(?) where {};'.format(
+                    ' or '.join(['(PT = ? and TS between ? and ?)'] * len(query_pts)))
+                parameters = [table_name]
+                for pt in query_pts:
+                    parameters.extend([pt] + [ts.replace(tzinfo=None).isoformat() for ts in ts_ranges[pt]])
+                for (pt, ts, value, value_str) in cursor.execute(query, parameters):
+                    # TS is read back as a naive UTC datetime
+                    ts = ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+                    loaded_keys.add((pt, ts, value, value_str))
+        except Exception as e:
+            LOGGER.error("Failed to read the loaded rows of {} exception: {}".format(table_name, e))
+            SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+            raise e
+        finally:
+            cursor.close()
+
+        return [row_index for (row_index, row_key) in enumerate(row_keys) if row_key in loaded_keys]
+
+    def merge_latest_values(self, latest_table_name, rows):
+        """
+        Merge the latest (PT, TS, DATA_TYPE, PT_VALUE, PT_VALUE_STR) row of every PT into a latest value table,
+        returns whether all rows were merged.
+        """
+        cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
+        try:
+            for start in range(0, len(rows), LATEST_VALUE_MERGE_MAX_ROWS):
+                cursor.execute(*generate_latest_value_merge_statement(
+                    latest_table_name, rows[start: start + LATEST_VALUE_MERGE_MAX_ROWS]))
+            LOGGER.info('MERGE {} of rows INTO Snowflake table "{}".'.format(len(rows), latest_table_name))
+            return True
+        except Exception as e:
+            LOGGER.error("Failed to MERGE INTO {} exception: {}".format(latest_table_name, e))
+            SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
+            return False
+        finally:
+            cursor.close()
+
+    def remove_orphaned_stage_prefixes(self, min_age_seconds, max_prefixes):
+        """
+        Remove the stage prefixes, and files staged outside of a prefix, whose newest file is older than
+        min_age_seconds, i.e. files left behind by failed loads or interrupted invocations.
+        At most max_prefixes are removed per call, one REMOVE statement each.
+        """
+        removed_prefixes = []
+        cursor = SNOWFLAKE_CONNECTION_MANAGER.cursor()
+        try:
+            # prefix -> last modified epoch seconds of its newest file
+            last_modified_by_prefix = dict()
+            for row in cursor.execute('LIST @{};'.format(self.stage_name)):
+                file_name, last_modified = row[0], row[3]
+                # LIST returns <stage name>/<prefix>/<file> or <stage name>/<file>
+                path = file_name.split('/', 1)[-1]
+                prefix = path.split('/', 1)[0] + '/' if '/' in path else path
+                last_modified = parsedate_to_datetime(last_modified).timestamp()
+                last_modified_by_prefix[prefix] = max(last_modified, last_modified_by_prefix.get(prefix, 0))
+
+            oldest_allowed = time.time() - min_age_seconds
+            orphaned_prefixes = sorted(prefix for prefix in last_modified_by_prefix
+                                       if last_modified_by_prefix[prefix] < oldest_allowed)
+            for prefix in orphaned_prefixes[:max_prefixes]:
+                for (file_name, status) in cursor.execute('REMOVE @{}/{};'.format(self.stage_name, prefix)):
+                    LOGGER.info('{} file name: {} from stage name: {}.'.format(status, file_name, self.stage_name))
+                removed_prefixes.append(prefix)
+            LOGGER.info('Removed {} of {} orphaned stage prefixes.'.format(len(removed_prefixes),
+                                                                          len(orphaned_prefixes)))
         except Exception as e:
             LOGGER.error("Failed to execute REMOVE command, {}".format(e))
+            SNOWFLAKE_CONNECTION_MANAGER.handle_error(e)
             raise e
         finally:
             cursor.close()
+        return removed_prefixes
 
     @staticmethod
-    def remove_local_file(file_path):
+    def remove_staging_buffer(staging_buffer):
         try:
-            os.remove(file_path)
-            LOGGER.info("Removed file in local path: {}".format(file_path))
+            staging_buffer.close()
+            if staging_buffer.spilled:
+                LOGGER.info("Removed file in local path: {}".format(staging_buffer.file_path))
         except Exception as e:
             LOGGER.error("Failed to remove local file, {}".format(e))
+
+    def stats(self):
+        return {
+            'stagedInMemory': self.staged_in_memory,
+            'stagedOnDisk': self.staged_on_disk,
+            'bytesWrittenToDisk': self.bytes_written_to_disk,
+            'peakMemoryBytes': self.peak_memory_bytes
+        }
+
+
+class StagingBuffer:
+    """
+    Write-only binary stream kept in memory until it grows past max_memory_bytes,
+    after which its content is moved to file_path and every further write goes to that file.
+    """
+
+    def __init__(self, file_path, max_memory_bytes):
+        self.file_path = file_path
+        self.max_memory_bytes = max_memory_bytes
+        self.size = 0
+        self.peak_memory_bytes = 0
+        self.__memory = io.BytesIO()
+        self.__file = None
+
+    @property
+    def spilled(self):
+        return self.__memory is None
+
+    def write(self, data):
+        if self.__memory is not None and self.size + len(data) > self.max_memory_bytes:
+            self.__file = open(self.file_path, 'wb')
+            self.__file.write(self.__memory.getbuffer())
+            self.__memory = None
+
+        if self.__memory is not None:
+            self.__memory.write(data)
+            self.peak_memory_bytes = max(self.peak_memory_bytes, self.size + len(data))
+        else:
+            self.__file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    @property
+    def closed(self):
+        return False
+
+    def flush(self):
+        if self.__file is not None:
+            self.__file.flush()
+
+    def finish(self):
+        """
+        Complete the written data, so a spilled file can be read by PUT.
+        """
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def stream(self):
+        self.__memory.seek(0)
+        return self.__memory
+
+    def close(self):
+        self.finish()
+        if self.spilled:
+            if os.path.exists(self.file_path):
+                os.remove(self.file_path)
+        else:
+            self.__memory = io.BytesIO()
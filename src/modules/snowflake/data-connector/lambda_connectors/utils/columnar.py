@@ -0,0 +1,67 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import importlib.util
+import os
+from datetime import timezone
+
+# pyarrow is installed with snowflake-connector-python[pandas]. It is only looked up here,
+# and imported by the first fetch, since importing it takes a noticeable part of a cold start.
+ARROW_FETCH_ENABLED = importlib.util.find_spec('pyarrow') is not None and \
+                      os.environ.get('ARROW_FETCH_ENABLED', 'true').lower() == 'true'
+
+
+def fetch_rows(cursor, timestamp_column_index):
+    """
+    Fetch the result of an executed cursor as tuples, with the timestamp column formatted as an ISO 8601 UTC string.
+
+    When pyarrow is available the result is fetched as Arrow batches, so the timestamps are formatted and the values
+    are converted to Python objects one column at a time instead of one row at a time.
+    """
+    if not ARROW_FETCH_ENABLED:
+        return (format_row(row, timestamp_column_index) for row in cursor)
+
+    table = cursor.fetch_arrow_all()
+    if table is None:
+        # empty result set
+        return []
+
+    columns = []
+    for column_index, column in enumerate(table.columns):
+        if column_index == timestamp_column_index:
+            columns.append(format_timestamp_column(column))
+        else:
+            columns.append(column.to_pylist())
+    return list(zip(*columns))
+
+
+def format_row(row, timestamp_column_index):
+    row = list(row)
+    row[timestamp_column_index] = format_timestamp(row[timestamp_column_index])
+    return tuple(row)
+
+
+def format_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return timestamp.replace(tzinfo=timezone.utc).isoformat()
+
+
+def format_timestamp_column(column):
+    """
+    Vectorized equivalent of format_timestamp, e.g. 2022-01-01T01:00:00+00:00 or 2022-01-01T01:00:00.123000+00:00
+    """
+    import pyarrow
+    import pyarrow.compute
+
+    try:
+        # drop the time zone and sub-microsecond precision, the same way datetime.isoformat() renders the value
+        timestamps = pyarrow.compute.cast(column, pyarrow.timestamp('us'), safe=False)
+        formatted = pyarrow.compute.cast(timestamps, pyarrow.string())
+        formatted = pyarrow.compute.replace_substring_regex(formatted, pattern=r'\.000000$', replacement='')
+        formatted = pyarrow.compute.replace_substring(formatted, pattern=' ', replacement='T', max_replacements=1)
+        formatted = pyarrow.compute.binary_join_element_wise(formatted, '+00:00', '')
+        return formatted.to_pylist()
+    except (pyarrow.ArrowNotImplementedError, pyarrow.ArrowInvalid, AttributeError):
+        # compute kernels missing in older pyarrow releases
+        return [format_timestamp(timestamp) for timestamp in column.to_pylist()]
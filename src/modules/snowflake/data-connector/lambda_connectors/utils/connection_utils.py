@@ -1,9 +1,11 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
-import json
-import boto3
-import snowflake.connector
+import logging
+import os
+import threading
+import time
+from utils.secret_cache import SECRET_CACHE
 
 SNOWFLAKE_SECRET_ID = 'SnowflakeSecret'
 SNOWFLAKE_SECRET_KEY_ACCOUNT = 'ACCOUNT'
@@ -14,35 +16,161 @@ SNOWFLAKE_SECRET_KEY_WAREHOUSE = 'WAREHOUSE'
 SNOWFLAKE_SECRET_KEY_DATABASE = 'DATABASE'
 SNOWFLAKE_SECRET_KEY_SCHEMA = 'SCHEMA'
 
+# Snowflake error numbers of a session that no longer exists or whose token expired
+SNOWFLAKE_SESSION_GONE_ERRNOS = {390111, 390112, 390114}
+
+SNOWFLAKE_CONNECT_ATTEMPTS = int(os.environ.get('SNOWFLAKE_CONNECT_ATTEMPTS', '3'))
+SNOWFLAKE_CONNECT_BACKOFF_SECONDS = float(os.environ.get('SNOWFLAKE_CONNECT_BACKOFF_SECONDS', '0.5'))
+SNOWFLAKE_VALIDATE_AFTER_IDLE_SECONDS = int(os.environ.get('SNOWFLAKE_VALIDATE_AFTER_IDLE_SECONDS', '300'))
+
+# LAZY imports snowflake.connector and connects on the first query,
+# EAGER does both while the Lambda container initializes, before the first invocation
+STARTUP_MODE_LAZY = 'LAZY'
+STARTUP_MODE_EAGER = 'EAGER'
+STARTUP_MODE = os.environ.get('STARTUP_MODE', STARTUP_MODE_LAZY)
+
+LOGGER = logging.getLogger()
+
 
 def connect_snowflake():
+    # snowflake.connector takes hundreds of milliseconds to import, only pay for it when connecting
+    import snowflake.connector
 
     # Fetch Snowflake credential
     secret = load_secret(SNOWFLAKE_SECRET_ID)
 
     snowflake.connector.paramstyle='qmark'
-    
+
     # Establish Snowflake connection
-    return snowflake.connector.connect(
-        account=secret[SNOWFLAKE_SECRET_KEY_ACCOUNT],
-        user=secret[SNOWFLAKE_SECRET_KEY_USER],
-        password=secret[SNOWFLAKE_SECRET_KEY_PASSWORD],
-        role=secret[SNOWFLAKE_SECRET_KEY_ROLE],
-        warehouse=secret[SNOWFLAKE_SECRET_KEY_WAREHOUSE],
-        database=secret[SNOWFLAKE_SECRET_KEY_DATABASE],
-        schema=secret[SNOWFLAKE_SECRET_KEY_SCHEMA]
-    )
+    try:
+        return snowflake.connector.connect(
+            account=secret[SNOWFLAKE_SECRET_KEY_ACCOUNT],
+            user=secret[SNOWFLAKE_SECRET_KEY_USER],
+            password=secret[SNOWFLAKE_SECRET_KEY_PASSWORD],
+            role=secret[SNOWFLAKE_SECRET_KEY_ROLE],
+            warehouse=secret[SNOWFLAKE_SECRET_KEY_WAREHOUSE],
+            database=secret[SNOWFLAKE_SECRET_KEY_DATABASE],
+            schema=secret[SNOWFLAKE_SECRET_KEY_SCHEMA],
+            # keep the session of a warm container from expiring between invocations
+            client_session_keep_alive=True
+        )
+    except snowflake.connector.errors.DatabaseError as e:
+        # the cached credential may have been rotated, fetch it again on the next attempt
+        SECRET_CACHE.invalidate(SNOWFLAKE_SECRET_ID)
+        raise e
 
 
 def load_secret(secret_id):
 
-    aws_session = boto3.session.Session()
-    secrets_manager_client = aws_session.client(
-        service_name='secretsmanager'
-    )
+    # served from the warm container cache, Secrets Manager is only called when the cached copy expires
+    return SECRET_CACHE.get_secret(secret_id)
+
+
+class SnowflakeConnectionManager:
+    """
+    Snowflake connection shared by all invocations of a warm Lambda container.
+
+    The connection is created on first use instead of at import time. A connection that has been idle for
+    SNOWFLAKE_VALIDATE_AFTER_IDLE_SECONDS is checked with a trivial query before it is handed out, and a closed
+    or dead connection is replaced, retrying the login up to SNOWFLAKE_CONNECT_ATTEMPTS times.
+    """
+
+    def __init__(self, connect=connect_snowflake, max_attempts=SNOWFLAKE_CONNECT_ATTEMPTS,
+                 backoff_seconds=SNOWFLAKE_CONNECT_BACKOFF_SECONDS,
+                 validate_after_idle_seconds=SNOWFLAKE_VALIDATE_AFTER_IDLE_SECONDS):
+        self.__connect = connect
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.validate_after_idle_seconds = validate_after_idle_seconds
+        self.connect_count = 0
+        self.connect_seconds = 0.0
+        self.__connection = None
+        self.__last_used = 0.0
+        self.__lock = threading.Lock()
+
+    def get_connection(self):
+        with self.__lock:
+            if self.__connection is not None and not self.__is_alive():
+                self.__close()
+            if self.__connection is None:
+                self.__connection = self.__connect_with_retries()
+            self.__last_used = time.monotonic()
+            return self.__connection
+
+    def cursor(self):
+        return self.get_connection().cursor()
+
+    def handle_error(self, error):
+        """
+        Drop the connection when a query failed because the session is gone, so the next call reconnects.
+        """
+        import snowflake.connector
+
+        if isinstance(error, snowflake.connector.errors.OperationalError) or \
+                getattr(error, 'errno', None) in SNOWFLAKE_SESSION_GONE_ERRNOS:
+            LOGGER.warning('Dropping Snowflake connection after error: %s', error)
+            with self.__lock:
+                self.__close()
+
+    def stats(self):
+        return {
+            'connectCount': self.connect_count,
+            'connectSeconds': round(self.connect_seconds, 3)
+        }
+
+    def __is_alive(self):
+        if self.__connection.is_closed():
+            return False
+        if time.monotonic() - self.__last_used < self.validate_after_idle_seconds:
+            return True
+
+        cursor = None
+        try:
+            cursor = self.__connection.cursor()
+            cursor.execute('select 1').fetchone()
+            return True
+        except Exception as e:
+            LOGGER.warning('Snowflake connection liveness check failed: %s', e)
+            return False
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def __connect_with_retries(self):
+        for attempt in range(1, self.max_attempts + 1):
+            start = time.monotonic()
+            try:
+                connection = self.__connect()
+                self.__record_connect_time(attempt, start)
+                return connection
+            except Exception as e:
+                self.__record_connect_time(attempt, start)
+                if attempt >= self.max_attempts:
+                    LOGGER.error('Failed to connect to Snowflake after %s attempts: %s', attempt, e)
+                    raise e
+                LOGGER.warning('Failed to connect to Snowflake (attempt %s): %s', attempt, e)
+                time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+
+    def __record_connect_time(self, attempt, start):
+        elapsed = time.monotonic() - start
+        self.connect_count += 1
+        self.connect_seconds += elapsed
+        LOGGER.info('Snowflake connect attempt %s took %.3f seconds, %s', attempt, elapsed, self.stats())
+
+    def __close(self):
+        connection, self.__connection = self.__connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception as e:
+                LOGGER.warning('Failed to close Snowflake connection: %s', e)
+
 
-    get_secret_value_response = secrets_manager_client.get_secret_value(
-        SecretId=secret_id
-    )
+# Shared by every connector module loaded in the same Lambda container
+SNOWFLAKE_CONNECTION_MANAGER = SnowflakeConnectionManager()
 
-    return json.loads(get_secret_value_response['SecretString'])
+if STARTUP_MODE == STARTUP_MODE_EAGER:
+    SNOWFLAKE_CONNECTION_MANAGER.get_connection()
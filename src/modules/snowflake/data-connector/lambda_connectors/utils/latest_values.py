@@ -0,0 +1,64 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+# Suffix of the latest value table of a time-series table, e.g. _LATEST, kept up to date by DataWriter on a best-effort
+# basis. Empty disables the latest value tables
+LATEST_VALUE_TABLE_SUFFIX = os.environ.get('LATEST_VALUE_TABLE_SUFFIX', '')
+# Rows bound to one MERGE statement
+LATEST_VALUE_MERGE_MAX_ROWS = 1000
+LATEST_VALUE_COLUMNS = ['PT', 'TS', 'DATA_TYPE', 'PT_VALUE', 'PT_VALUE_STR']
+
+
+def latest_value_table_name(table_name):
+    """
+    Name of the latest value table of a time-series table, or None when latest value tables are disabled
+    """
+    if not LATEST_VALUE_TABLE_SUFFIX:
+        return None
+    return table_name + LATEST_VALUE_TABLE_SUFFIX
+
+
+def latest_value_rows(batch, error_entry_map):
+    """
+    Return the (PT, TS, DATA_TYPE, PT_VALUE, PT_VALUE_STR) row of the latest point of every PT of a TimeSeriesBatch,
+    leaving out the rows that failed to load, entry id -> request timestamps in error_entry_map
+    """
+    latest_rows = dict()
+    columns = [batch.column(column_name) for column_name in LATEST_VALUE_COLUMNS]
+    for (index, row) in enumerate(zip(*columns)):
+        failed_timestamps = error_entry_map.get(batch.entry_ids[index])
+        if failed_timestamps and batch.request_timestamps[index] in failed_timestamps:
+            continue
+        # TS is normalized to YYYY-MM-DDTHH:MM:SS[.ffffff], so strings compare in time order
+        latest_row = latest_rows.get(row[0])
+        if latest_row is None or row[1] >= latest_row[1]:
+            latest_rows[row[0]] = row
+    return list(latest_rows.values())
+
+
+def generate_latest_value_merge_statement(latest_table_name, rows):
+    """
+    MERGE of the rows into the latest value table, a row only replaces an older point of its PT
+    """
+    values = ', '.join(['(?, ?, ?, ?, ?)'] * len(rows))
+    query = 'merge into identifier(?) as L using (' \
+            'select column1 as PT, column2::timestamp_ntz as TS, column3::integer as DATA_TYPE, ' \
+            'column4::float as PT_VALUE, column5::varchar as PT_VALUE_STR from values {}) as S on L.PT = S.PT ' \
+            'when matched and S.TS >= L.TS then update set ' \
+            'TS = S.TS, DATA_TYPE = S.DATA_TYPE, PT_VALUE = S.PT_VALUE, PT_VALUE_STR = S.PT_VALUE_STR ' \
+            'when not matched then insert (PT, TS, DATA_TYPE, PT_VALUE, PT_VALUE_STR) ' \
+            'values (S.PT, S.TS, S.DATA_TYPE, S.PT_VALUE, S.PT_VALUE_STR);'.format(values)
+    parameters = [latest_table_name]
+    for row in rows:
+        parameters.extend(row)
+    return (query, parameters)
+
+
+def generate_latest_timestamp_query_statement(latest_table_name, property_foreign_keys):
+    """
+    (PT, TS) of the latest point of every PT in the latest value table
+    """
+    query = 'select PT, TS from identifier(?) where PT in ({})'.format(', '.join(['?'] * len(property_foreign_keys)))
+    return (query, [latest_table_name] + list(property_foreign_keys))
@@ -2,12 +2,14 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from . import udqw_constants, get_value
+from .property_descriptor import build_property_descriptors
 from datetime import datetime
 
 class UDQWParamsParser:
 
     def __init__(self, event):
         self.event = event
+        self.property_descriptors = None
 
     def get_workspace_id(self):
         return get_value(self.event, udqw_constants.WORKSPACE_ID)
@@ -24,6 +26,19 @@ class UDQWParamsParser:
     def get_selected_properties(self):
         return get_value(self.event, udqw_constants.SELECTED_PROPERTIES)
 
+    def get_property_descriptors(self):
+        '''
+        PropertyDescriptor of every selected property, built on the first call
+        '''
+        if self.property_descriptors is None:
+            self.property_descriptors = build_property_descriptors(self.get_properties(),
+                                                                   self.get_selected_properties(),
+                                                                   self.get_timeseries_table_name())
+        return self.property_descriptors
+
+    def get_entities(self):
+        return get_value(self.event, udqw_constants.ENTITIES)
+
     def get_entries(self):
         return get_value(self.event, udqw_constants.ENTRIES)
 
@@ -57,6 +72,9 @@ class UDQWParamsParser:
             order_by = udqw_constants.ORDER_BY_ASC
         return order_by
 
+    def get_aggregation(self):
+        return get_value(self.event, udqw_constants.AGGREGATION)
+
     def get_start_time(self):
         return get_value(self.event, udqw_constants.START_TIME)
 
@@ -0,0 +1,46 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import timezone
+from . import parse_timestamp
+
+
+def parse_partition_columns(partition_columns):
+    """
+    Parse a comma separated 'YEAR,MONTH,DAY' setting into a (year, month, day) column name tuple,
+    or None when the setting is empty
+    """
+    if not partition_columns or not partition_columns.strip():
+        return None
+    column_names = tuple(column_name.strip() for column_name in partition_columns.split(','))
+    if len(column_names) != 3 or not all(column_names):
+        raise ValueError('Invalid partition columns {}, expected YEAR,MONTH,DAY'.format(partition_columns))
+    return column_names
+
+
+def generate_partition_predicate(lower_time, upper_time, partition_columns):
+    """
+    Predicate on the (year, month, day) columns of a table, implied by a lower_time to upper_time range.
+    It is redundant with the timestamp range and only lets Snowflake prune the micro-partitions of a table
+    clustered by date. Returns (None, []) when partition_columns is None.
+
+    Months and days are only compared within a single year, and days within a single month,
+    since the columns cannot be compared as one tuple without losing pruning.
+    """
+    if partition_columns is None:
+        return (None, [])
+
+    (year_column, month_column, day_column) = partition_columns
+    lower_date = parse_timestamp(lower_time).astimezone(timezone.utc).date()
+    upper_date = parse_timestamp(upper_time).astimezone(timezone.utc).date()
+
+    predicates = ['{} between ? and ?'.format(year_column)]
+    parameters = [lower_date.year, upper_date.year]
+    if lower_date.year == upper_date.year:
+        predicates.append('{} between ? and ?'.format(month_column))
+        parameters.extend([lower_date.month, upper_date.month])
+        if lower_date.month == upper_date.month:
+            predicates.append('{} between ? and ?'.format(day_column))
+            parameters.extend([lower_date.day, upper_date.day])
+
+    return (' and '.join(predicates), parameters)
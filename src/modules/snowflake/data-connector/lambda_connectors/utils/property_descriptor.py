@@ -0,0 +1,73 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+from . import udqw_constants
+
+# TwinMaker data type -> key of a value in the responses
+VALUE_TYPE_DATA_TYPE_MAPPING = {
+    'DOUBLE': 'doubleValue',
+    'LONG': 'longValue',
+    'INTEGER': 'intValue',
+    'STRING': 'stringValue',
+    'BOOLEAN': 'booleanValue'
+}
+
+
+class PropertyDescriptor:
+    """
+    What the connectors read from the definition of a property, extracted once per request
+    """
+    __slots__ = ('name', 'foreign_key', 'data_type', 'value_type', 'table_name')
+
+    def __init__(self, name, property_definition, table_name):
+        definition = property_definition.get(udqw_constants.PROPERTY_DEFINITION) or {}
+        configuration = definition.get(udqw_constants.CONFIGURATION) or {}
+        data_type = (definition.get(udqw_constants.PROPERTY_DATA_TYPE) or {}).get(udqw_constants.PROPERTY_TYPE)
+
+        self.name = name
+        # PT key of a time-series property
+        self.foreign_key = configuration.get('PT')
+        self.data_type = data_type
+        # response key of the values, e.g. doubleValue
+        self.value_type = VALUE_TYPE_DATA_TYPE_MAPPING.get(data_type.upper()) if data_type else None
+        self.table_name = table_name
+
+    def require_foreign_key(self):
+        if self.foreign_key is None:
+            raise ValueError('Property {} has no PT configuration'.format(self.name))
+        return self.foreign_key
+
+    def require_value_type(self):
+        if self.value_type is None:
+            raise ValueError('Invalid data type {} for property {}'.format(self.data_type, self.name))
+        return self.value_type
+
+
+def build_property_descriptors(properties, property_names, table_name):
+    """
+    Return {property name: PropertyDescriptor} of the named properties, in their order
+    """
+    return {property_name: PropertyDescriptor(property_name, properties[property_name], table_name)
+            for property_name in property_names}
+
+
+class EntityPropertyDescriptors:
+    """
+    Descriptors of the properties of several entities, e.g. of a write request, built on first use
+    """
+
+    def __init__(self, properties):
+        # entity id -> {property name: property definition, timeseriesTableName: ...}
+        self.properties = properties
+        self.__descriptors = {}
+
+    def get(self, entity_id, property_name):
+        key = (entity_id, property_name)
+        descriptor = self.__descriptors.get(key)
+        if descriptor is None:
+            entity_properties = self.properties[entity_id]
+            table_name = entity_properties[udqw_constants.TIMESERIES_TABLE_NAME][udqw_constants.PROPERTY_VALUE][
+                udqw_constants.PROPERTY_STRING_VALUE]
+            descriptor = PropertyDescriptor(property_name, entity_properties[property_name], table_name)
+            self.__descriptors[key] = descriptor
+        return descriptor
@@ -0,0 +1,44 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+
+# Size limit of a reader response, below the 6 MB limit of a synchronous Lambda response
+RESPONSE_MAX_BYTES = int(os.environ.get('RESPONSE_MAX_BYTES', str(5 * 1024 * 1024)))
+# Room kept for the next token of a response, per property it may continue
+NEXT_TOKEN_BYTES_PER_PROPERTY = 256
+
+
+class ResponseBudget:
+    """
+    Running size of a JSON response, as serialized by the Lambda runtime, counted item by item
+    so that a response can stop at the last item that fits in max_bytes.
+    """
+
+    def __init__(self, max_bytes, reserved_bytes=0):
+        self.max_bytes = max_bytes
+        # the enclosing object, and the room kept for items that are always added, e.g. the next token
+        self.size = 2 + reserved_bytes
+        self.items = 0
+        self.exceeded = False
+
+    def add(self, item):
+        """
+        Count the item and return True if it fits, the first item always does so every response makes progress.
+        Once an item does not fit, no later item does either, so the response stays in order.
+        """
+        if self.exceeded:
+            return False
+        # ', ' separator included
+        size = len(json.dumps(item, default=str)) + 2
+        if self.items > 0 and self.size + size > self.max_bytes:
+            self.exceeded = True
+            return False
+        self.size += size
+        self.items += 1
+        return True
+
+    def add_always(self, item):
+        # items that are part of the response whatever the budget, e.g. the reference of a property
+        self.size += len(json.dumps(item, default=str)) + 2
@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from . import parse_timestamp
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache with per-entry TTL, kept in the warm Lambda container.
+
+    Query results are only immutable once their time window is older than `immutable_after_seconds`.
+    Use ttl_for_window() to pick the TTL of a window: `ttl_seconds` for historical windows,
+    `recent_ttl_seconds` for windows close to now, and 0 (do not cache) when recent_ttl_seconds is 0.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds, recent_ttl_seconds, immutable_after_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.recent_ttl_seconds = recent_ttl_seconds
+        self.immutable_after_seconds = immutable_after_seconds
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, size in bytes, expiry in monotonic seconds)
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def ttl_for_window(self, window_end):
+        try:
+            window_end = parse_timestamp(window_end)
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
+        watermark = datetime.now(timezone.utc) - timedelta(seconds=self.immutable_after_seconds)
+        if window_end <= watermark:
+            return self.ttl_seconds
+        return self.recent_ttl_seconds
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self.__remove(key)
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl_seconds):
+        if ttl_seconds <= 0 or self.max_bytes <= 0:
+            return
+
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            while self.__entries and self.size_bytes + size > self.max_bytes:
+                self.__remove(next(iter(self.__entries)))
+                self.evictions += 1
+
+            self.__entries[key] = (value, size, time.monotonic() + ttl_seconds)
+            self.size_bytes += size
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.__entries),
+            'sizeBytes': self.size_bytes
+        }
+
+    def __remove(self, key):
+        value, size, expires_at = self.__entries.pop(key)
+        self.size_bytes -= size
+
+
+def result_cache_from_environment():
+    return ResultCache(
+        max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+        ttl_seconds=int(os.environ.get('RESULT_CACHE_TTL_SECONDS', '3600')),
+        recent_ttl_seconds=int(os.environ.get('RESULT_CACHE_RECENT_TTL_SECONDS', '0')),
+        immutable_after_seconds=int(os.environ.get('RESULT_CACHE_IMMUTABLE_AFTER_SECONDS', '3600'))
+    )
@@ -0,0 +1,93 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class SchemaCache:
+    """
+    LRU cache of the schema rows of elements, keyed by (table, elem_id), kept in the warm Lambda container.
+
+    Every table has a version, e.g. the time of its last change. The cached rows of a table are dropped
+    when validate() sees a new version, which it looks up at most every `version_check_seconds`.
+    Tables without a version keep their rows for `ttl_seconds`, and their version is looked up again
+    at the same interval.
+    """
+
+    def __init__(self, max_elements, version_check_seconds, ttl_seconds):
+        self.max_elements = max_elements
+        self.version_check_seconds = version_check_seconds
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # (table, elem_id) -> (schema rows, cached at in monotonic seconds)
+        self.__entries = OrderedDict()
+        # table -> (version, checked at in monotonic seconds)
+        self.__versions = dict()
+        self.__lock = threading.Lock()
+
+    def validate(self, table, get_version):
+        """
+        Drop the cached rows of the table if get_version() returns a new version, skipped when the version
+        was checked less than version_check_seconds ago, or ttl_seconds ago for a table without version.
+        """
+        checked = self.__versions.get(table)
+        if checked is not None and \
+                time.monotonic() - checked[1] < (self.version_check_seconds if checked[0] is not None
+                                                 else self.ttl_seconds):
+            return
+
+        version = get_version()
+        with self.__lock:
+            if checked is not None and version != checked[0]:
+                for key in [key for key in self.__entries if key[0] == table]:
+                    del self.__entries[key]
+                self.invalidations += 1
+            self.__versions[table] = (version, time.monotonic())
+
+    def get(self, table, elem_id):
+        with self.__lock:
+            entry = self.__entries.get((table, elem_id))
+            if entry is not None and self.__versions.get(table, (None,))[0] is None and \
+                    time.monotonic() - entry[1] >= self.ttl_seconds:
+                del self.__entries[(table, elem_id)]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            (rows, _) = entry
+            self.__entries.move_to_end((table, elem_id))
+            self.hits += 1
+            return rows
+
+    def put(self, table, rows_by_elem_id):
+        if self.max_elements <= 0:
+            return
+
+        cached_at = time.monotonic()
+        with self.__lock:
+            for elem_id in rows_by_elem_id:
+                self.__entries[(table, elem_id)] = (rows_by_elem_id[elem_id], cached_at)
+                self.__entries.move_to_end((table, elem_id))
+            while len(self.__entries) > self.max_elements:
+                self.__entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'entries': len(self.__entries)
+        }
+
+
+def schema_cache_from_environment():
+    return SchemaCache(
+        max_elements=int(os.environ.get('SCHEMA_CACHE_MAX_ELEMENTS', '100000')),
+        version_check_seconds=int(os.environ.get('SCHEMA_CACHE_VERSION_CHECK_SECONDS', '60')),
+        ttl_seconds=int(os.environ.get('SCHEMA_CACHE_TTL_SECONDS', '300'))
+    )
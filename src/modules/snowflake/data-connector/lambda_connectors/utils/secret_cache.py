@@ -0,0 +1,149 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+SECRET_CACHE_TTL_SECONDS = int(os.environ.get('SECRET_CACHE_TTL_SECONDS', '900'))
+SECRET_CACHE_REFRESH_RATIO = float(os.environ.get('SECRET_CACHE_REFRESH_RATIO', '0.8'))
+# A Fernet key (cryptography.fernet.Fernet.generate_key()) enables the encrypted /tmp copy of cached secrets
+SECRET_CACHE_SPILL_KEY = os.environ.get('SECRET_CACHE_SPILL_KEY')
+SECRET_CACHE_SPILL_DIRECTORY = os.environ.get('SECRET_CACHE_SPILL_DIRECTORY', '/tmp')
+
+LOGGER = logging.getLogger()
+
+
+def create_secrets_manager_client():
+    # boto3 is imported on the first fetch instead of at container start
+    import boto3
+
+    return boto3.session.Session().client(service_name='secretsmanager')
+
+
+class SecretCache:
+    """
+    Cache of Secrets Manager secret strings shared by all invocations of a warm Lambda container.
+
+    A secret is fetched once and served from memory for ttl_seconds. Once it is older than
+    refresh_ratio * ttl_seconds, it is refreshed in a background thread while callers keep getting the cached value.
+    With a spill key, every fetched secret is also written Fernet-encrypted to spill_directory and read back by a
+    new cache instance, e.g. after the module is re-initialized, as long as the copy is younger than ttl_seconds.
+    """
+
+    def __init__(self, client_factory=create_secrets_manager_client, ttl_seconds=SECRET_CACHE_TTL_SECONDS,
+                 refresh_ratio=SECRET_CACHE_REFRESH_RATIO, spill_key=SECRET_CACHE_SPILL_KEY,
+                 spill_directory=SECRET_CACHE_SPILL_DIRECTORY):
+        self.client_factory = client_factory
+        self.ttl_seconds = ttl_seconds
+        self.refresh_ratio = refresh_ratio
+        self.spill_directory = spill_directory
+        self.fetch_count = 0
+        self.__fernet = None
+        if spill_key:
+            from cryptography.fernet import Fernet
+            self.__fernet = Fernet(spill_key)
+        self.__client = None
+        # secret id -> (secret string, fetched at in epoch seconds)
+        self.__entries = {}
+        self.__refreshing = set()
+        self.__lock = threading.Lock()
+
+    def get_secret(self, secret_id):
+        return json.loads(self.get_secret_string(secret_id))
+
+    def get_secret_string(self, secret_id):
+        entry = self.__entries.get(secret_id)
+        if entry is None:
+            entry = self.__read_spill(secret_id)
+            if entry is not None:
+                self.__entries[secret_id] = entry
+
+        if entry is not None:
+            (secret_string, fetched_at) = entry
+            age = time.time() - fetched_at
+            if age < self.ttl_seconds:
+                if age >= self.ttl_seconds * self.refresh_ratio:
+                    self.__refresh_in_background(secret_id)
+                return secret_string
+
+        return self.__fetch(secret_id)
+
+    def invalidate(self, secret_id):
+        self.__entries.pop(secret_id, None)
+        spill_path = self.__spill_path(secret_id)
+        if spill_path is not None and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    def __fetch(self, secret_id):
+        with self.__lock:
+            if self.__client is None:
+                self.__client = self.client_factory()
+            client = self.__client
+
+        get_secret_value_response = client.get_secret_value(SecretId=secret_id)
+        secret_string = get_secret_value_response['SecretString']
+        fetched_at = time.time()
+        self.fetch_count += 1
+
+        self.__entries[secret_id] = (secret_string, fetched_at)
+        self.__write_spill(secret_id, secret_string)
+        return secret_string
+
+    def __refresh_in_background(self, secret_id):
+        with self.__lock:
+            if secret_id in self.__refreshing:
+                return
+            self.__refreshing.add(secret_id)
+
+        def refresh():
+            try:
+                self.__fetch(secret_id)
+            except Exception as e:
+                # the cached value stays valid until it expires, the next call retries
+                LOGGER.warning('Background refresh of secret %s failed: %s', secret_id, e)
+            finally:
+                with self.__lock:
+                    self.__refreshing.discard(secret_id)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def __spill_path(self, secret_id):
+        if self.__fernet is None:
+            return None
+        return os.path.join(self.spill_directory,
+                            'secret-cache-{}'.format(hashlib.sha256(secret_id.encode('utf-8')).hexdigest()))
+
+    def __write_spill(self, secret_id, secret_string):
+        spill_path = self.__spill_path(secret_id)
+        if spill_path is None:
+            return
+        try:
+            token = self.__fernet.encrypt(secret_string.encode('utf-8'))
+            temporary_path = '{}.{}'.format(spill_path, threading.get_ident())
+            with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as spill_file:
+                spill_file.write(token)
+            os.replace(temporary_path, spill_path)
+        except Exception as e:
+            LOGGER.warning('Failed to write cached secret %s: %s', secret_id, e)
+
+    def __read_spill(self, secret_id):
+        spill_path = self.__spill_path(secret_id)
+        if spill_path is None or not os.path.exists(spill_path):
+            return None
+        try:
+            with open(spill_path, 'rb') as spill_file:
+                token = spill_file.read()
+            # Fernet tokens carry their creation time, decrypt() rejects copies older than the TTL
+            secret_string = self.__fernet.decrypt(token, ttl=self.ttl_seconds).decode('utf-8')
+            return (secret_string, self.__fernet.extract_timestamp(token))
+        except Exception as e:
+            LOGGER.info('Ignoring cached secret %s: %s', secret_id, e)
+            return None
+
+
+# Shared by every module loaded in the same Lambda container
+SECRET_CACHE = SecretCache()
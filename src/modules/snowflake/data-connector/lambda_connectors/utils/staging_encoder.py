@@ -0,0 +1,92 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import importlib.util
+import io
+import logging
+from datetime import timezone
+from . import parse_timestamp
+
+STAGING_FORMAT_CSV = 'CSV'
+STAGING_FORMAT_PARQUET = 'PARQUET'
+
+LOGGER = logging.getLogger()
+
+
+class CsvStagingEncoder:
+    """
+    Gzipped CSV files, loaded with a named CSV file format. Every column is written as text
+    and parsed back by Snowflake during COPY INTO.
+    """
+    file_extension = 'csv.gz'
+    # the data is already gzipped, PUT uploads it as is
+    put_options = 'AUTO_COMPRESS=FALSE SOURCE_COMPRESSION=GZIP'
+
+    def __init__(self, file_format_name):
+        self.file_format_name = file_format_name
+
+    def copy_options(self):
+        return 'FILE_FORMAT = (FORMAT_NAME = {})'.format(self.file_format_name)
+
+    def encode(self, batch, field_names, staging_buffer):
+        import csv
+        import gzip
+
+        with gzip.GzipFile(fileobj=staging_buffer, mode='wb') as gzip_file:
+            with io.TextIOWrapper(gzip_file, encoding='utf-8', newline='') as csv_file:
+                csv.writer(csv_file).writerows(batch.rows(field_names))
+        return len(batch)
+
+
+class ParquetStagingEncoder:
+    """
+    Snappy-compressed Parquet files with one typed column per field present in the batch,
+    loaded by column name so Snowflake does not parse any text.
+    """
+    file_extension = 'parquet'
+    put_options = 'AUTO_COMPRESS=FALSE'
+
+    def __init__(self, column_types):
+        # column name -> pyarrow type name or 'timestamp', columns missing here are written as strings
+        self.column_types = column_types
+
+    def copy_options(self):
+        return 'FILE_FORMAT = (TYPE = PARQUET) MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE'
+
+    def encode(self, batch, field_names, staging_buffer):
+        import pyarrow
+        import pyarrow.parquet
+
+        columns = dict()
+        for field_name in field_names:
+            if not batch.has_values(field_name):
+                # columns without any value are not written, and load as NULL like empty CSV fields
+                continue
+            values = batch.column(field_name)
+            column_type = self.column_types.get(field_name, 'string')
+            if column_type == 'timestamp':
+                arrow_type = pyarrow.timestamp('us')
+                values = [to_utc_datetime(value) for value in values]
+            else:
+                arrow_type = getattr(pyarrow, column_type)()
+            columns[field_name] = pyarrow.array(values, type=arrow_type)
+
+        pyarrow.parquet.write_table(pyarrow.table(columns), staging_buffer, compression='snappy')
+        return len(batch)
+
+
+def to_utc_datetime(timestamp):
+    if timestamp is None:
+        return None
+    return parse_timestamp(timestamp).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def create_staging_encoder(staging_format, file_format_name, column_types):
+    """
+    PARQUET needs pyarrow, installed with snowflake-connector-python[pandas], CSV is used without it.
+    """
+    if staging_format == STAGING_FORMAT_PARQUET:
+        if importlib.util.find_spec('pyarrow') is not None:
+            return ParquetStagingEncoder(column_types)
+        LOGGER.warning('pyarrow is not installed, staging CSV files instead of Parquet')
+    return CsvStagingEncoder(file_format_name)
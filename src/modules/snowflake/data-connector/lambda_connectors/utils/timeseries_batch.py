@@ -0,0 +1,174 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import timezone
+from itertools import repeat
+from . import parse_timestamp
+
+# TwinMaker value type -> DATA_TYPE code of the time-series table, see map_to_twinmaker_data_type
+# in schema_initializer_entity.py. There is no 64-bit integer code, long values are stored as Int32 points
+VALUE_TYPE_DATA_TYPES = {
+    'doubleValue': 13,
+    'longValue': 8,
+    'integerValue': 8,
+    'intValue': 8,
+    'stringValue': 105,
+    'booleanValue': 101
+}
+STRING_VALUE_TYPES = {'stringValue'}
+BOOLEAN_VALUE_TYPES = {'booleanValue'}
+
+
+class TimeSeriesBatch:
+    """
+    Data points written to one time-series table, kept as one list per column instead of one dict per row.
+
+    Besides the table columns, every row keeps the entry id and the timestamp of the request it came from,
+    used to report the rows that failed to load.
+    """
+
+    def __init__(self):
+        self.columns = {
+            'PT': [],
+            'TS': [],
+            'DATA_TYPE': [],
+            'PT_VALUE': [],
+            'PT_VALUE_STR': [],
+            'YEAR': [],
+            'MONTH': [],
+            'DAY': []
+        }
+        self.entry_ids = []
+        self.request_timestamps = []
+
+    def __len__(self):
+        return len(self.entry_ids)
+
+    def append_entry(self, entry_id, property_foreign_key, timestamp_key, value_key, property_values):
+        """
+        Append the property values of a write entry, a list of {timestamp_key: ISO 8601 string, value_key: value}
+        """
+        count = len(property_values)
+        request_timestamps = [property_value[timestamp_key] for property_value in property_values]
+        self.entry_ids.extend(repeat(entry_id, count))
+        self.request_timestamps.extend(request_timestamps)
+        self.columns['PT'].extend(repeat(property_foreign_key, count))
+
+        timestamps = normalize_timestamps(request_timestamps)
+        self.columns['TS'].extend(timestamps)
+        # TS is normalized to YYYY-MM-DDTHH:MM:SS[.ffffff] in UTC, the points of an entry span few days
+        dates = dict()
+        for timestamp in timestamps:
+            date = timestamp[0:10]
+            if date not in dates:
+                dates[date] = (int(date[0:4]), int(date[5:7]), int(date[8:10]))
+            (year, month, day) = dates[date]
+            self.columns['YEAR'].append(year)
+            self.columns['MONTH'].append(month)
+            self.columns['DAY'].append(day)
+
+        values = [property_value[value_key] for property_value in property_values]
+        value_type = get_value_type(values[0]) if values else None
+        try:
+            # the values of a property usually share one type, read them all with the type of the first value
+            typed_values = [value[value_type] for value in values]
+        except KeyError:
+            value_types = [get_value_type(value) for value in values]
+            self.__extend_mixed_values(value_types, [value[value_type] for (value, value_type) in zip(values,
+                                                                                                       value_types)])
+            return
+
+        self.columns['DATA_TYPE'].extend(repeat(VALUE_TYPE_DATA_TYPES.get(value_type), count))
+        if value_type in STRING_VALUE_TYPES:
+            self.columns['PT_VALUE'].extend(repeat(None, count))
+            self.columns['PT_VALUE_STR'].extend(typed_values)
+        elif value_type in BOOLEAN_VALUE_TYPES:
+            self.columns['PT_VALUE'].extend([1.0 if typed_value else 0.0 for typed_value in typed_values])
+            self.columns['PT_VALUE_STR'].extend(['true' if typed_value else 'false' for typed_value in typed_values])
+        else:
+            self.columns['PT_VALUE'].extend(typed_values)
+            self.columns['PT_VALUE_STR'].extend(repeat(None, count))
+
+    def __extend_mixed_values(self, value_types, typed_values):
+        for (value_type, typed_value) in zip(value_types, typed_values):
+            self.columns['DATA_TYPE'].append(VALUE_TYPE_DATA_TYPES[value_type])
+            if value_type in STRING_VALUE_TYPES:
+                self.columns['PT_VALUE'].append(None)
+                self.columns['PT_VALUE_STR'].append(typed_value)
+            elif value_type in BOOLEAN_VALUE_TYPES:
+                self.columns['PT_VALUE'].append(1.0 if typed_value else 0.0)
+                self.columns['PT_VALUE_STR'].append('true' if typed_value else 'false')
+            else:
+                self.columns['PT_VALUE'].append(typed_value)
+                self.columns['PT_VALUE_STR'].append(None)
+
+    def slice(self, start, end):
+        batch = TimeSeriesBatch()
+        for column_name in self.columns:
+            batch.columns[column_name] = self.columns[column_name][start:end]
+        batch.entry_ids = self.entry_ids[start:end]
+        batch.request_timestamps = self.request_timestamps[start:end]
+        return batch
+
+    def select(self, row_indexes):
+        """
+        Batch of the given rows, in the given order
+        """
+        batch = TimeSeriesBatch()
+        for column_name in self.columns:
+            column = self.columns[column_name]
+            batch.columns[column_name] = [column[row_index] for row_index in row_indexes]
+        batch.entry_ids = [self.entry_ids[row_index] for row_index in row_indexes]
+        batch.request_timestamps = [self.request_timestamps[row_index] for row_index in row_indexes]
+        return batch
+
+    def has_values(self, column_name):
+        return any(value is not None for value in self.columns.get(column_name, ()))
+
+    def column(self, column_name):
+        """
+        Values of a column, or None for every row when the batch does not fill that column
+        """
+        if column_name in self.columns:
+            return self.columns[column_name]
+        return repeat(None, len(self))
+
+    def rows(self, column_names):
+        return zip(*[self.column(column_name) for column_name in column_names])
+
+
+def read_value(value_type, value, value_str):
+    """
+    Value of a point read back from its PT_VALUE and PT_VALUE_STR columns, the reverse of TimeSeriesBatch.append_entry
+    """
+    if value_type in STRING_VALUE_TYPES:
+        return value_str
+    if value_type in BOOLEAN_VALUE_TYPES:
+        if value_str is not None:
+            return value_str == 'true'
+        return None if value is None else value != 0
+    return value
+
+
+def get_value_type(value):
+    for value_type in value:
+        if value_type in VALUE_TYPE_DATA_TYPES:
+            return value_type
+    raise ValueError('Unsupported value {}'.format(value))
+
+
+def normalize_timestamps(timestamps):
+    """
+    ISO 8601 timestamps as naive UTC strings. Timestamps in UTC, the common case, are only trimmed,
+    the others are parsed and converted.
+    """
+    normalized = []
+    for timestamp in timestamps:
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1]
+        elif timestamp.endswith('+00:00'):
+            timestamp = timestamp[:-6]
+        elif len(timestamp) > 19 and ('+' in timestamp[19:] or '-' in timestamp[19:]):
+            timestamp = parse_timestamp(timestamp).astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+        normalized.append(timestamp)
+    return normalized
@@ -1,12 +1,17 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
+AGGREGATION = 'aggregation'
+AGGREGATION_BUCKET_WIDTH = 'bucketWidthInSeconds'
+AGGREGATION_FUNCTION = 'function'
+AGGREGATION_TARGET_POINTS = 'targetPoints'
 ALARM_KEY = 'alarm_key'
 ATTRIBUTE_PROPERTY_TABLE_NAME = 'attributePropertyTableName'
 COMPONENT_NAME = 'componentName'
 CONFIGURATION = 'configuration'
 ELEMENT_ID = 'elem_id'
 END_TIME = 'endTime'
+ENTITIES = 'entities'
 ENTITY_ID = 'entityId'
 ENTITY_PROPERTY_REFERENCE = 'entityPropertyReference'
 ENTRIES = 'entries'
@@ -0,0 +1,204 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Amazon SQS queue of the buffered write mode, required by it
+WRITE_BUFFER_QUEUE_URL = os.environ.get('WRITE_BUFFER_QUEUE_URL')
+# Amazon SQS queue of the buffered entries that failed to load too many times, optional
+WRITE_BUFFER_DEAD_LETTER_QUEUE_URL = os.environ.get('WRITE_BUFFER_DEAD_LETTER_QUEUE_URL')
+# SQS limits of a message and of a SendMessageBatch call
+SQS_MAX_BATCH_MESSAGES = 10
+SQS_MAX_BATCH_BYTES = 256 * 1024
+# how long received messages stay invisible to other flushers, must exceed the flusher timeout
+WRITE_BUFFER_VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get('WRITE_BUFFER_VISIBILITY_TIMEOUT_SECONDS', '360'))
+# long polling of a receive, up to 20 seconds. A receive returns as soon as messages are available, the flush
+# only ends once a receive waited this long for none
+WRITE_BUFFER_RECEIVE_WAIT_SECONDS = int(os.environ.get('WRITE_BUFFER_RECEIVE_WAIT_SECONDS', '2'))
+
+
+class BufferedMessage:
+
+    def __init__(self, receipt, body, sent_at):
+        self.receipt = receipt
+        self.body = body
+        # epoch seconds
+        self.sent_at = sent_at
+
+
+def message_key(body):
+    """
+    (request id, entry id, entity id, property name) of a buffered write entry. Entry ids are only unique within
+    a request, two messages with the same key hold the same entry
+    """
+    entry = body['entry']
+    entity_property_reference = entry['entityPropertyReference']
+    return (body['requestId'], entry['entryId'], entity_property_reference['entityId'],
+            entity_property_reference['propertyName'])
+
+
+def dedup_key(body):
+    """
+    Key of a buffered write entry, the same message key, failed load attempts and timestamps always give the same key
+    """
+    timestamps = ','.join(property_value['time'] for property_value in body['entry']['propertyValues'])
+    return hashlib.sha256('{}|{}|{}'.format(json.dumps(message_key(body)), body.get('attempts', 0),
+                                            timestamps).encode('utf-8')).hexdigest()
+
+
+class InMemoryWriteBuffer:
+    """
+    Local stand-in for the SQS buffer, only shared by the functions loaded in the same process, e.g. in tests.
+    Received messages are hidden until they are deleted or released. Its messages are lost with the process,
+    so it is only used when injected, never by a deployed function.
+    """
+
+    def __init__(self):
+        self.max_message_bytes = SQS_MAX_BATCH_BYTES
+        # receipt -> (body, sent at, in flight)
+        self.__messages = OrderedDict()
+        self.__next_receipt = 0
+        self.__lock = threading.Lock()
+
+    def put(self, bodies):
+        with self.__lock:
+            for body in bodies:
+                self.__messages[str(self.__next_receipt)] = (body, time.time(), False)
+                self.__next_receipt += 1
+
+    def approximate_depth(self):
+        return len(self.__messages)
+
+    def receive(self, max_messages):
+        messages = []
+        with self.__lock:
+            for receipt in self.__messages:
+                if len(messages) >= max_messages:
+                    break
+                body, sent_at, in_flight = self.__messages[receipt]
+                if not in_flight:
+                    self.__messages[receipt] = (body, sent_at, True)
+                    messages.append(BufferedMessage(receipt, body, sent_at))
+        return messages
+
+    def delete(self, receipts):
+        with self.__lock:
+            for receipt in receipts:
+                self.__messages.pop(receipt, None)
+
+    def release(self, receipts):
+        with self.__lock:
+            for receipt in receipts:
+                if receipt in self.__messages:
+                    body, sent_at, in_flight = self.__messages[receipt]
+                    self.__messages[receipt] = (body, sent_at, False)
+
+
+class SqsWriteBuffer:
+    """
+    Buffer of write entries in an Amazon SQS queue, one JSON message per entry.
+    FIFO queues get the dedup_key of an entry as MessageDeduplicationId, so retried writes are dropped by SQS.
+    """
+
+    def __init__(self, queue_url, client_factory=None, depth_cache_seconds=10):
+        self.queue_url = queue_url
+        self.max_message_bytes = SQS_MAX_BATCH_BYTES
+        self.depth_cache_seconds = depth_cache_seconds
+        self.__client_factory = client_factory or create_sqs_client
+        self.__client = None
+        # (approximate number of messages, checked at in monotonic seconds)
+        self.__depth = None
+
+    def put(self, bodies):
+        batch = []
+        batch_bytes = 0
+        for body in bodies:
+            message = json.dumps(body, separators=(',', ':'))
+            if batch and (len(batch) >= SQS_MAX_BATCH_MESSAGES or batch_bytes + len(message) > SQS_MAX_BATCH_BYTES):
+                self.__send_batch(batch)
+                batch = []
+                batch_bytes = 0
+            batch.append((body, message))
+            batch_bytes += len(message)
+        if batch:
+            self.__send_batch(batch)
+
+    def __send_batch(self, batch):
+        request_entries = []
+        for (index, (body, message)) in enumerate(batch):
+            request_entry = {'Id': str(index), 'MessageBody': message}
+            if self.queue_url.endswith('.fifo'):
+                request_entry['MessageGroupId'] = body['entry']['entryId']
+                request_entry['MessageDeduplicationId'] = dedup_key(body)
+            request_entries.append(request_entry)
+
+        response = self.__get_client().send_message_batch(QueueUrl=self.queue_url, Entries=request_entries)
+        if response.get('Failed'):
+            raise Exception('Failed to buffer write entries: {}'.format(response['Failed']))
+
+    def approximate_depth(self):
+        # checked at most every depth_cache_seconds, so buffered writes do not pay for it on every request
+        if self.__depth is None or time.monotonic() - self.__depth[1] >= self.depth_cache_seconds:
+            attributes = self.__get_client().get_queue_attributes(QueueUrl=self.queue_url,
+                                                                  AttributeNames=['ApproximateNumberOfMessages'])
+            self.__depth = (int(attributes['Attributes']['ApproximateNumberOfMessages']), time.monotonic())
+        return self.__depth[0]
+
+    def receive(self, max_messages):
+        messages = []
+        while len(messages) < max_messages:
+            response = self.__get_client().receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(SQS_MAX_BATCH_MESSAGES, max_messages - len(messages)),
+                VisibilityTimeout=WRITE_BUFFER_VISIBILITY_TIMEOUT_SECONDS,
+                WaitTimeSeconds=WRITE_BUFFER_RECEIVE_WAIT_SECONDS,
+                AttributeNames=['SentTimestamp'])
+            received = response.get('Messages', [])
+            if not received:
+                break
+            for message in received:
+                messages.append(BufferedMessage(message['ReceiptHandle'], json.loads(message['Body']),
+                                                int(message['Attributes']['SentTimestamp']) / 1000))
+        return messages
+
+    def delete(self, receipts):
+        for start in range(0, len(receipts), SQS_MAX_BATCH_MESSAGES):
+            self.__get_client().delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(index), 'ReceiptHandle': receipt}
+                         for (index, receipt) in enumerate(receipts[start: start + SQS_MAX_BATCH_MESSAGES])])
+
+    def release(self, receipts):
+        for start in range(0, len(receipts), SQS_MAX_BATCH_MESSAGES):
+            self.__get_client().change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(index), 'ReceiptHandle': receipt, 'VisibilityTimeout': 0}
+                         for (index, receipt) in enumerate(receipts[start: start + SQS_MAX_BATCH_MESSAGES])])
+
+    def __get_client(self):
+        if self.__client is None:
+            self.__client = self.__client_factory()
+        return self.__client
+
+
+def create_sqs_client():
+    # boto3 is imported on the first buffered write instead of at container start
+    import boto3
+
+    return boto3.session.Session().client(service_name='sqs')
+
+
+def create_write_buffer():
+    # buffered entries are acknowledged to the writer, they must outlive the Lambda container
+    if not WRITE_BUFFER_QUEUE_URL:
+        raise ValueError('WRITE_BUFFER_QUEUE_URL is required to buffer writes')
+    return SqsWriteBuffer(WRITE_BUFFER_QUEUE_URL)
+
+
+def create_dead_letter_buffer():
+    return SqsWriteBuffer(WRITE_BUFFER_DEAD_LETTER_QUEUE_URL) if WRITE_BUFFER_DEAD_LETTER_QUEUE_URL else None
@@ -0,0 +1,137 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Round trips of DataReaderByComponentType to drain an alarm status filter, against a local SQLite stand-in.
+
+The alarm table is generated in memory, every alarm with the same number of events and a given share of the alarms
+with the filtered status as their latest one. Pages are read in ASCENDING order until no next token is returned:
+
+- limit-then-filter: the query before the status filter was reworked, LIMIT inside the subquery and the status
+  filter outside, with a next token when the filtered page is full
+- limit-then-filter, raw token: the same query with a next token whenever the subquery read a full page
+- filter-then-page: the current query, the latest status of every alarm filtered first, SQLite has no QUALIFY so
+  it is written as a window subquery
+
+Usage:
+
+    python scripts/alarm_filter_benchmark.py [--alarms 1000] [--events 20] [--matching 0.1] [--max-results 100]
+"""
+
+import argparse
+import random
+import sqlite3
+import sys
+import zlib
+from datetime import datetime, timedelta
+
+from cold_start_benchmark import LAMBDA_DIRECTORY, install_stubs
+
+START_TIME = '2022-01-01T00:00:00'
+END_TIME = '2022-01-02T00:00:00'
+STATUS = 'ACTIVE'
+
+
+def snowflake_hash(*values):
+    # stands in for Snowflake's HASH(), only equal values need equal hashes
+    return zlib.crc32(repr(values).encode('utf-8')) - 2 ** 31
+
+
+def create_database(alarms, events, matching):
+    database = sqlite3.connect(':memory:')
+    database.create_function('HASH', -1, snowflake_hash)
+    database.execute('create table ALARMS (ALARM_ID text, EVENT_TIME text, STATUS text)')
+    generator = random.Random(0)
+    start = datetime(2022, 1, 1, 0, 0, 1)
+    rows = []
+    expected = 0
+    for alarm in range(alarms):
+        event_times = sorted(generator.sample(range(86000), events))
+        latest_status = STATUS if alarm < alarms * matching else 'NORMAL'
+        for (index, event_time) in enumerate(event_times):
+            status = latest_status if index == events - 1 else generator.choice([STATUS, 'NORMAL', 'ACKED'])
+            rows.append(('alarm-{}'.format(alarm), (start + timedelta(seconds=event_time)).isoformat(), status))
+        if latest_status == STATUS:
+            expected += events
+    database.executemany('insert into ALARMS values (?, ?, ?)', rows)
+    return database, expected
+
+
+def drain_limit_then_filter(database, max_results, raw_token):
+    round_trips = 0
+    returned = 0
+    start_time = START_TIME
+    while True:
+        rows = database.execute(
+            'select ALARM_ID, EVENT_TIME, STATUS from ('
+            'select ALARM_ID, EVENT_TIME, STATUS, '
+            'first_value(STATUS) over (partition by ALARM_ID order by EVENT_TIME desc) LAST_STATUS '
+            'from ALARMS where EVENT_TIME > ? and EVENT_TIME <= ? order by EVENT_TIME asc limit ?) '
+            'where LAST_STATUS = ?', [start_time, END_TIME, max_results, STATUS]).fetchall()
+        round_trips += 1
+        returned += len(rows)
+        if raw_token:
+            # the page size and last event time of the subquery, which the old response did not expose,
+            # not counted as a round trip
+            page_rows = database.execute(
+                'select count(*), max(EVENT_TIME) from (select EVENT_TIME from ALARMS where EVENT_TIME > ? and '
+                'EVENT_TIME <= ? order by EVENT_TIME asc limit ?)', [start_time, END_TIME, max_results]).fetchone()
+            if page_rows[0] < max_results:
+                return round_trips, returned
+            start_time = page_rows[1]
+        else:
+            if len(rows) < max_results:
+                return round_trips, returned
+            start_time = rows[-1][1]
+
+
+def drain_filter_then_page(reader, database, max_results):
+    round_trips = 0
+    returned = 0
+    (start_time, last_tie_breaker) = (START_TIME, None)
+    tie_breaker = reader.ALARM_TIE_BREAKER_EXPRESSION
+    while True:
+        (predicate, parameters) = reader.generate_event_time_predicate(
+            start_time, END_TIME, '<=', 'ASC', reader.parse_tie_breaker(last_tie_breaker))
+        rows = database.execute(
+            'select ALARM_ID, EVENT_TIME, STATUS, {} from ('
+            'select ALARM_ID, EVENT_TIME, STATUS, '
+            'first_value(STATUS) over (partition by ALARM_ID order by EVENT_TIME desc) LAST_STATUS '
+            'from ALARMS where EVENT_TIME > ? and EVENT_TIME <= ?) '
+            'where LAST_STATUS = ? and {} order by EVENT_TIME asc, ALARM_ID asc, {} asc limit ?'.format(
+                tie_breaker, predicate, tie_breaker),
+            [START_TIME, END_TIME, STATUS] + parameters + [max_results]).fetchall()
+        round_trips += 1
+        returned += len(rows)
+        if len(rows) < max_results:
+            return round_trips, returned
+        (start_time, last_tie_breaker) = (rows[-1][1], [rows[-1][0], rows[-1][3]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Round trips to drain an alarm status filter')
+    parser.add_argument('--alarms', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=20, help='events per alarm')
+    parser.add_argument('--matching', type=float, default=0.1, help='share of alarms with the filtered status')
+    parser.add_argument('--max-results', type=int, default=100)
+    arguments = parser.parse_args()
+
+    install_stubs()
+    sys.path.insert(0, LAMBDA_DIRECTORY)
+    import data_reader_by_component_type
+
+    (database, expected) = create_database(arguments.alarms, arguments.events, arguments.matching)
+    results = [
+        ('limit-then-filter', drain_limit_then_filter(database, arguments.max_results, False)),
+        ('limit-then-filter, raw token', drain_limit_then_filter(database, arguments.max_results, True)),
+        ('filter-then-page', drain_filter_then_page(data_reader_by_component_type, database, arguments.max_results))
+    ]
+    print('{} of {} events match, maxResults {}'.format(expected, arguments.alarms * arguments.events,
+                                                        arguments.max_results))
+    print('{:30} {:>11} {:>15}'.format('query', 'round trips', 'events returned'))
+    for (name, (round_trips, returned)) in results:
+        print('{:30} {:>11} {:>15}'.format(name, round_trips, returned))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Cold start benchmark of the connector Lambda entry points.
+
+Every entry point is loaded in a fresh `python -X importtime` process, like a new Lambda container, with
+snowflake.connector and boto3 replaced by stubs, so the numbers show the cost of the connector's own imports and
+of its first invocation, without network calls. Usage:
+
+    python scripts/cold_start_benchmark.py [entry point ...] [--runs N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+LAMBDA_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda_connectors')
+
+TIMESERIES_PROPERTIES = {
+    'timeseriesTableName': {'value': {'stringValue': 'TIMESERIES'}},
+    'temperature': {'definition': {'configuration': {'PT': 'PT_TEMPERATURE'}, 'dataType': {'type': 'DOUBLE'}}}
+}
+
+# entry point -> first event of the benchmark
+EVENTS = {
+    'data_reader_by_entity': {
+        'workspaceId': 'workspace', 'entityId': 'entity', 'componentName': 'component',
+        'selectedProperties': ['temperature'], 'properties': TIMESERIES_PROPERTIES,
+        'startTime': '2022-01-01T00:00:00', 'endTime': '2022-01-02T00:00:00', 'maxResults': 100
+    },
+    'data_reader_by_component_type': {
+        'workspaceId': 'workspace', 'entityId': 'entity', 'componentName': 'component',
+        'selectedProperties': ['alarm_status'], 'properties': {},
+        'startTime': '2022-01-01T00:00:00', 'endTime': '2022-01-02T00:00:00', 'maxResults': 100
+    },
+    'attribute_property_value_reader_by_entity': {
+        'workspaceId': 'workspace', 'entityId': 'entity', 'componentName': 'component',
+        'selectedProperties': ['model'],
+        'properties': {
+            'attributePropertyTableName': {'value': {'stringValue': 'ATTRIBUTES'}},
+            'elem_id': {'value': {'stringValue': 'element'}},
+            'model': {'definition': {'dataType': {'type': 'STRING'}}}
+        }
+    },
+    'data_writer': {
+        'workspaceId': 'workspace',
+        'properties': {'entity': TIMESERIES_PROPERTIES},
+        'entries': [{
+            'entryId': 'entry',
+            'entityPropertyReference': {'entityId': 'entity', 'propertyName': 'temperature'},
+            'propertyValues': [{'time': '2022-01-01T00:00:00', 'value': {'doubleValue': 21.5}}]
+        }]
+    },
+    'schema_initializer_entity': {
+        'properties': {
+            'elemId': {'value': {'stringValue': 'element'}},
+            'entityPropertyTableName': {'value': {'stringValue': 'ELEMENTS'}}
+        }
+    }
+}
+
+
+class StubCursor:
+    rowcount = 0
+    sfqid = 'stub'
+
+    def execute(self, *args, **kwargs):
+        return self
+
+    def executemany(self, *args, **kwargs):
+        return self
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def fetch_arrow_all(self):
+        return None
+
+    def __iter__(self):
+        return iter([])
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    def cursor(self):
+        return StubCursor()
+
+    def is_closed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class StubSecretsManagerClient:
+    def get_secret_value(self, SecretId):
+        return {'SecretString': json.dumps({key: 'stub' for key in
+                                            ['ACCOUNT', 'USER', 'PASSWORD', 'ROLE', 'WAREHOUSE', 'DATABASE',
+                                             'SCHEMA']})}
+
+
+def install_stubs():
+    """
+    Stand-ins for the packages of the Lambda runtime and layer that the benchmark does not measure
+    """
+    errors = types.ModuleType('snowflake.connector.errors')
+    errors.Error = type('Error', (Exception,), {})
+    errors.DatabaseError = type('DatabaseError', (errors.Error,), {})
+    errors.OperationalError = type('OperationalError', (errors.DatabaseError,), {})
+    errors.ProgrammingError = type('ProgrammingError', (errors.DatabaseError,), {})
+    connector = types.ModuleType('snowflake.connector')
+    connector.errors = errors
+    connector.connect = lambda **kwargs: StubConnection()
+    snowflake = types.ModuleType('snowflake')
+    snowflake.connector = connector
+
+    session = types.SimpleNamespace(client=lambda *args, **kwargs: StubSecretsManagerClient())
+    boto3 = types.ModuleType('boto3')
+    boto3.session = types.SimpleNamespace(Session=lambda *args, **kwargs: session)
+    boto3.client = lambda *args, **kwargs: StubSecretsManagerClient()
+
+    sys.modules.update({
+        'snowflake': snowflake,
+        'snowflake.connector': connector,
+        'snowflake.connector.errors': errors,
+        'boto3': boto3
+    })
+
+
+def run_entry_point(entry_point):
+    """
+    Child process: import the entry point and call its handler once, print the timings as JSON
+    """
+    install_stubs()
+    sys.path.insert(0, LAMBDA_DIRECTORY)
+
+    start = time.perf_counter()
+    module = __import__(entry_point)
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    error = None
+    try:
+        module.lambda_handler(EVENTS[entry_point], None)
+    except Exception as e:
+        # stub rows are empty, a handler may reject them after the work that is measured
+        error = '{}: {}'.format(type(e).__name__, e)
+    first_call_seconds = time.perf_counter() - start
+
+    print(json.dumps({'import': import_seconds, 'firstCall': first_call_seconds, 'error': error}))
+
+
+def parse_import_times(stderr, entry_point):
+    """
+    Cumulative import time of the entry point, and the slowest modules it imports, from -X importtime output.
+    A module is listed after the modules it imports, indented one level deeper.
+    """
+    lines = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        module_name = name.lstrip()
+        lines.append((int(fields[1]), len(name) - len(module_name), module_name))
+        if module_name != entry_point:
+            continue
+
+        (microseconds, level, _) = lines[-1]
+        imported = []
+        for (module_microseconds, module_level, name) in reversed(lines[:-1]):
+            if module_level <= level:
+                break
+            imported.append((module_microseconds, name))
+        slowest = [name for (_, name) in sorted(imported, reverse=True)[:5]]
+        return microseconds, slowest
+    return None, []
+
+
+def benchmark(entry_point, runs):
+    import_seconds = []
+    cumulative_seconds = []
+    first_call_seconds = []
+    slowest = []
+    error = None
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child', entry_point],
+            capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+        if completed.returncode != 0:
+            raise RuntimeError('{} failed:\n{}'.format(entry_point, completed.stderr))
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_seconds.append(result['import'])
+        first_call_seconds.append(result['firstCall'])
+        error = result['error']
+        (microseconds, slowest) = parse_import_times(completed.stderr, entry_point)
+        if microseconds is not None:
+            cumulative_seconds.append(microseconds / 1e6)
+    return {
+        'entryPoint': entry_point,
+        'importMs': round(statistics.median(import_seconds) * 1000, 1),
+        'importTimeMs': round(statistics.median(cumulative_seconds) * 1000, 1) if cumulative_seconds else None,
+        'firstCallMs': round(statistics.median(first_call_seconds) * 1000, 1),
+        'slowestImports': slowest,
+        'error': error
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark of the connector Lambda entry points')
+    parser.add_argument('entry_points', nargs='*', default=list(EVENTS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        run_entry_point(arguments.child)
+        return
+
+    print('{:45} {:>10} {:>14} {:>13}  {}'.format('entry point', 'import ms', 'importtime ms', 'first call ms',
+                                                 'slowest imports'))
+    for entry_point in arguments.entry_points:
+        result = benchmark(entry_point, arguments.runs)
+        print('{:45} {:>10} {:>14} {:>13}  {}'.format(result['entryPoint'], result['importMs'],
+                                                     str(result['importTimeMs']), result['firstCallMs'],
+                                                     ', '.join(result['slowestImports'])))
+        if result['error']:
+            print('    first call raised {}'.format(result['error']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Benchmark of the Arrow and tuple fetch paths of the reader Lambdas.
+
+Every case runs in a fresh process with snowflake.connector replaced by the stubs of cold_start_benchmark.py and a
+cursor returning a prepared result, as tuples or as an Arrow table. The numbers show the cost of building the
+response from the result in a warm container, not the cost of the connector decoding it. Peak memory is the
+tracemalloc peak of the Python heap plus the growth of the Arrow memory pool during the call. Usage:
+
+    python scripts/fetch_benchmark.py [--rows 1000,10000,50000] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta
+
+from cold_start_benchmark import LAMBDA_DIRECTORY, install_stubs
+
+READERS = ['data_reader_by_entity', 'data_reader_by_component_type']
+FETCH_PATHS = ['tuple', 'arrow']
+START_TIME = datetime(2022, 1, 1, 0, 0, 1)
+
+
+class PreparedCursor:
+
+    def __init__(self, rows, table):
+        self.rows = rows
+        self.table = table
+
+    def execute(self, *args, **kwargs):
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetch_arrow_all(self):
+        return self.table
+
+    def close(self):
+        pass
+
+
+def generate_result(reader, rows):
+    """
+    (event, rows, column names) of a reader, in the select list order of its query
+    """
+    timestamps = [START_TIME + timedelta(milliseconds=row) for row in range(rows)]
+    event = {
+        'workspaceId': 'workspace', 'entityId': 'entity', 'componentName': 'component',
+        'startTime': '2022-01-01T00:00:00', 'endTime': '2022-01-02T00:00:00', 'maxResults': rows
+    }
+    if reader == 'data_reader_by_entity':
+        event['selectedProperties'] = ['temperature']
+        event['properties'] = {
+            'timeseriesTableName': {'value': {'stringValue': 'TIMESERIES'}},
+            'temperature': {'definition': {'configuration': {'PT': 'PT_TEMPERATURE'},
+                                           'dataType': {'type': 'DOUBLE'}}}
+        }
+        return (event, [('PT_TEMPERATURE', float(row), timestamps[row], row, None) for row in range(rows)],
+                ['PT', 'PT_VALUE', 'TS', 'TIE_BREAKER', 'PT_VALUE_STR'])
+
+    event['selectedProperties'] = ['alarm_status']
+    event['properties'] = {}
+    return (event, [('alarm-{}'.format(row % 100), timestamps[row], 'ACTIVE', row) for row in range(rows)],
+            ['ALARM_ID', 'EVENT_TIME', 'STATUS', 'TIE_BREAKER'])
+
+
+def run_case(reader_name, fetch_path, rows, runs):
+    """
+    Child process: call the reader runs times on a prepared result, print the timings and peak memory as JSON
+    """
+    # every run reads Snowflake, the result cache and the response budget would cut the runs short
+    os.environ['RESULT_CACHE_TTL_SECONDS'] = '0'
+    os.environ['RESPONSE_MAX_BYTES'] = str(1024 * 1024 * 1024)
+    os.environ['ARROW_FETCH_ENABLED'] = 'true' if fetch_path == 'arrow' else 'false'
+    install_stubs()
+    sys.path.insert(0, LAMBDA_DIRECTORY)
+    import pyarrow
+    reader = __import__(reader_name)
+
+    (event, result_rows, column_names) = generate_result(reader_name, rows)
+    table = pyarrow.table([pyarrow.array(column, type=pyarrow.timestamp('ns')) if isinstance(column[0], datetime)
+                           else pyarrow.array(column) for column in zip(*result_rows)], names=column_names)
+    reader.SNOWFLAKE_CONNECTION_MANAGER = types.SimpleNamespace(cursor=lambda: PreparedCursor(result_rows, table),
+                                                                handle_error=lambda error: None)
+
+    # the first call imports pyarrow.compute, measured by cold_start_benchmark.py instead
+    reader.lambda_handler(event, None)
+    memory_pool = pyarrow.default_memory_pool()
+    allocated_bytes = memory_pool.bytes_allocated()
+    tracemalloc.start()
+    reader.lambda_handler(event, None)
+    python_peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    arrow_peak_bytes = max(0, memory_pool.max_memory() - allocated_bytes)
+
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        reader.lambda_handler(event, None)
+        seconds.append(time.perf_counter() - start)
+
+    print(json.dumps({'seconds': statistics.median(seconds), 'peakBytes': python_peak_bytes + arrow_peak_bytes}))
+
+
+def benchmark(reader_name, fetch_path, rows, runs):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', reader_name, fetch_path, str(rows), str(runs)],
+        capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError('{} {} failed:\n{}'.format(reader_name, fetch_path, completed.stderr))
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        'medianMs': round(result['seconds'] * 1000, 1),
+        'rowsPerSecond': int(rows / result['seconds']),
+        'peakKiB': result['peakBytes'] // 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the Arrow and tuple fetch paths of the readers')
+    parser.add_argument('--rows', default='1000,10000,50000')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        (reader_name, fetch_path, rows, runs) = arguments.child
+        run_case(reader_name, fetch_path, int(rows), int(runs))
+        return
+
+    print('{:30} {:>7} {:6} {:>10} {:>10} {:>9}'.format('reader', 'rows', 'fetch', 'median ms', 'rows/s',
+                                                       'peak KiB'))
+    for reader_name in READERS:
+        for rows in [int(value) for value in arguments.rows.split(',')]:
+            for fetch_path in FETCH_PATHS:
+                result = benchmark(reader_name, fetch_path, rows, arguments.runs)
+                print('{:30} {:>7} {:6} {:>10} {:>10} {:>9}'.format(reader_name, rows, fetch_path,
+                                                                   result['medianMs'], result['rowsPerSecond'],
+                                                                   result['peakKiB']))
+
+
+if __name__ == '__main__':
+    main()
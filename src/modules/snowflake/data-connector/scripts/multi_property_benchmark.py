@@ -0,0 +1,133 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Benchmark of the QUERY_MODE of DataReaderByEntity as the number of selected properties grows.
+
+snowflake.connector is replaced by the stubs of cold_start_benchmark.py, and every statement sleeps for a fixed
+round trip before its rows are returned, so the numbers show the statements per request and the latency they add
+under that round trip, not the query time of a warehouse. Usage:
+
+    python scripts/multi_property_benchmark.py [--properties 1,5,10,30] [--rows 100] [--round-trip-ms 50] [--runs 5]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta
+
+from cold_start_benchmark import LAMBDA_DIRECTORY, install_stubs
+
+QUERY_MODES = ['SINGLE_PROPERTY', 'MULTI_PROPERTY', 'CONCURRENT']
+
+
+class RoundTripCursor:
+    """
+    Returns up to max_results rows of every PT bound to a statement, after sleeping for the round trip
+    """
+
+    def __init__(self, rows_by_pt, round_trip_seconds, statements):
+        self.rows_by_pt = rows_by_pt
+        self.round_trip_seconds = round_trip_seconds
+        self.statements = statements
+        self.rows = []
+
+    def execute(self, query, parameters):
+        self.statements.append(query)
+        time.sleep(self.round_trip_seconds)
+        self.rows = [row for parameter in parameters if isinstance(parameter, str) and parameter in self.rows_by_pt
+                     for row in self.rows_by_pt[parameter][:parameters[-1]]]
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+def generate_event(property_count, rows):
+    properties = {'timeseriesTableName': {'value': {'stringValue': 'TIMESERIES'}}}
+    for index in range(property_count):
+        properties['property{}'.format(index)] = {
+            'definition': {'configuration': {'PT': 'PT{}'.format(index)}, 'dataType': {'type': 'DOUBLE'}}}
+    return {
+        'workspaceId': 'workspace', 'entityId': 'entity', 'componentName': 'component',
+        'selectedProperties': [name for name in properties if name != 'timeseriesTableName'],
+        'properties': properties,
+        'startTime': '2022-01-01T00:00:00', 'endTime': '2022-01-02T00:00:00', 'maxResults': rows
+    }
+
+
+def generate_rows(property_count, rows):
+    start = datetime(2022, 1, 1, 0, 0, 1)
+    return {'PT{}'.format(index): [('PT{}'.format(index), float(row), start + timedelta(seconds=row), row, None)
+                                   for row in range(rows)]
+            for index in range(property_count)}
+
+
+def benchmark(reader, query_mode, property_count, rows, round_trip_seconds, runs):
+    event = generate_event(property_count, rows)
+    rows_by_pt = generate_rows(property_count, rows)
+    statements = []
+    reader.QUERY_MODE = query_mode
+    reader.SNOWFLAKE_CONNECTION_MANAGER = types.SimpleNamespace(
+        cursor=lambda: RoundTripCursor(rows_by_pt, round_trip_seconds, statements),
+        handle_error=lambda error: None)
+
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = reader.lambda_handler(event, None)
+        seconds.append(time.perf_counter() - start)
+    returned_rows = sum(len(property_value['values']) for property_value in response['propertyValues'])
+
+    tracemalloc.start()
+    reader.lambda_handler(event, None)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    median_seconds = statistics.median(seconds)
+    return {
+        'statements': len(statements) // (runs + 1),
+        'medianMs': round(median_seconds * 1000, 1),
+        'rowsPerSecond': int(returned_rows / median_seconds),
+        'peakKiB': peak_bytes // 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the QUERY_MODE of DataReaderByEntity')
+    parser.add_argument('--properties', default='1,5,10,30')
+    parser.add_argument('--rows', type=int, default=100, help='rows per property, also the maxResults')
+    parser.add_argument('--round-trip-ms', type=float, default=50)
+    parser.add_argument('--runs', type=int, default=5)
+    arguments = parser.parse_args()
+
+    # every run reads Snowflake, the result cache and the response budget would cut the runs short
+    os.environ['RESULT_CACHE_TTL_SECONDS'] = '0'
+    os.environ['RESPONSE_MAX_BYTES'] = str(1024 * 1024 * 1024)
+    install_stubs()
+    sys.path.insert(0, LAMBDA_DIRECTORY)
+    import data_reader_by_entity
+    from utils import columnar
+    # the stub cursor only returns tuples
+    columnar.ARROW_FETCH_ENABLED = False
+
+    print('{:>10} {:16} {:>10} {:>10} {:>12} {:>9}'.format('properties', 'query mode', 'statements', 'median ms',
+                                                         'rows/s', 'peak KiB'))
+    for property_count in [int(value) for value in arguments.properties.split(',')]:
+        for query_mode in QUERY_MODES:
+            result = benchmark(data_reader_by_entity, query_mode, property_count, arguments.rows,
+                               arguments.round_trip_ms / 1000, arguments.runs)
+            print('{:>10} {:16} {:>10} {:>10} {:>12} {:>9}'.format(property_count, query_mode, result['statements'],
+                                                                 result['medianMs'], result['rowsPerSecond'],
+                                                                 result['peakKiB']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Micro-partitions scanned by a time-series query with and without the partition predicate of
+PARTITION_PRUNING_ENABLED, in a model of Snowflake's min/max pruning.
+
+A time-series table is generated in memory, one row per PT every --interval-minutes, and cut into micro-partitions
+of --partition-rows rows in one of these row orders:
+
+- ingestion: TS order, every PT interleaved, as rows written as they are measured
+- late arrivals: ingestion order with a --late share of the rows written up to --late-days days after their TS
+- clustered: CLUSTER BY (PT, YEAR, MONTH, DAY), TS unordered within a day
+
+A partition is scanned unless the min/max of one of its columns excludes a predicate of the query, which is what
+Snowflake does with its partition metadata. The PT and TS predicates come from the reader query, the partition
+predicate from utils.partition_predicate. The model does not show the partition sizes, the clustering depth or the
+pruning of a real account. Usage:
+
+    python scripts/partition_pruning_benchmark.py [--pts 50] [--days 90] [--interval-minutes 10]
+        [--partition-rows 10000] [--late 0.05] [--late-days 30]
+"""
+
+import argparse
+import random
+import re
+import sys
+from datetime import datetime, timedelta
+
+from cold_start_benchmark import LAMBDA_DIRECTORY
+
+START_TIME = datetime(2021, 12, 1)
+PARTITION_COLUMNS = ('YEAR', 'MONTH', 'DAY')
+# name -> (first day, days) of a query of one PT, days counted from START_TIME
+QUERIES = [
+    ('one PT, one day', 45, 1),
+    ('one PT, one week across months', 55, 7),
+    ('one PT, every day', 0, None)
+]
+COLUMNS = ['PT', 'TS', 'YEAR', 'MONTH', 'DAY']
+
+
+def generate_rows(pts, days, interval_minutes):
+    """
+    (PT, TS, YEAR, MONTH, DAY, write time) rows in TS order
+    """
+    rows = []
+    for step in range(days * 24 * 60 // interval_minutes):
+        ts = START_TIME + timedelta(minutes=step * interval_minutes)
+        for pt in range(pts):
+            rows.append(('PT{:04d}'.format(pt), ts, ts.year, ts.month, ts.day, ts))
+    return rows
+
+
+def order_rows(rows, layout, late, late_days):
+    generator = random.Random(0)
+    if layout == 'ingestion':
+        return rows
+    if layout == 'late arrivals':
+        delayed = [row[:5] + (row[5] + timedelta(days=generator.uniform(0, late_days)) if generator.random() < late
+                              else row[5],) for row in rows]
+        return sorted(delayed, key=lambda row: row[5])
+    if layout == 'clustered':
+        shuffled = list(rows)
+        generator.shuffle(shuffled)
+        return sorted(shuffled, key=lambda row: (row[0], row[2], row[3], row[4]))
+    raise ValueError('Invalid layout {}'.format(layout))
+
+
+def partition_ranges(rows, partition_rows):
+    """
+    (min, max) of every column of every micro-partition
+    """
+    partitions = []
+    for start in range(0, len(rows), partition_rows):
+        partition = rows[start:start + partition_rows]
+        partitions.append({column: (min(row[index] for row in partition), max(row[index] for row in partition))
+                           for (index, column) in enumerate(COLUMNS)})
+    return partitions
+
+
+def query_ranges(partition_predicate, pt, lower_time, upper_time, pruning):
+    """
+    Column -> (lower, upper) bounds of a query, parsed from the partition predicate when pruning
+    """
+    ranges = {'PT': (pt, pt), 'TS': (lower_time, upper_time)}
+    if pruning:
+        (predicate, parameters) = partition_predicate.generate_partition_predicate(
+            lower_time.isoformat(), upper_time.isoformat(), PARTITION_COLUMNS)
+        for (index, column) in enumerate(re.findall(r'(\w+) between \? and \?', predicate)):
+            ranges[column] = (parameters[2 * index], parameters[2 * index + 1])
+    return ranges
+
+
+def scanned_partitions(partitions, ranges):
+    return sum(1 for partition in partitions
+               if all(partition[column][0] <= upper and lower <= partition[column][1]
+                      for (column, (lower, upper)) in ranges.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-partitions scanned with and without the partition predicate')
+    parser.add_argument('--pts', type=int, default=50)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--interval-minutes', type=int, default=10)
+    parser.add_argument('--partition-rows', type=int, default=10000)
+    parser.add_argument('--late', type=float, default=0.05, help='share of the rows written late')
+    parser.add_argument('--late-days', type=float, default=30, help='longest delay of a late row')
+    arguments = parser.parse_args()
+
+    sys.path.insert(0, LAMBDA_DIRECTORY)
+    from utils import partition_predicate
+
+    rows = generate_rows(arguments.pts, arguments.days, arguments.interval_minutes)
+    print('{} rows, {} rows per micro-partition'.format(len(rows), arguments.partition_rows))
+    print('{:14} {:32} {:>6} {:>12} {:>14}'.format('layout', 'query', 'total', 'TS predicate', 'with partition'))
+    for layout in ['ingestion', 'late arrivals', 'clustered']:
+        partitions = partition_ranges(order_rows(rows, layout, arguments.late, arguments.late_days),
+                                      arguments.partition_rows)
+        for (name, first_day, days) in QUERIES:
+            lower_time = START_TIME + timedelta(days=first_day)
+            upper_time = lower_time + timedelta(days=days if days else arguments.days)
+            scanned = [scanned_partitions(partitions, query_ranges(partition_predicate, 'PT0007', lower_time,
+                                                                   upper_time, pruning)) for pruning in (False, True)]
+            print('{:14} {:32} {:>6} {:>12} {:>14}'.format(layout, name, len(partitions), scanned[0], scanned[1]))
+
+
+if __name__ == '__main__':
+    main()
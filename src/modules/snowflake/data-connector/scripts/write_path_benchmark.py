@@ -0,0 +1,120 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Benchmark of the INSERT and staged file (PUT and COPY INTO) load paths of DataWriter by batch size.
+
+snowflake.connector is replaced by the stubs of cold_start_benchmark.py, and every statement sleeps for a fixed
+round trip, so the numbers show the statements per request, the writer's own encoding time and the latency under
+that round trip. They do not show the upload time of a staged file, the INSERT binding time of the connector or the
+load time of a warehouse. Usage:
+
+    python scripts/write_path_benchmark.py [--rows 1,10,100,500,2000] [--round-trip-ms 50] [--runs 50]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+import types
+
+from cold_start_benchmark import LAMBDA_DIRECTORY, install_stubs
+
+PROPERTIES = {
+    'pump': {
+        'timeseriesTableName': {'value': {'stringValue': 'TIMESERIES'}},
+        'temperature': {'definition': {'configuration': {'PT': 'PT_TEMPERATURE'}, 'dataType': {'type': 'DOUBLE'}}}
+    }
+}
+
+
+class LoadCursor:
+    """
+    Answers PUT and COPY INTO as if every row loaded, after sleeping for the round trip
+    """
+    sfqid = 'stub'
+
+    def __init__(self, round_trip_seconds, statements):
+        self.round_trip_seconds = round_trip_seconds
+        self.statements = statements
+        self.result = None
+
+    def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement.split(' ', 1)[0])
+        time.sleep(self.round_trip_seconds)
+        if statement.startswith('PUT'):
+            self.result = ('file', 'file.csv.gz', 0, 0, None, None, 'UPLOADED', '')
+        else:
+            self.result = ('file.csv.gz', 'LOADED', 0, 0, 0, 0, None, None)
+        return self
+
+    def executemany(self, statement, rows):
+        return self.execute(statement)
+
+    def fetchone(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def generate_entries(rows):
+    return [{
+        'entryId': '1',
+        'entityPropertyReference': {'entityId': 'pump', 'propertyName': 'temperature'},
+        'propertyValues': [{'time': '2022-01-01T00:{:02d}:{:02d}'.format(row // 60 % 60, row % 60),
+                            'value': {'doubleValue': float(row)}} for row in range(rows)]
+    }]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def benchmark(data_writer, bulk_loader, load_path, rows, round_trip_seconds, runs):
+    statements = []
+    bulk_loader.SNOWFLAKE_CONNECTION_MANAGER = types.SimpleNamespace(
+        cursor=lambda: LoadCursor(round_trip_seconds, statements), handle_error=lambda error: None)
+    data_writer.INSERT_MAX_ROWS = rows if load_path == 'INSERT' else 0
+    entries = generate_entries(rows)
+
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        data_writer.write_entries(entries, PROPERTIES)
+        seconds.append(time.perf_counter() - start)
+    return {
+        'statements': len(statements) // runs,
+        'p50Ms': round(percentile(seconds, 0.5) * 1000, 1),
+        'p99Ms': round(percentile(seconds, 0.99) * 1000, 1),
+        'clientMs': round(max(0.0, statistics.median(seconds) - len(statements) // runs * round_trip_seconds) * 1000,
+                          2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the INSERT and staged file load paths of DataWriter')
+    parser.add_argument('--rows', default='1,10,100,500,2000')
+    parser.add_argument('--round-trip-ms', type=float, default=50)
+    parser.add_argument('--runs', type=int, default=50)
+    arguments = parser.parse_args()
+
+    install_stubs()
+    sys.path.insert(0, LAMBDA_DIRECTORY)
+    import data_writer
+    from utils import bulk_loader
+
+    print('{:>6} {:7} {:>10} {:>8} {:>8} {:>10}'.format('rows', 'path', 'statements', 'p50 ms', 'p99 ms',
+                                                       'client ms'))
+    for rows in [int(value) for value in arguments.rows.split(',')]:
+        for load_path in ['INSERT', 'STAGED']:
+            result = benchmark(data_writer, bulk_loader, load_path, rows, arguments.round_trip_ms / 1000,
+                               arguments.runs)
+            print('{:>6} {:7} {:>10} {:>8} {:>8} {:>10}'.format(rows, load_path, result['statements'],
+                                                               result['p50Ms'], result['p99Ms'],
+                                                               result['clientMs']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+# the flusher needs a queue at import, the tests inject an in-memory buffer instead
+os.environ.setdefault('WRITE_BUFFER_QUEUE_URL', 'https://sqs.us-east-1.amazonaws.com/123456789012/write-buffer')
+
+import pytest
+
+import buffer_flusher
+import data_writer
+from utils.write_buffer import BufferedMessage, InMemoryWriteBuffer, dedup_key
+
+PROPERTIES = {
+    'pump': {
+        'timeseriesTableName': {'value': {'stringValue': 'TIMESERIES'}},
+        'temperature': {'definition': {'configuration': {'PT': 'PT_TEMPERATURE'}}},
+        'pressure': {'definition': {'configuration': {'PT': 'PT_PRESSURE'}}}
+    }
+}
+
+
+def message_body(request_id, property_name, values, entry_id='1'):
+    return {
+        'requestId': request_id,
+        'entry': {
+            'entryId': entry_id,
+            'entityPropertyReference': {'entityId': 'pump', 'propertyName': property_name},
+            'propertyValues': [{'time': time, 'value': {'doubleValue': value}} for (time, value) in values]
+        },
+        'properties': {'pump': {property_name: PROPERTIES['pump'][property_name],
+                                'timeseriesTableName': PROPERTIES['pump']['timeseriesTableName']}}
+    }
+
+
+def messages(*bodies):
+    return [BufferedMessage(str(index), body, 0) for (index, body) in enumerate(bodies)]
+
+
+def test_entries_of_different_requests_sharing_an_entry_id_are_kept_apart():
+    temperature = message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5)])
+    pressure = message_body('request-2', 'pressure', [('2022-01-01T00:00:00', 1.2)])
+
+    (entries, properties, entry_messages) = buffer_flusher.coalesce_messages(messages(temperature, pressure))
+
+    assert [(entry['entryId'], entry['entityPropertyReference']['propertyName'], entry['propertyValues'])
+            for entry in entries] == [
+        ('request-1:1', 'temperature', temperature['entry']['propertyValues']),
+        ('request-2:1', 'pressure', pressure['entry']['propertyValues'])
+    ]
+    assert properties == PROPERTIES
+    assert {entry_id: [message.receipt for message in entry_messages[entry_id]] for entry_id in entry_messages} == \
+        {'request-1:1': ['0'], 'request-2:1': ['1']}
+    assert dedup_key(temperature) != dedup_key(pressure)
+
+
+def test_redelivered_message_is_loaded_once():
+    body = message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5), ('2022-01-01T00:00:01', 22.0)])
+
+    (entries, properties, entry_messages) = buffer_flusher.coalesce_messages(messages(body, body))
+
+    assert len(entries) == 1
+    assert entries[0]['propertyValues'] == body['entry']['propertyValues']
+
+
+def test_same_request_and_entry_id_with_other_values_are_deduplicated_on_timestamp():
+    first = message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5)])
+    second = message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5), ('2022-01-01T00:00:01', 22.0)])
+
+    (entries, properties, entry_messages) = buffer_flusher.coalesce_messages(messages(first, second))
+
+    assert len(entries) == 1
+    assert [value['time'] for value in entries[0]['propertyValues']] == ['2022-01-01T00:00:00',
+                                                                         '2022-01-01T00:00:01']
+
+
+@pytest.fixture
+def write_buffer(monkeypatch):
+    write_buffer = InMemoryWriteBuffer()
+    monkeypatch.setattr(buffer_flusher, 'WRITE_BUFFER', write_buffer)
+    monkeypatch.setattr(buffer_flusher, 'FLUSH_MIN_ENTRIES', 1)
+    return write_buffer
+
+
+@pytest.fixture
+def dead_letter_buffer(monkeypatch):
+    dead_letter_buffer = InMemoryWriteBuffer()
+    monkeypatch.setattr(buffer_flusher, 'DEAD_LETTER_BUFFER', dead_letter_buffer)
+    return dead_letter_buffer
+
+
+def fail_last_value_of_second_entry(entries, properties, skip_loaded_rows):
+    failed_entry = entries[1]
+    return [{'errors': [{'errorCode': 'SnowflakeException', 'errorMessage': 'failed',
+                         'entry': {'entryId': failed_entry['entryId'],
+                                   'entityPropertyReference': failed_entry['entityPropertyReference'],
+                                   'propertyValues': failed_entry['propertyValues'][-1:]}}]}]
+
+
+def test_only_failed_values_are_buffered_again(write_buffer, dead_letter_buffer, monkeypatch):
+    write_buffer.put([message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5)]),
+                      message_body('request-2', 'pressure', [('2022-01-01T00:00:00', 1.2),
+                                                             ('2022-01-01T00:00:01', 1.3)])])
+    monkeypatch.setattr(data_writer, 'write_entries', fail_last_value_of_second_entry)
+
+    assert buffer_flusher.lambda_handler({}, None) == {'flushedEntries': 2, 'errorEntries': 1}
+
+    # the loaded messages are gone, a new message holds the value that failed
+    [remaining] = write_buffer.receive(10)
+    assert remaining.body == dict(message_body('request-2', 'pressure', [('2022-01-01T00:00:01', 1.3)]), attempts=1)
+    assert dead_letter_buffer.approximate_depth() == 0
+
+
+def test_values_failing_every_attempt_move_to_the_dead_letter_buffer(write_buffer, dead_letter_buffer,
+                                                                     monkeypatch):
+    monkeypatch.setattr(buffer_flusher, 'FLUSH_MAX_ATTEMPTS', 2)
+    write_buffer.put([message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5)]),
+                      dict(message_body('request-2', 'pressure', [('2022-01-01T00:00:01', 1.3)]), attempts=1)])
+    monkeypatch.setattr(data_writer, 'write_entries', fail_last_value_of_second_entry)
+
+    buffer_flusher.lambda_handler({}, None)
+
+    assert write_buffer.approximate_depth() == 0
+    [dead_letter] = dead_letter_buffer.receive(10)
+    assert dead_letter.body['attempts'] == 2
+
+
+def test_messages_with_failed_values_are_released_without_dead_letter_buffer(write_buffer, monkeypatch):
+    monkeypatch.setattr(buffer_flusher, 'DEAD_LETTER_BUFFER', None)
+    write_buffer.put([message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5)]),
+                      message_body('request-2', 'pressure', [('2022-01-01T00:00:00', 1.2),
+                                                             ('2022-01-01T00:00:01', 1.3)])])
+    monkeypatch.setattr(data_writer, 'write_entries', fail_last_value_of_second_entry)
+
+    buffer_flusher.lambda_handler({}, None)
+
+    # the whole message is received again, its loaded value is skipped by the writer
+    remaining = write_buffer.receive(10)
+    assert [message.body['requestId'] for message in remaining] == ['request-2']
+    assert len(remaining[0].body['entry']['propertyValues']) == 2
+
+
+def test_all_messages_are_deleted_after_a_full_load(write_buffer, monkeypatch):
+    write_buffer.put([message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5)])])
+    monkeypatch.setattr(data_writer, 'write_entries', lambda entries, properties, skip_loaded_rows: [])
+
+    assert buffer_flusher.lambda_handler({}, None) == {'flushedEntries': 1, 'errorEntries': 0}
+    assert write_buffer.approximate_depth() == 0
+
+
+@pytest.mark.parametrize('scheduled_time,flushed_entries', [
+    ('2022-01-01T00:04:00Z', 0),
+    ('2022-01-01T00:05:00Z', 1)
+])
+def test_small_buffer_is_flushed_once_per_max_age_without_receiving(write_buffer, monkeypatch, scheduled_time,
+                                                                    flushed_entries):
+    monkeypatch.setattr(buffer_flusher, 'FLUSH_MIN_ENTRIES', 1000)
+    monkeypatch.setattr(buffer_flusher, 'FLUSH_MAX_AGE_SECONDS', 300)
+    monkeypatch.setattr(buffer_flusher, 'FLUSH_SCHEDULE_SECONDS', 60)
+    monkeypatch.setattr(data_writer, 'write_entries', lambda entries, properties, skip_loaded_rows: [])
+    write_buffer.put([message_body('request-1', 'temperature', [('2022-01-01T00:00:00', 21.5)])])
+
+    assert buffer_flusher.lambda_handler({'time': scheduled_time}, None)['flushedEntries'] == flushed_entries
+    # a flush that is not due leaves the message unreceived
+    assert len(write_buffer.receive(10)) == 1 - flushed_entries
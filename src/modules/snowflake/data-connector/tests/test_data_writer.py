@@ -0,0 +1,82 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import data_writer
+from utils import bulk_loader
+from utils.bulk_loader import SnowflakeBulkLoader
+
+PROPERTIES = {
+    'pump': {
+        'timeseriesTableName': {'value': {'stringValue': 'TIMESERIES'}},
+        'temperature': {'definition': {'configuration': {'PT': 'PT_TEMPERATURE'}}}
+    }
+}
+
+
+def entry(entry_id, values):
+    return {
+        'entryId': entry_id,
+        'entityPropertyReference': {'entityId': 'pump', 'propertyName': 'temperature'},
+        'propertyValues': [{'time': time, 'value': {'doubleValue': value}} for (time, value) in values]
+    }
+
+
+def test_failed_insert_reports_only_the_rows_copy_cannot_load(monkeypatch):
+    loader = data_writer.SNOWFLAKE_BULK_LOADER
+    copied_files = []
+
+    def copy_staged_file_into_table(target_file, table_name, total_rows, stage_prefix):
+        copied_files.append((target_file, table_name, total_rows))
+        # the second row of the staged file is the bad one
+        return ('PARTIALLY_LOADED', [1])
+    monkeypatch.setattr(loader, 'insert_rows_into_table', lambda table_name, batch: False)
+    monkeypatch.setattr(loader, 'put_file_into_stage',
+                        lambda staging_buffer, stage_prefix: (SnowflakeBulkLoader.PUT_SUCCESS_STATUS, 'file.csv.gz'))
+    monkeypatch.setattr(loader, 'copy_staged_file_into_table', copy_staged_file_into_table)
+    monkeypatch.setattr(data_writer, 'INSERT_MAX_ROWS', 500)
+    entries = [entry('1', [('2022-01-01T00:00:00', 21.5), ('2022-01-01T00:00:01', 22.0)]),
+               entry('2', [('2022-01-01T00:00:02', 22.5)])]
+
+    error_entries = data_writer.write_entries(entries, PROPERTIES)
+
+    assert copied_files == [('file.csv.gz', 'TIMESERIES', 3)]
+    assert [(error['entry']['entryId'], error['entry']['propertyValues'])
+            for error_entry in error_entries for error in error_entry['errors']] == \
+        [('1', [{'time': '2022-01-01T00:00:01', 'value': {'doubleValue': 22.0}}])]
+
+
+class LoadedRowsCursor:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query, parameters):
+        self.queries.append((query, parameters))
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+def test_rows_already_in_the_table_are_not_loaded_again(monkeypatch):
+    # the first value of entry 1 was loaded by an earlier flush, the table returns TS as a naive UTC datetime
+    cursor = LoadedRowsCursor([('PT_TEMPERATURE', datetime(2022, 1, 1, 0, 0, 0), 21.5, None),
+                               ('PT_TEMPERATURE', datetime(2022, 1, 1, 0, 0, 2), 99.0, None)])
+    monkeypatch.setattr(bulk_loader, 'SNOWFLAKE_CONNECTION_MANAGER', SimpleNamespace(cursor=lambda: cursor))
+    inserted_batches = []
+    monkeypatch.setattr(data_writer.SNOWFLAKE_BULK_LOADER, 'insert_rows_into_table',
+                        lambda table_name, batch: inserted_batches.append(batch) or True)
+    entries = [entry('1', [('2022-01-01T00:00:00.000Z', 21.5), ('2022-01-01T00:00:01Z', 22.0)]),
+               entry('2', [('2022-01-01T00:00:02Z', 22.5)])]
+
+    assert data_writer.write_entries(entries, PROPERTIES, skip_loaded_rows=True) == []
+
+    [(query, parameters)] = cursor.queries
+    assert parameters == ['TIMESERIES', 'PT_TEMPERATURE', '2022-01-01T00:00:00', '2022-01-01T00:00:02']
+    [batch] = inserted_batches
+    assert list(batch.rows(['TS', 'PT_VALUE'])) == [('2022-01-01T00:00:01', 22.0), ('2022-01-01T00:00:02', 22.5)]
+    assert batch.entry_ids == ['1', '2']
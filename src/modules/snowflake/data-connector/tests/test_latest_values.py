@@ -0,0 +1,38 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import data_reader_by_entity
+import data_writer
+from utils.timeseries_batch import TimeSeriesBatch
+
+START_TIME = '2022-01-01T00:00:00'
+END_TIME = '2022-01-02T00:00:00'
+
+
+def test_latest_timestamp_bounds_the_scan_from_below():
+    property_tuple = ('temperature', 'PT1', 'doubleValue', END_TIME, None)
+
+    assert data_reader_by_entity.generate_property_range_predicate(
+        property_tuple, START_TIME, END_TIME, 'DESC', '2022-01-01T06:00:00+00:00') == \
+        ('PT = ? and TS > ? and TS < ? and TS >= ?', ['PT1', START_TIME, END_TIME, '2022-01-01T06:00:00+00:00'])
+
+
+def test_only_latest_timestamps_within_the_time_range_are_bounds(monkeypatch):
+    rows = [('PT1', '2022-01-01T06:00:00+00:00'), ('PT2', '2022-01-03T00:00:00+00:00'),
+            ('PT3', '2021-12-31T00:00:00+00:00')]
+    monkeypatch.setattr(data_reader_by_entity, 'query_rows', lambda statements, timestamp_column_index: rows)
+
+    assert data_reader_by_entity.query_latest_timestamps('TIMESERIES_LATEST', ['PT1', 'PT2', 'PT3', 'PT4'],
+                                                         START_TIME, END_TIME) == \
+        {'PT1': '2022-01-01T06:00:00+00:00'}
+
+
+def test_failed_merge_does_not_report_loaded_points(monkeypatch):
+    batch = TimeSeriesBatch()
+    batch.append_entry('entry', 'PT1', 'time', 'value', [{'time': '2022-01-01T00:00:00', 'value': {'doubleValue': 1.0}}])
+    monkeypatch.setattr(data_writer.SNOWFLAKE_BULK_LOADER, 'merge_latest_values', lambda table_name, rows: False)
+    error_entry_map = {}
+
+    data_writer.merge_latest_values('TIMESERIES_LATEST', batch, error_entry_map)
+
+    assert error_entry_map == {}
@@ -0,0 +1,47 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+
+import pytest
+
+from utils import generate_next_token, parse_next_token
+
+
+def test_token_round_trip():
+    keys = {
+        'temperature': ('2022-01-01T00:00:01', 123456789),
+        'alarm_status': ('2022-01-01T00:00:02', ['alarm-1', -42]),
+        'pressure': ('2022-01-01T00:00:03', None)
+    }
+    token = generate_next_token(keys)
+
+    assert json.loads(token)['v'] == 2
+    assert parse_next_token(token, ['temperature', 'alarm_status', 'pressure']) == {
+        'temperature': ('2022-01-01T00:00:01', 123456789),
+        'alarm_status': ('2022-01-01T00:00:02', ['alarm-1', -42]),
+        'pressure': ('2022-01-01T00:00:03', None)
+    }
+
+
+def test_version_1_token_has_no_tie_breaker():
+    token = json.dumps({'temperature': '2022-01-01T00:00:01'})
+
+    assert parse_next_token(token, ['temperature']) == {'temperature': ('2022-01-01T00:00:01', None)}
+
+
+@pytest.mark.parametrize('token', [None, '', '  '])
+def test_empty_token(token):
+    assert parse_next_token(token, ['temperature']) is None
+
+
+def test_token_of_other_properties_is_rejected():
+    token = generate_next_token({'pressure': ('2022-01-01T00:00:01', 1)})
+
+    with pytest.raises(ValueError):
+        parse_next_token(token, ['temperature'])
+
+
+def test_invalid_token_is_rejected():
+    with pytest.raises(Exception):
+        parse_next_token('not a token', ['temperature'])
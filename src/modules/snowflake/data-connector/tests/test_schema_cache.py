@@ -0,0 +1,48 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from utils import schema_cache
+from utils.schema_cache import SchemaCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(schema_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_new_version_drops_the_rows_of_the_table(clock):
+    cache = SchemaCache(max_elements=10, version_check_seconds=60, ttl_seconds=300)
+    cache.validate('T', lambda: 'v1')
+    cache.put('T', {'e1': ['row']})
+
+    clock[0] += 61
+    cache.validate('T', lambda: 'v2')
+
+    assert cache.get('T', 'e1') is None
+
+
+def test_table_without_version_is_cached_for_the_ttl(clock):
+    cache = SchemaCache(max_elements=10, version_check_seconds=60, ttl_seconds=300)
+    lookups = []
+
+    def get_version():
+        lookups.append(clock[0])
+        return None
+
+    cache.validate('T', get_version)
+    cache.put('T', {'e1': ['row']})
+    clock[0] += 120
+    cache.validate('T', get_version)
+
+    assert cache.get('T', 'e1') == ['row']
+    assert len(lookups) == 1
+
+    clock[0] += 200
+    cache.validate('T', get_version)
+
+    assert cache.get('T', 'e1') is None
+    assert len(lookups) == 2
@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import threading
+import time
+
+import pytest
+
+from utils import secret_cache
+from utils.secret_cache import SecretCache
+
+
+class FakeSecretsManagerClient:
+    def __init__(self):
+        self.secrets = {'snowflake': json.dumps({'user': 'first'})}
+        self.calls = 0
+        self.fetched = threading.Event()
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        self.fetched.set()
+        return {'SecretString': self.secrets[SecretId]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def client():
+    return FakeSecretsManagerClient()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(secret_cache.time, 'time', clock.time)
+    return clock
+
+
+def test_secret_is_fetched_once_within_ttl(client, clock):
+    cache = SecretCache(client_factory=lambda: client, ttl_seconds=100, refresh_ratio=0.8)
+
+    assert cache.get_secret('snowflake') == {'user': 'first'}
+    clock.now += 50
+    assert cache.get_secret('snowflake') == {'user': 'first'}
+    assert client.calls == 1
+
+
+def test_expired_secret_is_fetched_again(client, clock):
+    cache = SecretCache(client_factory=lambda: client, ttl_seconds=100, refresh_ratio=1.0)
+    cache.get_secret('snowflake')
+
+    client.secrets['snowflake'] = json.dumps({'user': 'second'})
+    clock.now += 100
+    assert cache.get_secret('snowflake') == {'user': 'second'}
+    assert client.calls == 2
+
+
+def test_aging_secret_is_refreshed_in_background(client, clock):
+    cache = SecretCache(client_factory=lambda: client, ttl_seconds=100, refresh_ratio=0.8)
+    cache.get_secret('snowflake')
+
+    client.secrets['snowflake'] = json.dumps({'user': 'second'})
+    client.fetched.clear()
+    clock.now += 90
+    # the cached value is served while the refresh runs
+    assert cache.get_secret('snowflake') == {'user': 'first'}
+    assert client.fetched.wait(5)
+    deadline = time.monotonic() + 5
+    while cache.get_secret('snowflake') != {'user': 'second'} and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get_secret('snowflake') == {'user': 'second'}
+    assert client.calls == 2
+
+
+def test_invalidate_forces_a_fetch(client, clock):
+    cache = SecretCache(client_factory=lambda: client, ttl_seconds=100)
+    cache.get_secret('snowflake')
+
+    client.secrets['snowflake'] = json.dumps({'user': 'rotated'})
+    cache.invalidate('snowflake')
+    assert cache.get_secret('snowflake') == {'user': 'rotated'}
+    assert client.calls == 2
+
+
+def test_spilled_secret_is_read_by_a_new_cache(client, tmp_path):
+    fernet = pytest.importorskip('cryptography.fernet')
+    spill_key = fernet.Fernet.generate_key()
+    SecretCache(client_factory=lambda: client, spill_key=spill_key, spill_directory=str(tmp_path)) \
+        .get_secret('snowflake')
+
+    spill_files = list(tmp_path.iterdir())
+    assert len(spill_files) == 1
+    # the copy is encrypted
+    assert b'first' not in spill_files[0].read_bytes()
+
+    cache = SecretCache(client_factory=lambda: client, spill_key=spill_key, spill_directory=str(tmp_path))
+    assert cache.get_secret('snowflake') == {'user': 'first'}
+    assert client.calls == 1
+
+    cache.invalidate('snowflake')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spilled_secret_older_than_ttl_is_ignored(client, tmp_path):
+    fernet = pytest.importorskip('cryptography.fernet')
+    spill_key = fernet.Fernet.generate_key()
+    SecretCache(client_factory=lambda: client, spill_key=spill_key, spill_directory=str(tmp_path)) \
+        .get_secret('snowflake')
+
+    client.secrets['snowflake'] = json.dumps({'user': 'second'})
+    # Fernet timestamps have a resolution of one second
+    time.sleep(2.1)
+    cache = SecretCache(client_factory=lambda: client, ttl_seconds=1, spill_key=spill_key,
+                        spill_directory=str(tmp_path))
+    assert cache.get_secret('snowflake') == {'user': 'second'}
+    assert client.calls == 2
+
+
+def test_spill_with_another_key_is_ignored(client, tmp_path):
+    fernet = pytest.importorskip('cryptography.fernet')
+    SecretCache(client_factory=lambda: client, spill_key=fernet.Fernet.generate_key(),
+                spill_directory=str(tmp_path)).get_secret('snowflake')
+
+    cache = SecretCache(client_factory=lambda: client, spill_key=fernet.Fernet.generate_key(),
+                        spill_directory=str(tmp_path))
+    assert cache.get_secret('snowflake') == {'user': 'first'}
+    assert client.calls == 2
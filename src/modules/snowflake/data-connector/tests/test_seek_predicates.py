@@ -0,0 +1,172 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import sqlite3
+import zlib
+
+import pytest
+
+import data_reader_by_component_type
+import data_reader_by_entity
+from utils import generate_next_token, parse_next_token
+
+START_TIME = '2022-01-01T00:00:00'
+END_TIME = '2022-01-02T00:00:00'
+
+
+def snowflake_hash(*values):
+    # stands in for Snowflake's HASH(), only equal values need equal hashes
+    return zlib.crc32(repr(values).encode('utf-8')) - 2 ** 31
+
+
+@pytest.fixture
+def database():
+    connection = sqlite3.connect(':memory:')
+    connection.create_function('HASH', -1, snowflake_hash)
+    connection.execute('create table POINTS (PT text, TS text, PT_VALUE real, PT_VALUE_STR text)')
+    connection.execute('create table ALARMS (ALARM_ID text, EVENT_TIME text, STATUS text)')
+    yield connection
+    connection.close()
+
+
+def test_property_range_predicate_without_tie_breaker():
+    property_tuple = ('temperature', 'PT1', 'doubleValue', '2022-01-01T06:00:00', None)
+
+    assert data_reader_by_entity.generate_property_range_predicate(property_tuple, START_TIME, END_TIME, 'ASC') == \
+        ('PT = ? and TS > ? and TS < ?', ['PT1', '2022-01-01T06:00:00', END_TIME])
+    assert data_reader_by_entity.generate_property_range_predicate(property_tuple, START_TIME, END_TIME, 'DESC') == \
+        ('PT = ? and TS > ? and TS < ?', ['PT1', START_TIME, '2022-01-01T06:00:00'])
+
+
+def test_property_range_predicate_seeks_past_the_tie_breaker():
+    property_tuple = ('temperature', 'PT1', 'doubleValue', '2022-01-01T06:00:00', 7)
+
+    (predicate, parameters) = data_reader_by_entity.generate_property_range_predicate(property_tuple, START_TIME,
+                                                                                       END_TIME, 'ASC')
+    assert predicate == 'PT = ? and (TS > ? or (TS = ? and {} > ?)) and TS < ?'.format(
+        data_reader_by_entity.TIE_BREAKER_EXPRESSION)
+    assert parameters == ['PT1', '2022-01-01T06:00:00', '2022-01-01T06:00:00', 7, END_TIME]
+
+
+def page_through_points(database, order_by, max_results):
+    """
+    Read every page of PT1 the way DataReaderByEntity does, with the next token of each page
+    """
+    tie_breaker = data_reader_by_entity.TIE_BREAKER_EXPRESSION
+    start_key = START_TIME if order_by == 'ASC' else END_TIME
+    last_tie_breaker = None
+    rows = []
+    while True:
+        property_tuple = ('temperature', 'PT1', 'doubleValue', start_key, last_tie_breaker)
+        (predicate, parameters) = data_reader_by_entity.generate_property_range_predicate(
+            property_tuple, START_TIME, END_TIME, order_by)
+        page = database.execute(
+            'select PT, coalesce(PT_VALUE_STR, PT_VALUE), TS, {} from POINTS where {} order by TS {}, {} {} '
+            'limit ?'.format(tie_breaker, predicate, order_by, tie_breaker, order_by),
+            parameters + [max_results]).fetchall()
+        rows.extend(page)
+        if len(page) < max_results:
+            return rows
+        token = generate_next_token({'temperature': (page[-1][2], page[-1][3])})
+        (start_key, last_tie_breaker) = parse_next_token(token, ['temperature'])['temperature']
+
+
+@pytest.mark.parametrize('order_by', ['ASC', 'DESC'])
+@pytest.mark.parametrize('max_results', [1, 2, 3, 5])
+def test_pages_return_points_sharing_a_timestamp_once(database, order_by, max_results):
+    points = [('PT1', '2022-01-01T00:00:0{}'.format(second), value, None)
+              for second in range(1, 4) for value in [1.0, 2.0, 3.0, 4.0]]
+    # string points have no PT_VALUE, only their PT_VALUE_STR tells them apart
+    points += [('PT1', '2022-01-01T00:00:05', None, value) for value in ['a', 'b', 'c']]
+    points += [('PT2', '2022-01-01T00:00:01', 1.0, None)]
+    database.executemany('insert into POINTS values (?, ?, ?, ?)', points)
+
+    rows = page_through_points(database, order_by, max_results)
+
+    assert sorted((row[2], str(row[1])) for row in rows) == \
+        sorted((point[1], str(point[3] or point[2])) for point in points if point[0] == 'PT1')
+
+
+def test_event_time_predicate_without_token():
+    assert data_reader_by_component_type.generate_event_time_predicate(START_TIME, END_TIME, '<=', 'ASC', None) == \
+        ('EVENT_TIME > ? AND EVENT_TIME <= ?', [START_TIME, END_TIME])
+
+
+def test_event_time_predicate_of_alarm_id_token():
+    # tokens written before the status hash only hold the ALARM_ID
+    last_tie_breaker = data_reader_by_component_type.parse_tie_breaker('alarm-1')
+
+    assert data_reader_by_component_type.generate_event_time_predicate(
+        START_TIME, END_TIME, '<', 'DESC', last_tie_breaker) == \
+        ('EVENT_TIME > ? AND (EVENT_TIME < ? OR (EVENT_TIME = ? AND ALARM_ID < ?))',
+         [START_TIME, END_TIME, END_TIME, 'alarm-1'])
+
+
+def page_through_alarms(database, order_by, max_results, alarm_id=None):
+    """
+    Read every page of the alarm events the way DataReaderByComponentType does, with the next token of each page
+    """
+    tie_breaker = data_reader_by_component_type.ALARM_TIE_BREAKER_EXPRESSION
+    (start_time, end_time, operator) = (START_TIME, END_TIME, '<=')
+    last_tie_breaker = None
+    rows = []
+    while True:
+        (predicate, parameters) = data_reader_by_component_type.generate_event_time_predicate(
+            start_time, end_time, operator, order_by, data_reader_by_component_type.parse_tie_breaker(last_tie_breaker))
+        alarm_predicate = 'ALARM_ID = ? and ' if alarm_id else ''
+        page = database.execute(
+            'select ALARM_ID, EVENT_TIME, STATUS, {} from ALARMS where {}{} '
+            'order by EVENT_TIME {}, ALARM_ID {}, {} {} limit ?'.format(tie_breaker, alarm_predicate, predicate,
+                                                                       order_by, order_by, tie_breaker, order_by),
+            ([alarm_id] if alarm_id else []) + parameters + [max_results]).fetchall()
+        rows.extend(page)
+        if len(page) < max_results:
+            return rows
+        token = generate_next_token({'alarm_status': (page[-1][1], [page[-1][0], page[-1][3]])})
+        (last_time, last_tie_breaker) = parse_next_token(token, ['alarm_status'])['alarm_status']
+        if order_by == 'ASC':
+            start_time = last_time
+        else:
+            (end_time, operator) = (last_time, '<')
+
+
+@pytest.mark.parametrize('order_by', ['ASC', 'DESC'])
+@pytest.mark.parametrize('max_results', [1, 2, 3])
+@pytest.mark.parametrize('alarm_id', [None, 'alarm-1'])
+def test_pages_return_alarm_events_sharing_an_event_time_once(database, order_by, max_results, alarm_id):
+    # the events of one alarm at the same EVENT_TIME only differ by their status
+    events = [(alarm, '2022-01-01T00:00:0{}'.format(second), status)
+              for alarm in ['alarm-1', 'alarm-2'] for second in range(1, 4) for status in ['ACTIVE', 'NORMAL', 'ACKED']]
+    database.executemany('insert into ALARMS values (?, ?, ?)', events)
+
+    rows = page_through_alarms(database, order_by, max_results, alarm_id)
+
+    assert sorted(row[0:3] for row in rows) == sorted(event for event in events if alarm_id in (None, event[0]))
+
+
+def alarm_request(alarm_id, status_filter):
+    return {
+        'workspaceId': 'workspace',
+        'startTime': START_TIME,
+        'endTime': END_TIME,
+        'selectedProperties': ['alarm_status'],
+        'maxResults': 10,
+        'properties': {'alarm_key': {'value': {'stringValue': alarm_id}}},
+        'propertyFilters': [{'propertyName': 'alarm_status', 'operator': '=', 'value': {'stringValue': status_filter}}]
+    }
+
+
+def test_status_filter_keeps_the_alarm_id_filter(monkeypatch):
+    queries = []
+
+    def query_alarm_values(query_string, query_params):
+        queries.append((query_string, query_params))
+        return ([], 0, None)
+    monkeypatch.setattr(data_reader_by_component_type, 'query_alarm_values', query_alarm_values)
+
+    data_reader_by_component_type.lambda_handler(alarm_request('alarm-1', 'ACTIVE'), None)
+
+    [(query_string, query_params)] = queries
+    assert 'ALARM_ID=? AND EVENT_TIME > ? AND EVENT_TIME <= ?' in query_string
+    assert query_string.count('?') == len(query_params)
+    assert query_params[:5] == ['alarm_status', 'TEST_ALARMS', 'alarm-1', START_TIME, END_TIME]
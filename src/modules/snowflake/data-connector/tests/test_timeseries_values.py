@@ -0,0 +1,56 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+import data_reader_by_entity
+from utils.timeseries_batch import TimeSeriesBatch, read_value
+
+
+@pytest.mark.parametrize('value_type,values', [
+    ('doubleValue', [1.5, -2.0]),
+    ('intValue', [1, 2]),
+    ('stringValue', ['open', '']),
+    ('booleanValue', [True, False])
+])
+def test_written_values_are_read_back(value_type, values):
+    batch = TimeSeriesBatch()
+    batch.append_entry('entry', 'PT1', 'time', 'value',
+                       [{'time': '2022-01-01T00:00:0{}'.format(index), 'value': {value_type: value}}
+                        for (index, value) in enumerate(values)])
+
+    assert [read_value(value_type, value, value_str) for (value, value_str) in batch.rows(['PT_VALUE',
+                                                                                         'PT_VALUE_STR'])] == values
+
+
+def test_mixed_values_are_read_back():
+    values = [{'stringValue': 'open'}, {'booleanValue': True}, {'doubleValue': 3.0}]
+    batch = TimeSeriesBatch()
+    batch.append_entry('entry', 'PT1', 'time', 'value',
+                       [{'time': '2022-01-01T00:00:0{}'.format(index), 'value': value}
+                        for (index, value) in enumerate(values)])
+
+    rows = list(batch.rows(['PT_VALUE', 'PT_VALUE_STR']))
+    assert [read_value(value_type, *row) for (value_type, row) in zip(['stringValue', 'booleanValue', 'doubleValue'],
+                                                                      rows)] == ['open', True, 3.0]
+
+
+def test_boolean_without_string_column_is_read_from_its_number():
+    assert read_value('booleanValue', 1.0, None) is True
+    assert read_value('booleanValue', 0.0, None) is False
+    assert read_value('booleanValue', None, None) is None
+
+
+@pytest.mark.parametrize('aggregation,value,expected', [
+    (('AVG', 60), 1, ('doubleValue', 1.0)),
+    (('MAX', 60), 2.5, ('doubleValue', 2.5)),
+    (('COUNT', 60), 3, ('longValue', 3))
+])
+def test_aggregated_values_are_numbers(aggregation, value, expected):
+    assert data_reader_by_entity.read_aggregated_value(aggregation, value) == expected
+
+
+@pytest.mark.parametrize('value_type', ['stringValue', 'booleanValue'])
+def test_aggregation_rejects_non_numeric_properties(value_type):
+    with pytest.raises(ValueError):
+        data_reader_by_entity.validate_aggregated_properties([('status', 'PT1', value_type, None, None)])
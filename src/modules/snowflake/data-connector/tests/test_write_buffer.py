@@ -0,0 +1,46 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+
+import pytest
+
+from utils import write_buffer
+from utils.write_buffer import SqsWriteBuffer
+
+
+class FakeSqsClient:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.receive_requests = []
+
+    def receive_message(self, **kwargs):
+        self.receive_requests.append(kwargs)
+        return self.responses.pop(0) if self.responses else {}
+
+
+def sqs_message(index):
+    return {'ReceiptHandle': str(index), 'Body': json.dumps({'index': index}),
+            'Attributes': {'SentTimestamp': '1640995200000'}}
+
+
+def test_receive_long_polls_until_a_receive_is_empty():
+    client = FakeSqsClient([{'Messages': [sqs_message(index) for index in range(10)]},
+                            {'Messages': [sqs_message(10)]}])
+    buffer = SqsWriteBuffer('https://sqs.us-east-1.amazonaws.com/123456789012/write-buffer',
+                            client_factory=lambda: client)
+
+    messages = buffer.receive(100)
+
+    assert [message.body['index'] for message in messages] == list(range(11))
+    assert messages[0].sent_at == 1640995200
+    assert len(client.receive_requests) == 3
+    assert all(request['WaitTimeSeconds'] == write_buffer.WRITE_BUFFER_RECEIVE_WAIT_SECONDS
+               for request in client.receive_requests)
+
+
+def test_buffer_requires_a_queue(monkeypatch):
+    monkeypatch.setattr(write_buffer, 'WRITE_BUFFER_QUEUE_URL', None)
+
+    with pytest.raises(ValueError):
+        write_buffer.create_write_buffer()
@@ -8,6 +8,8 @@ import os
 import re
 import time
 
+from secret_cache import SecretCache
+
 ## Parameter columns on interest.
 ATTR_NAME_COL=9
 ATTR_VALUE_COL=10
@@ -104,10 +106,11 @@ def all_results( api_name, params, response_key, initial_seed=200):
     return results
 
 
+## Secrets are cached across invocations of a warm container, see secret_cache.py
+SNOWFLAKE_SECRET_CACHE = SecretCache(client_factory=lambda: boto3_session().client("secretsmanager"))
+
 def get_snowflake_credentials(secrets):
-    sm = boto3_session().client("secretsmanager")
-    secret = sm.get_secret_value( SecretId=secrets)
-    creds = json.loads(secret['SecretString'])
+    creds = SNOWFLAKE_SECRET_CACHE.get_secret(secrets)
     return creds
 
 